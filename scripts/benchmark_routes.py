@@ -0,0 +1,82 @@
+"""
+Load test of the read only trading routes, reports latency percentiles.
+
+Run it against the same deployment before and after a change, e.g.
+    python -m scripts.benchmark_routes --base-url http://localhost:8000 --trader-ids 4040 4041 --concurrency 64
+
+Only /trades/positions/ and /trades/profit-loss/ are called, the routes that open or close
+positions submit real signals and are left out.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+
+def percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+async def call(client: httpx.AsyncClient, args) -> tuple:
+    trader_id = random.choice(args.trader_ids)
+    started = time.perf_counter()
+    if args.trade_pair and random.random() < args.profit_loss_ratio:
+        name = "profit-loss"
+        response = await client.post("/trades/profit-loss/", json={
+            "trader_id": trader_id, "trade_pair": args.trade_pair, "asset_type": args.asset_type,
+        })
+    else:
+        name = "positions"
+        response = await client.get(f"/trades/positions/{trader_id}", params={"status": "OPEN"})
+    return name, response.status_code, time.perf_counter() - started
+
+
+async def worker(client, args, deadline, results):
+    while time.perf_counter() < deadline:
+        try:
+            results.append(await call(client, args))
+        except httpx.HTTPError as e:
+            results.append(("error", type(e).__name__, 0.0))
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        results = []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(worker(client, args, deadline, results) for _ in range(args.concurrency)))
+
+    print(f"{len(results)} requests in {args.duration}s with {args.concurrency} clients, "
+          f"{len(results) / args.duration:.1f} req/s")
+    for name in sorted({name for name, *_ in results}):
+        latencies = [latency * 1000 for n, status, latency in results if n == name]
+        statuses = {}
+        for n, status, _ in results:
+            if n == name:
+                statuses[status] = statuses.get(status, 0) + 1
+        print(f"{name:12} n={len(latencies):6} mean={statistics.fmean(latencies):8.1f}ms "
+              f"p50={percentile(latencies, 50):8.1f}ms p95={percentile(latencies, 95):8.1f}ms "
+              f"p99={percentile(latencies, 99):8.1f}ms max={max(latencies):8.1f}ms statuses={statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--trader-ids", type=int, nargs="+", required=True)
+    parser.add_argument("--trade-pair", default="", help="also call /trades/profit-loss/ for this trade pair")
+    parser.add_argument("--asset-type", default="crypto")
+    parser.add_argument("--profit-loss-ratio", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Microbenchmark of the Polygon tick parsing in WebSocketManager, ticks/sec before and after.
+
+    python -m scripts.benchmark_tick_parsing --frames frames.jsonl --asset-type crypto
+
+`--frames` is a file of raw Polygon frames, one per line as received from the socket, without
+it synthetic frames in the Polygon format are used. Redis is not involved, both paths encode
+every tick once as the old one did before its HSET, so only the parsing work is compared.
+"""
+import argparse
+import json
+import random
+import time
+from unittest.mock import patch
+
+from src.utils import websocket_manager as module
+from src.utils.websocket_manager import CryptoWebSocketManager, ForexWebSocketManager, StocksWebSocketManager
+
+MANAGERS = {
+    "crypto": CryptoWebSocketManager,
+    "forex": ForexWebSocketManager,
+    "stocks": StocksWebSocketManager,
+}
+
+
+def synthetic_frames(asset_type: str, count: int, ticks_per_frame=10) -> list:
+    frames = []
+    for _ in range(count):
+        items = []
+        for _ in range(ticks_per_frame):
+            price = random.uniform(1, 100000)
+            t = int(time.time() * 1000)
+            if asset_type == "crypto":
+                items.append({"ev": "XQ", "pair": random.choice(["BTC-USD", "ETH-USD", "SOL-USD"]), "lp": 0, "ls": 0,
+                              "bp": price, "bs": 0.5, "ap": price + 1, "as": 0.7, "t": t, "x": 1, "r": t})
+            elif asset_type == "forex":
+                items.append({"ev": "C", "p": random.choice(["EUR/USD", "GBP/USD", "USD/JPY"]), "x": 48,
+                              "a": price + 0.0001, "b": price, "t": t})
+            else:
+                items.append({"ev": "Q", "sym": random.choice(["AAPL", "MSFT", "NVDA"]), "bx": 4, "bp": price,
+                              "bs": 100, "ax": 7, "ap": price + 0.01, "as": 160, "c": 0, "i": [604], "t": t,
+                              "q": 50385480, "z": 3})
+        frames.append(json.dumps(items))
+    return frames
+
+
+def legacy_handle(manager, message):
+    """
+    the parsing of receive_and_log before the lean ingest path
+    """
+    data = json.loads(message)
+    for item in data:
+        if item.get("ev") not in ["CAS", "XAS", "A", "XQ", "C", "Q"]:
+            continue
+        trade_pair = item.pop(manager.pair_key, None) or item.pop(manager.alt_pair_key, None)
+        ev_type = item.pop("ev", None)
+        trade_pair = trade_pair.translate(str.maketrans('', '', '-/'))
+        if not 'A' in ev_type:
+            if manager.alt_pair_key == 'p':
+                item["bp"] = item.get("b")
+                item["ap"] = item.get("a")
+        json.dumps(item)
+
+
+class EncodingWriter:
+    def put(self, hash_name, key, value, source):
+        json.dumps(value)
+
+
+def measure(name, handle, frames, ticks, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for frame in frames:
+            handle(frame)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:8} {ticks / best:12,.0f} ticks/sec")
+    return ticks / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", help="file with one raw polygon frame per line")
+    parser.add_argument("--asset-type", choices=sorted(MANAGERS), default="crypto")
+    parser.add_argument("--count", type=int, default=20000, help="synthetic frames")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.frames:
+        with open(args.frames) as f:
+            frames = [line.strip() for line in f if line.strip()]
+    else:
+        frames = synthetic_frames(args.asset_type, args.count)
+    ticks = sum(len(json.loads(frame)) for frame in frames)
+    manager = MANAGERS[args.asset_type]()
+    print(f"{len(frames)} frames, {ticks} ticks, decoder {module.loads.__module__}")
+
+    with patch.object(module.trigger_dispatcher, "on_quote", lambda *args: None), \
+            patch.object(module, "quote_writer", EncodingWriter()):
+        before = measure("before", lambda frame: legacy_handle(manager, frame), frames, ticks, args.repeat)
+        after = measure("after", manager.handle_message, frames, ticks, args.repeat)
+    print(f"speedup  {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Bytes and encode CPU of the /ws/delta messages in the json and compact encodings.
+
+    python -m scripts.benchmark_ws_encoding --clients 1000 10000 --rounds 20
+
+Every round changes the quotes of `--changes` trade pairs and the profit and loss of
+`--position-changes` positions, the frame goes through ConnectionManager.receive as the pub/sub
+loop does and is delivered to simulated sockets that only count bytes. `--all-ratio` of the clients
+get everything, the others subscribe to a few trade pairs and one trader. "bytes/s" is what the
+worker writes to its sockets per second at one frame every `--interval` seconds, "encode" the CPU
+time spent building the messages per frame. Redis is not involved.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+from src.api.routes.websocket import ALL_TOPIC, ConnectionManager, positions_topic, price_topic
+from src.services.delta_leader import DeltaLeader
+from src.utils.constants import POSITIONS_TABLE, REDIS_LIVE_PRICES_TABLE, REDIS_LIVE_QUOTES_TABLE
+from src.utils.delta_encoding import ENCODINGS, PAIRS
+
+
+class CountingSocket:
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.bytes += len(message.encode())
+        self.messages += 1
+
+    async def send_bytes(self, message: bytes):
+        self.bytes += len(message)
+        self.messages += 1
+
+    async def close(self):
+        pass
+
+
+def quote(now: int) -> dict:
+    price = random.uniform(0.5, 60000)
+    # the fields of a Polygon crypto quote, as the websocket manager stores them
+    return {"x": 1, "bp": round(price, 5), "bs": round(random.uniform(0, 10), 8), "ap": round(price * 1.0002, 5),
+            "as": round(random.uniform(0, 10), 8), "t": now, "r": now + random.randint(1, 50)}
+
+
+def leader(traders: list) -> DeltaLeader:
+    now = int(time.time() * 1000)
+    leader = DeltaLeader()
+    for trade_pair in PAIRS:
+        price = random.uniform(0.5, 60000)
+        leader.books[REDIS_LIVE_PRICES_TABLE][trade_pair] = {
+            "o": price, "h": price * 1.01, "l": price * 0.99, "c": price, "v": random.uniform(0, 1e6),
+            "vw": price, "s": now - 60000, "e": now,
+        }
+        leader.books[REDIS_LIVE_QUOTES_TABLE][trade_pair] = quote(now)
+    for trader_id in traders:
+        for trade_pair in random.sample(PAIRS, 3):
+            entry = random.uniform(0.5, 60000)
+            leader.books[POSITIONS_TABLE][f"{trade_pair}-{trader_id}"] = [
+                str(datetime.now()), entry, 0.0, 0.0, 0, 0, "uuid", "hotkey", 1, entry, False,
+            ]
+    return leader
+
+
+def changes(leader: DeltaLeader, args) -> dict:
+    now = int(time.time() * 1000)
+    positions = {}
+    for key in random.sample(list(leader.books[POSITIONS_TABLE]), args.position_changes):
+        value = list(leader.books[POSITIONS_TABLE][key])
+        value[2] = round(random.uniform(-5, 5), 6)
+        value[3] = round(value[2] + 0.0345, 6)
+        value[0] = str(datetime.now())
+        positions[key] = value
+    return {"set": {
+        REDIS_LIVE_QUOTES_TABLE: {trade_pair: quote(now) for trade_pair in random.sample(PAIRS, args.changes)},
+        POSITIONS_TABLE: positions,
+    }, "delete": {}}
+
+
+async def drain(manager: ConnectionManager):
+    while any(client.stale or client.queue for client in manager.clients.values()):
+        await asyncio.sleep(0.001)
+
+
+def frame(leader: DeltaLeader, kind: str, data: dict) -> dict:
+    leader.seq += 1
+    return {"leader": leader.owner, "seq": leader.seq, "type": kind, **data}
+
+
+async def measure(clients: int, encoding: str, args) -> dict:
+    random.seed(args.seed)
+    traders = list(range(1000, 1000 + args.traders))
+    source = leader(traders)
+    manager = ConnectionManager()
+    sockets = [CountingSocket() for _ in range(clients)]
+    with patch.object(manager, "run", AsyncMock()):
+        for socket in sockets:
+            await manager.connect(socket, encoding)
+    for socket in sockets[int(clients * args.all_ratio):]:
+        manager.unsubscribe(socket, [ALL_TOPIC])
+        manager.subscribe(socket, [price_topic(trade_pair) for trade_pair in random.sample(PAIRS, 3)]
+                          + [positions_topic(random.choice(traders))])
+    manager.receive(frame(source, "snapshot", source.snapshot()))
+    manager.admit()
+    await drain(manager)
+    for socket in sockets:
+        socket.bytes = socket.messages = 0
+
+    encode, cpu = manager.encode, []
+
+    def timed(*args):
+        started = time.process_time()
+        try:
+            return encode(*args)
+        finally:
+            cpu[-1] += time.process_time() - started
+
+    with patch.object(manager, "encode", timed):
+        for _ in range(args.rounds):
+            source.apply(changes(source, args))
+            cpu.append(0.0)
+            manager.receive(frame(source, "delta", source.delta()))
+            await drain(manager)
+    tasks = [client.task for client in manager.clients.values()]
+    for socket in sockets:
+        manager.disconnect(socket)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    sent = sum(socket.bytes for socket in sockets)
+    return {
+        "bytes_per_second": sent / args.rounds / args.interval,
+        "bytes_per_message": sent / max(1, sum(socket.messages for socket in sockets)),
+        "encode_ms": sum(cpu) / len(cpu) * 1000,
+    }
+
+
+async def run(args):
+    print(f"{args.rounds} frames of {args.changes} quotes and {args.position_changes} positions every "
+          f"{args.interval}s, {args.traders} traders, {args.all_ratio:.0%} of the clients get everything")
+    for clients in args.clients:
+        results = {encoding: await measure(clients, encoding, args) for encoding in ENCODINGS}
+        for encoding, result in results.items():
+            print(f"{clients:6} clients {encoding:8} {result['bytes_per_second'] / 1e6:9.2f} MB/s "
+                  f"{result['bytes_per_message']:9.0f} bytes/message  encode {result['encode_ms']:7.2f}ms/frame")
+        if "compact" in results:
+            print(f"{'':15}compact/json bytes {results['compact']['bytes_per_second'] / results['json']['bytes_per_second']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--all-ratio", type=float, default=0.2)
+    parser.add_argument("--traders", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.25)
+    parser.add_argument("--changes", type=int, default=20, help="trade pairs changed per frame")
+    parser.add_argument("--position-changes", type=int, default=200, help="positions changed per frame")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Fan-out benchmark of the /ws/delta broadcaster with thousands of simulated websocket clients.
+
+    python -m scripts.benchmark_ws_fan_out --clients 2000 --slow-ratio 0.05 --rounds 10
+
+Every round a batch of quote changes goes through DeltaLeader.apply and delta and the frame
+through ConnectionManager.receive, as the pub/sub loops do, and is delivered to clients whose send_text takes `--latency` seconds,
+or `--slow-latency` for the slow ones. "before" sends each message to the clients one after
+the other like the old broadcast, "after" hands it to the per connection queues. Redis is
+not involved.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from unittest.mock import AsyncMock, patch
+
+from src.api.routes.websocket import ConnectionManager
+from src.services.delta_leader import DeltaLeader
+from src.utils.constants import REDIS_LIVE_PRICES_TABLE, REDIS_LIVE_QUOTES_TABLE
+
+
+def percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+class SimulatedSocket:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lags = []
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        message = json.loads(message)
+        if message["type"] == "prices_update":
+            self.lags.append(time.perf_counter() - max(quote["t"] for quote in message["data"].values()))
+
+    async def close(self):
+        pass
+
+
+def quote_changes(trade_pairs: list, count: int) -> dict:
+    now = time.perf_counter()
+    return {"set": {REDIS_LIVE_QUOTES_TABLE: {
+        trade_pair: {"bp": random.random(), "ap": random.random(), "t": now}
+        for trade_pair in random.sample(trade_pairs, count)
+    }}, "delete": {}}
+
+
+def frame(leader: DeltaLeader, kind: str, data: dict) -> dict:
+    leader.seq += 1
+    return {"leader": leader.owner, "seq": leader.seq, "type": kind, **data}
+
+
+async def legacy(leader: DeltaLeader, sockets: list, args, trade_pairs: list) -> list:
+    """
+    the sequential broadcast, every send awaited in turn by the broadcaster
+    """
+    durations = []
+    for _ in range(args.rounds):
+        leader.apply(quote_changes(trade_pairs, args.changes))
+        started = time.perf_counter()
+        message = json.dumps({"type": "prices_update", "data": leader.delta()["prices"]})
+        for socket in sockets:
+            await socket.send_text(message)
+        durations.append(time.perf_counter() - started)
+        await asyncio.sleep(max(0.0, args.interval - durations[-1]))
+    return durations
+
+
+async def queued(leader: DeltaLeader, manager: ConnectionManager, sockets: list, args, trade_pairs: list) -> list:
+    with patch.object(manager, "run", AsyncMock()):
+        for socket in sockets:
+            await manager.connect(socket)
+    for client in manager.clients.values():
+        client.max_queue = args.queue_size
+    manager.receive(frame(leader, "snapshot", leader.snapshot()))
+    manager.admit()
+    # the join snapshots go out before the first change
+    await asyncio.sleep(args.interval)
+    durations = []
+    for _ in range(args.rounds):
+        leader.apply(quote_changes(trade_pairs, args.changes))
+        started = time.perf_counter()
+        manager.receive(frame(leader, "delta", leader.delta()))
+        durations.append(time.perf_counter() - started)
+        await asyncio.sleep(args.interval)
+    # let the queues drain before reading the counters
+    await asyncio.sleep(args.slow_latency * (args.queue_size + 2))
+    return durations
+
+
+def report(name: str, durations: list, sockets: list, manager: ConnectionManager = None):
+    fast = [lag for socket in sockets if socket.latency == sockets[0].latency for lag in socket.lags]
+    slow = [lag for socket in sockets if socket.latency != sockets[0].latency for lag in socket.lags]
+    print(f"{name:7} broadcaster per round p50={percentile(durations, 50) * 1000:9.1f}ms "
+          f"max={max(durations) * 1000:9.1f}ms | fast clients lag p50={percentile(fast, 50) * 1000:9.1f}ms "
+          f"p99={percentile(fast, 99) * 1000:9.1f}ms | slow clients lag p50={percentile(slow, 50) * 1000:9.1f}ms "
+          f"| delivered {sum(socket.received for socket in sockets)}")
+    if manager:
+        stats = manager.stats()["clients"]
+        print(f"{'':7} dropped {sum(s['dropped'] for s in stats)}, resyncs {sum(s['resyncs'] for s in stats)}, "
+              f"max lag {max(s['max_lag'] for s in stats) * 1000:.1f}ms, "
+              f"mean sent {statistics.fmean(s['sent'] for s in stats):.1f}")
+
+
+async def run(args):
+    trade_pairs = [f"PAIR{i}" for i in range(args.trade_pairs)]
+    slow = set(random.sample(range(args.clients), int(args.clients * args.slow_ratio)))
+
+    def sockets():
+        return [SimulatedSocket(args.slow_latency if i in slow else args.latency) for i in range(args.clients)]
+
+    def leader():
+        leader = DeltaLeader()
+        leader.books[REDIS_LIVE_PRICES_TABLE] = {trade_pair: {"c": 1.0} for trade_pair in trade_pairs}
+        return leader
+
+    print(f"{args.clients} clients ({len(slow)} slow), {args.rounds} rounds of {args.changes} changes "
+          f"every {args.interval}s")
+    before_sockets = sockets()
+    report("before", await legacy(leader(), before_sockets, args, trade_pairs), before_sockets)
+    after_sockets, after_manager = sockets(), ConnectionManager()
+    durations = await queued(leader(), after_manager, after_sockets, args, trade_pairs)
+    report("after", durations, after_sockets, after_manager)
+    for socket in after_sockets:
+        after_manager.disconnect(socket)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--slow-ratio", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.0002, help="seconds per send of a normal client")
+    parser.add_argument("--slow-latency", type=float, default=0.1, help="seconds per send of a slow client")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.25)
+    parser.add_argument("--trade-pairs", type=int, default=60)
+    parser.add_argument("--changes", type=int, default=20, help="trade pairs changed per round")
+    parser.add_argument("--queue-size", type=int, default=16)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from src.services.trade_service import (
     update_transaction_async,
     get_open_or_adjusted_position,
 )
+from src.services.trigger_service import publish_position_triggers
 from src.utils.logging import setup_logging
 from src.utils.websocket_manager import websocket_manager
 from src.validations.position import validate_position, validate_leverage
@@ -89,6 +90,7 @@ async def adjust_position_endpoint(
                 adjust_time=datetime.now(),
             ),
         )
+        await publish_position_triggers(updated_transaction)
 
         return {
             "message": "Position adjusted successfully",
@@ -9,10 +9,11 @@ from src.services.trade_service import (
     get_latest_position,
     get_transaction_by_order_id,
 )
+from src.services.trigger_service import remove_position_triggers
 from src.utils.logging import setup_logging
 from src.utils.websocket_manager import websocket_manager
 from src.validations.position import validate_trade_pair, check_get_challenge
-from src.utils.redis_manager import (
+from src.utils.async_redis_manager import (
     get_live_quote_from_redis,
     get_profit_loss_from_redis,
     delete_hash_value,
@@ -61,10 +62,10 @@ async def close_position(
 
     else:
         status = Status.close_processing
-        profit_loss = get_profit_loss_from_redis(
+        profit_loss = await get_profit_loss_from_redis(
             position.trade_pair, position.trader_id
         )
-        close_price = get_live_quote_from_redis(
+        close_price = await get_live_quote_from_redis(
             position.trade_pair, position.order_type
         )
 
@@ -89,7 +90,7 @@ async def close_position(
                     status_code=500, detail="Failed to submit close signal"
                 )
 
-            delete_hash_value(f"{position.trade_pair}-{position.trader_id}")
+            await delete_hash_value(f"{position.trade_pair}-{position.trader_id}", publish=True)
             await db.commit()
 
         except Exception as e:
@@ -99,6 +100,7 @@ async def close_position(
             raise HTTPException(
                 status_code=500, detail=f"Failed to close position: {str(e)}"
             )
+    await remove_position_triggers(position)
     result = await get_transaction_by_order_id(db, position.order_id)
     if not result:
         raise HTTPException(
@@ -1,3 +1,4 @@
+import asyncio
 from typing import Optional, List
 
 from fastapi import APIRouter, Depends, HTTPException
@@ -9,8 +10,9 @@ from sqlalchemy.sql import and_ , or_
 from src.database import get_db
 from src.models.transaction import Transaction, Status
 from src.schemas.transaction import Transaction as TransactionSchema
-from src.services.api_service import call_main_net, testnet_websocket
-from src.services.user_service import get_challenge, get_hot_key
+from src.services.api_service import get_positions_index_async
+from src.services.trader_directory import trader_directory
+from src.services.user_service import get_challenge_async
 from src.utils.logging import setup_logging
 
 logger = setup_logging()
@@ -34,7 +36,7 @@ async def get_positions(
         logger.error("A status can only be open, pending and closed, processing , adjust_processing")
         raise HTTPException(status_code=400, detail="A status can only be open, pending, closed, processing , adjust_processing")
 
-    source = get_challenge(trader_id, source=True)
+    source = await get_challenge_async(db, trader_id, source=True)
 
     # Base query
     query = select(Transaction)
@@ -72,33 +74,33 @@ async def get_positions(
             position.fee = abs((position.profit_loss_without_fee or 0.0) - (position.profit_loss or 0.0))
         return positions
 
+    # testnet first, a hot key present in both snapshots is taken from the testnet one
     if source == "main":
-        data = call_main_net()
+        networks = [True]
     elif source == "test":
-        data = testnet_websocket()
+        networks = [False]
     else:
-        test_net = testnet_websocket()
-        data = call_main_net() | test_net
+        networks = [False, True]
+    if any(position.status == "OPEN" for position in positions):
+        indexes = [index for index in await asyncio.gather(*map(get_positions_index_async, networks)) if index]
+    else:
+        indexes = []
 
     for position in positions:
         position.fee = abs((position.profit_loss_without_fee or 0.0) - (position.profit_loss or 0.0))
-        if position.status != "OPEN":
+        if position.status != "OPEN" or not indexes:
             continue
 
-        hot_key = get_hot_key(position.trader_id)
-        content = data.get(hot_key)
-        if not content:
+        trader = await trader_directory.get_async(db, position.trader_id)
+        hot_key = trader.hot_key if trader else None
+        pos = next((p for p in (index.by_uuid.get((hot_key, position.uuid)) for index in indexes) if p), None)
+        if not pos:
             continue
 
-        for pos in content["positions"]:
-            if pos["position_uuid"] != position.uuid:
-                continue
-
-            price, taoshi_profit_loss, taoshi_profit_loss_without_fee = pos["orders"][-1]["price"], pos[
-                "return_at_close"], pos["current_return"]
-            position.profit_loss = (taoshi_profit_loss * 100) - 100
-            position.profit_loss_without_fee = (taoshi_profit_loss_without_fee * 100) - 100
-            position.fee = abs(position.profit_loss_without_fee - position.profit_loss)
-            break
+        price, taoshi_profit_loss, taoshi_profit_loss_without_fee = pos["orders"][-1]["price"], pos[
+            "return_at_close"], pos["current_return"]
+        position.profit_loss = (taoshi_profit_loss * 100) - 100
+        position.profit_loss_without_fee = (taoshi_profit_loss_without_fee * 100) - 100
+        position.fee = abs(position.profit_loss_without_fee - position.profit_loss)
 
     return positions
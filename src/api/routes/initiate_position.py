@@ -4,8 +4,9 @@ from src.database import get_db
 from src.schemas.transaction import TransactionCreate, TradeResponse ,Transaction
 from src.models.transaction import Status , OrderType
 from src.services.trade_service import create_transaction, get_non_closed_position
+from src.services.trigger_service import publish_position_triggers
 from src.utils.logging import setup_logging
-from src.utils.redis_manager import  get_bid_ask_price
+from src.utils.async_redis_manager import get_bid_ask_price, is_quote_stale
 from src.utils.websocket_manager import websocket_manager
 from src.validations.position import validate_position, validate_leverage, check_get_challenge
 
@@ -68,13 +69,17 @@ async def initiate_position(position_data: TransactionCreate, db: AsyncSession =
           
         else:
             status = Status.pending
-            quotes = get_bid_ask_price(position_data.trade_pair)
+            quotes = await get_bid_ask_price(position_data.trade_pair)
             #Case 1 : user provided entry price
             new_entry_price = position_data.entry_price 
             
             if not quotes.ap or not quotes.bp:
                 logger.error("Failed to fetch current price for the trade pair. Market Data not available")
                 raise HTTPException(status_code=500, detail="Failed to fetch current price for the trade pair,Market Data not available")
+
+            if await is_quote_stale(position_data.trade_pair):
+                logger.error(f"Quotes of {position_data.trade_pair} are stale, its price feed is down")
+                raise HTTPException(status_code=500, detail="Failed to fetch current price for the trade pair,Market Data is stale")
             
             first_price = quotes.ap if position_data.order_type == OrderType.sell else quotes.bp
             
@@ -109,7 +114,7 @@ async def initiate_position(position_data: TransactionCreate, db: AsyncSession =
                                                    limit_order=limit_order,
                                                    
                                                    )
-
+        await publish_position_triggers(new_transaction)
 
         logger.info(f"Position initiated successfully with entry price {first_price}")
         return new_transaction
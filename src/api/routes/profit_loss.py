@@ -3,7 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database import get_db
 from src.schemas.transaction import ProfitLossRequest
-from src.services.fee_service import get_taoshi_values
+from src.services.fee_service import get_taoshi_values_async
 from src.services.trade_service import get_open_or_adjusted_position
 from src.utils.logging import setup_logging
 from src.validations.position import validate_trade_pair
@@ -29,7 +29,8 @@ async def get_profit_loss(profit_loss_request: ProfitLossRequest, db: AsyncSessi
 
     try:
         # Calculate profit/loss based on the first price
-        current_price, profit_loss, profit_loss_without_fee, *extras = get_taoshi_values(
+        current_price, profit_loss, profit_loss_without_fee, *extras = await get_taoshi_values_async(
+            db,
             latest_position.trader_id,
             latest_position.trade_pair,
             position_uuid=latest_position.uuid,
@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 from src.database_tasks import get_sync_db
 from src.models.firebase_user import FirebaseUser
 from src.schemas.user import FirebaseUserRead, FirebaseUserCreate, FirebaseUserUpdate
+from src.services.trade_service import invalidate_user_hotkey_map
 from src.services.user_service import get_firebase_user, create_firebase_user, construct_username
 from src.utils.logging import setup_logging
 
@@ -51,6 +52,7 @@ def update_user(firebase_id: str, user_data: FirebaseUserUpdate, db: Session = D
         user.email = user_data.email
         user.username = construct_username(user_data.email)
     db.commit()
+    invalidate_user_hotkey_map()
     db.refresh(user)
     logger.info(f"User updated successfully with firebase_id={firebase_id}")
     return user
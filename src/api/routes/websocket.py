@@ -1,109 +1,477 @@
-import ast
 import asyncio
 import json
-from typing import List
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Set
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
 
-from src.utils.constants import POSITIONS_TABLE ,REDIS_LIVE_QUOTES_TABLE , STOP_LOSS_POSITIONS_TABLE
-from src.utils.redis_manager import get_hash_values
+from src.config import DELTA_BROADCAST_INTERVAL, DELTA_QUEUE_SIZE, DELTA_SEND_TIMEOUT
+from src.database import SessionLocal
+from src.services.delta_leader import DeltaLeader
+from src.services.user_service import get_user_by_email
+from src.utils.constants import DELTA_FRAMES_CHANNEL, DELTA_SNAPSHOT_REQUESTS
+from src.utils.async_redis_manager import async_redis_client
+from src.utils.delta_encoding import ENCODINGS, encode_prices, encode_positions
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# a client that has not subscribed to anything yet gets every price and position
+ALL_TOPIC = "*"
+
+
+def price_topic(trade_pair: str) -> str:
+    return f"prices:{trade_pair}"
+
+
+def positions_topic(trader_id) -> str:
+    return f"positions:{trader_id}"
+
+
+class ClientConnection:
+    """
+    Outbound side of a /ws/delta client, a bounded queue drained by its own writer task.
+
+    Queuing never waits on the client. When `max_queue` messages are already waiting the client
+    is too slow to follow the changes, the queued changes are dropped and the client is marked
+    stale: the next thing it gets is a snapshot of its topics built when it is sent, which covers
+    everything that was dropped, the changes until then are dropped as well. A send that takes
+    longer than `send_timeout` closes the connection.
+    Messages of the compact `encoding` are bytes and sent as binary frames.
+    """
+
+    def __init__(self, websocket: WebSocket, snapshots: Callable[[], list], on_close: Callable,
+                 max_queue=DELTA_QUEUE_SIZE, send_timeout=DELTA_SEND_TIMEOUT, encoding="json"):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.snapshots = snapshots
+        self.on_close = on_close
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.queue = deque()  # (message, queued at)
+        self.stale = False
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.closed = False
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, message, replaceable=True):
+        """
+        queue a message, `replaceable` ones are changes that a snapshot makes obsolete
+        """
+        if replaceable and self.stale:
+            self.dropped += 1
+            return
+        if len(self.queue) >= self.max_queue:
+            self.dropped += len(self.queue) + replaceable
+            self.queue.clear()
+            self.resync()
+            if replaceable:
+                return
+        self.queue.append((message, time.monotonic()))
+        self.ready.set()
+
+    def resync(self):
+        """
+        send a snapshot of the topics of the client before anything else
+        """
+        self.stale = True
+        self.ready.set()
+
+    async def send(self, message, queued_at: float):
+        send = self.websocket.send_bytes if isinstance(message, bytes) else self.websocket.send_text
+        await asyncio.wait_for(send(message), self.send_timeout)
+        self.sent += 1
+        self.lag = time.monotonic() - queued_at
+        self.max_lag = max(self.max_lag, self.lag)
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while (self.stale or self.queue) and not self.closed:
+                    if self.stale:
+                        self.stale = False
+                        self.resyncs += 1
+                        now = time.monotonic()
+                        for message in self.snapshots():
+                            await self.send(message, now)
+                    else:
+                        await self.send(*self.queue.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Closing a /ws/delta client that failed to receive: {e!r}")
+            try:
+                await self.websocket.close()
+            except Exception:
+                pass
+            self.on_close(self.websocket)
+
+    def close(self):
+        # wait_for may swallow the cancel when a send completes at the same time, the flag ends the loop then
+        self.closed = True
+        self.ready.set()
+        self.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "encoding": self.encoding,
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "lag": round(self.lag, 4),
+            "max_lag": round(self.max_lag, 4),
+        }
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.broadcast_tasks = []
+    """
+    Pushes the live prices and positions to the /ws/delta clients of this worker.
 
-    async def connect(self, websocket: WebSocket):
+    The frames are built once for all the workers by the DeltaLeader holding the leader lock,
+    every worker contends for it while it has clients. The manager keeps the prices and positions
+    of the frames and sends the trade pairs and positions of every "delta" frame as one
+    "prices_update" and one "positions_update" message. A closed and removed position is sent as null.
+    A client gets the full "prices" and "positions" snapshots when it joins, they are only rebuilt
+    after a change. When a frame was missed a "snapshot" frame is requested and every client gets
+    fresh snapshots, otherwise the differences of a snapshot frame are sent as changes.
+
+    A client can narrow what it gets to some trade pairs and the positions of some traders, see
+    `handle`. The changes are only sent to the clients subscribed to them, through the index from
+    topic to sockets, and serialized once per distinct selection.
+
+    Messages are handed to the ClientConnection of every socket, a slow client only delays itself.
+    A client connecting with ?encoding=compact gets the price and position messages in the binary
+    format of delta_encoding, the other messages stay JSON.
+    """
+
+    def __init__(self, interval=DELTA_BROADCAST_INTERVAL, leader: DeltaLeader = None):
+        self.interval = interval
+        self.leader = leader or DeltaLeader(interval=interval)
+        self.active_connections: Set[WebSocket] = set()
+        self.joining: Set[WebSocket] = set()
+        self.topics: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.subscriptions: Dict[WebSocket, Set[str]] = {}
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.broadcast_task = None
+        self.prices = {}  # trade_pair -> price and quote
+        self.positions = {}  # trader_id -> {trade_pair: position}
+        self.synced = False
+        self.last_frame = (None, 0)  # leader, seq
+        self.snapshots = {}
+
+    async def connect(self, websocket: WebSocket, encoding="json"):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        if len(self.active_connections) == 1:
-            # Start broadcasting when the first client connects
-            self.broadcast_tasks.append(asyncio.create_task(self.broadcast_prices()))
-            self.broadcast_tasks.append(asyncio.create_task(self.broadcast_positions()))
+        client = ClientConnection(
+            websocket, lambda: self.topic_snapshots(self.subscriptions.get(websocket, ()), client.encoding),
+            self.forget, encoding=encoding if encoding in ENCODINGS else "json",
+        )
+        self.clients[websocket] = client
+        if client.encoding != encoding:
+            client.put(json.dumps({"type": "error", "detail": f"Unsupported encoding {encoding}, using json"}),
+                       replaceable=False)
+        # the snapshots are requested by the broadcast task once the prices and positions are known
+        self.joining.add(websocket)
+        self.subscribe(websocket, [ALL_TOPIC])
+        if self.broadcast_task is None or self.broadcast_task.done():
+            self.broadcast_task = asyncio.create_task(self.run())
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        if not self.active_connections and self.broadcast_tasks:
+        self.forget(websocket)
+        if not self.active_connections and not self.joining and self.broadcast_task:
             # Stop broadcasting when the last client disconnects
-            for task in self.broadcast_tasks:
-                task.cancel()
-            self.broadcast_tasks = []
+            self.broadcast_task.cancel()
+            self.broadcast_task = None
 
-    async def broadcast(self, message: dict):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception:
-                disconnected.append(connection)
+    def forget(self, websocket: WebSocket):
+        self.active_connections.discard(websocket)
+        self.joining.discard(websocket)
+        self.unsubscribe(websocket, list(self.subscriptions.get(websocket, ())))
+        self.subscriptions.pop(websocket, None)
+        client = self.clients.pop(websocket, None)
+        if client:
+            client.close()
 
-        # Remove disconnected clients
-        for conn in disconnected:
-            self.active_connections.remove(conn)
+    def subscribe(self, websocket: WebSocket, topics) -> list:
+        """
+        add the topics to the subscriptions of the socket, returns the new ones
+        """
+        subscriptions = self.subscriptions.setdefault(websocket, set())
+        added = [topic for topic in topics if topic not in subscriptions]
+        for topic in added:
+            subscriptions.add(topic)
+            self.topics[topic].add(websocket)
+        return added
 
-    async def broadcast_prices(self):
-        while True:
-            if not self.active_connections:
-                # No active connections, stop broadcasting
-                break
-            try:
-                current_prices = get_hash_values() or {}
-                current_quotes = get_hash_values( REDIS_LIVE_QUOTES_TABLE)
-                # Parse both JSON strings and merge
-                prices_dict = {
-                        k: {
-                            **json.loads(v), 
-                            **json.loads(current_quotes.get(k, '{}'))
-                        } for k, v in current_prices.items()
-                    }
-                    
-                await self.broadcast(json.dumps({"type": "prices", "data": prices_dict}))
-            except Exception as e:
-                print(f"Error fetching prices: {e}")
-            await asyncio.sleep(1)
-
-    async def broadcast_positions(self):
-        while True:
-            if not self.active_connections:\
-                # No active connections, stop broadcasting
-                break
-            try:
-                positions = get_hash_values(POSITIONS_TABLE)
-                positions_with_stop_loss = get_hash_values(STOP_LOSS_POSITIONS_TABLE)
-                positions_dict = {}
-                for key, value in positions.items():
-                    value = value.strip('"')  # Remove outer quotes
-                    value = json.loads(value)  # Parse the JSON string
-                    
-
-                    trade_pair, trader_id = key.split("-")
-                    if trader_id not in positions_dict:
-                        positions_dict[trader_id] = {}
-                    positions_dict[trader_id][trade_pair] = {
-                        "time": value[0],
-                        "entry_price": value[1],
-                        "profit_loss": value[2],
-                        "profit_loss_without_fee": value[3],
-                        "is_closed" : value[-1],
-                        "stop_loss" : json.loads(positions_with_stop_loss.get(key, "0"))
-                    }
-                await self.broadcast(json.dumps({"type": "positions", "data": positions_dict}))
-            except Exception as e:
-                print(f"Error fetching positions: {e}")
-            await asyncio.sleep(1)
+    def unsubscribe(self, websocket: WebSocket, topics):
+        subscriptions = self.subscriptions.get(websocket, set())
+        for topic in topics:
+            subscriptions.discard(topic)
+            sockets = self.topics.get(topic)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.topics[topic]
+
+    async def resolve_topics(self, request: dict) -> list:
+        """
+        the topics of a subscribe or unsubscribe request, the favorite trade pairs of a user
+        are looked up by email like the favorites API does
+        """
+        topics = [ALL_TOPIC] if request.get("all") else []
+        topics += [price_topic(trade_pair) for trade_pair in request.get("trade_pairs", [])]
+        topics += [positions_topic(int(trader_id)) for trader_id in request.get("trader_ids", [])]
+        if request.get("favorites"):
+            async with SessionLocal() as db:
+                user = await get_user_by_email(db, request["favorites"])
+            topics += [price_topic(trade_pair) for trade_pair in user.favorite_trade_pairs or []]
+        return topics
+
+    async def handle(self, websocket: WebSocket, text: str):
+        """
+        handle a message of a client, e.g.
+            {"action": "subscribe", "trade_pairs": ["BTCUSD"], "trader_ids": [4040], "favorites": "user@mail"}
+            {"action": "unsubscribe", "trade_pairs": ["BTCUSD"]}
+            {"action": "subscribe", "all": true}
+        a subscription is answered with the snapshots of its new topics
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        try:
+            request = json.loads(text)
+            action = request.get("action")
+            if action not in ("subscribe", "unsubscribe"):
+                raise ValueError(f"Unknown action {action}")
+            topics = await self.resolve_topics(request)
+        except HTTPException as e:
+            client.put(json.dumps({"type": "error", "detail": e.detail}), replaceable=False)
+            return
+        except Exception as e:
+            client.put(json.dumps({"type": "error", "detail": f"Invalid request: {e}"}), replaceable=False)
+            return
+
+        if action == "unsubscribe":
+            self.unsubscribe(websocket, topics)
+        else:
+            if ALL_TOPIC not in topics:
+                # a selection replaces the subscription to everything
+                self.unsubscribe(websocket, [ALL_TOPIC])
+            added = self.subscribe(websocket, topics)
+            if websocket not in self.joining:
+                for message in self.topic_snapshots(added, client.encoding):
+                    client.put(message)
+        client.put(json.dumps({"type": "subscriptions", "topics": sorted(self.subscriptions.get(websocket, ()))}),
+                   replaceable=False)
+
+    def broadcast(self, message: str, connections=None):
+        connections = self.active_connections if connections is None else connections
+        for connection in connections:
+            client = self.clients.get(connection)
+            if client:
+                client.put(message)
+
+    def stats(self) -> dict:
+        clients = [client.stats() for client in self.clients.values()]
+        return {
+            "leader": self.leader.leading,
+            "synced": self.synced,
+            "connections": len(clients),
+            "dropped": sum(client["dropped"] for client in clients),
+            "max_lag": max((client["max_lag"] for client in clients), default=0.0),
+            "clients": clients,
+        }
+
+    @staticmethod
+    def encode(encoding: str, kind: str, data: dict, previous: dict = None):
+        """
+        a price or position message, `previous` are the values before the changes in `data`
+        """
+        if encoding == "compact":
+            encode = encode_prices if kind.startswith("prices") else encode_positions
+            return encode(kind, data, previous)
+        return json.dumps({"type": kind, "data": data})
+
+    def encoding(self, websocket: WebSocket) -> str:
+        client = self.clients.get(websocket)
+        return client.encoding if client else "json"
+
+    def fan_out(self, kind: str, data: dict, topic, previous: dict = None):
+        """
+        send the changes in `data` to the subscribers of their topics, one serialization
+        per encoding and distinct selection of keys
+        """
+        groups = defaultdict(list)
+        for socket in self.topics.get(ALL_TOPIC, ()):
+            if socket not in self.joining:
+                groups[(self.encoding(socket), None)].append(socket)
+        selections = defaultdict(set)
+        for key in data:
+            for socket in self.topics.get(topic(key), ()):
+                selections[socket].add(key)
+        for socket, keys in selections.items():
+            if socket not in self.joining and ALL_TOPIC not in self.subscriptions.get(socket, ()):
+                groups[(self.encoding(socket), frozenset(keys))].append(socket)
+        for (encoding, keys), sockets in groups.items():
+            selected = data if keys is None else {key: data[key] for key in keys}
+            self.broadcast(self.encode(encoding, kind, selected, previous), sockets)
+
+    def topic_snapshots(self, topics, encoding="json") -> list:
+        """
+        the "prices" and "positions" snapshots limited to the topics
+        """
+        if ALL_TOPIC in topics:
+            return [self.snapshot("prices", encoding), self.snapshot("positions", encoding)]
+        trade_pairs = {topic.split(":", 1)[1] for topic in topics if topic.startswith("prices:")}
+        trader_ids = {topic.split(":", 1)[1] for topic in topics if topic.startswith("positions:")}
+        prices = {trade_pair: self.prices[trade_pair] for trade_pair in trade_pairs if trade_pair in self.prices}
+        positions = {trader_id: self.positions[trader_id] for trader_id in trader_ids if trader_id in self.positions}
+        messages = []
+        if trade_pairs:
+            messages.append(self.encode(encoding, "prices", prices))
+        if trader_ids:
+            messages.append(self.encode(encoding, "positions", positions))
+        return messages
+
+    def snapshot(self, kind: str, encoding="json"):
+        snapshots = self.snapshots.setdefault(kind, {})
+        if encoding not in snapshots:
+            snapshots[encoding] = self.encode(encoding, kind, self.prices if kind == "prices" else self.positions)
+        return snapshots[encoding]
+
+    def update(self, prices: dict, positions: dict):
+        """
+        apply the changes of a frame and send them to the subscribers
+        """
+        previous_prices = {trade_pair: self.prices.get(trade_pair) for trade_pair in prices}
+        previous_positions = {trader_id: dict(self.positions.get(trader_id, {})) for trader_id in positions}
+        self.prices.update(prices)
+        for trader_id, entries in positions.items():
+            trader_positions = self.positions.setdefault(trader_id, {})
+            for trade_pair, position in entries.items():
+                if position is None:
+                    trader_positions.pop(trade_pair, None)
+                else:
+                    trader_positions[trade_pair] = position
+            if not trader_positions:
+                del self.positions[trader_id]
+        if prices:
+            self.snapshots.pop("prices", None)
+            self.fan_out("prices_update", prices, price_topic, previous_prices)
+        if positions:
+            self.snapshots.pop("positions", None)
+            self.fan_out("positions_update", positions, positions_topic, previous_positions)
+
+    def differences(self, prices: dict, positions: dict) -> tuple:
+        """
+        the changes from the current prices and positions to those of a snapshot frame
+        """
+        changed_prices = {trade_pair: price for trade_pair, price in prices.items()
+                          if self.prices.get(trade_pair) != price}
+        changed_positions = {}
+        for trader_id in positions.keys() | self.positions.keys():
+            before, after = self.positions.get(trader_id, {}), positions.get(trader_id, {})
+            entries = {trade_pair: after.get(trade_pair) for trade_pair in before.keys() | after.keys()
+                       if before.get(trade_pair) != after.get(trade_pair)}
+            if entries:
+                changed_positions[trader_id] = entries
+        return changed_prices, changed_positions
+
+    def receive(self, frame: dict) -> bool:
+        """
+        apply a frame of the leader, False when a frame was missed and a snapshot is needed
+        """
+        leader, seq = self.last_frame
+        in_order = frame["leader"] == leader and frame["seq"] == seq + 1
+        self.last_frame = (frame["leader"], frame["seq"])
+        if frame["type"] == "snapshot":
+            if self.synced and in_order:
+                self.update(*self.differences(frame["prices"], frame["positions"]))
+            else:
+                self.prices, self.positions, self.snapshots = frame["prices"], frame["positions"], {}
+                self.synced = True
+                for websocket in self.active_connections:
+                    self.clients[websocket].resync()
+            return True
+        if not (self.synced and in_order):
+            self.synced = False
+            return False
+        self.update(frame["prices"], frame["positions"])
+        return True
+
+    def admit(self):
+        """
+        the joining clients get their snapshots once the prices and positions are known
+        """
+        if self.joining and self.synced:
+            joining, self.joining = self.joining, set()
+            for websocket in joining:
+                if websocket in self.clients:
+                    self.clients[websocket].resync()
+                    self.active_connections.add(websocket)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+        leader_task = asyncio.create_task(self.leader.run())
+        requested_at = None
+        try:
+            await pubsub.subscribe(DELTA_FRAMES_CHANNEL)
+            while self.active_connections or self.joining:
+                try:
+                    if not self.synced and (requested_at is None
+                                            or loop.time() - requested_at > self.leader.lock_seconds):
+                        # answered by the leader, or by the next one with its first frame
+                        await async_redis_client.publish(DELTA_SNAPSHOT_REQUESTS, self.leader.owner)
+                        requested_at = loop.time()
+                    message = await pubsub.get_message(timeout=self.interval)
+                    if message:
+                        synced = self.synced
+                        if not self.receive(json.loads(message["data"])) and synced:
+                            # a frame was missed, ask for a snapshot right away
+                            requested_at = None
+                    self.admit()
+                except Exception as e:
+                    # frames may have been missed, start again from a snapshot
+                    logger.error(f"Error relaying the /ws/delta frames: {e}")
+                    self.synced = False
+                    requested_at = None
+                    await asyncio.sleep(self.interval)
+        finally:
+            leader_task.cancel()
+            self.synced = False
+            self.snapshots = {}
+            await pubsub.aclose()
 
 
 manager = ConnectionManager()
 
 
+@router.get("/delta/stats")
+async def delta_stats():
+    """
+    queue depth, sent and dropped messages, snapshot resyncs and delivery lag of the /ws/delta clients
+    """
+    return manager.stats()
+
+
 @router.websocket("/delta")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, encoding: str = "json"):
+    await manager.connect(websocket, encoding)
     try:
         while True:
-            await websocket.receive_text()
+            await manager.handle(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
@@ -15,6 +15,27 @@ TESTNET_CHECKPOINT_URL = os.getenv("TESTNET_CHECKPOINT_URL")
 MAIN_NET = os.getenv("MAIN_NET", "false") == "true"
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# asyncio redis pool of the API and ingest coroutines, callers wait up to REDIS_POOL_TIMEOUT for a free connection
+REDIS_ASYNC_MAX_CONNECTIONS = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", "64"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+# seconds polygon ticks are coalesced before they are written to redis
+POLYGON_FLUSH_INTERVAL = float(os.getenv("POLYGON_FLUSH_INTERVAL", "0.02"))
+# only the price ingest holding the lock writes quotes, it renews the lock every INGEST_HEALTH_INTERVAL seconds
+INGEST_LOCK_SECONDS = int(os.getenv("INGEST_LOCK_SECONDS", "15"))
+INGEST_HEALTH_INTERVAL = float(os.getenv("INGEST_HEALTH_INTERVAL", "5"))
+# quotes of a feed that is disconnected or silent for longer are not traded on
+QUOTE_STALE_SECONDS = float(os.getenv("QUOTE_STALE_SECONDS", "30"))
+# /ws/delta sends the changes of every DELTA_BROADCAST_INTERVAL seconds in one message per type,
+# and reloads the hashes every DELTA_RESYNC_INTERVAL seconds for writes that are not published
+DELTA_BROADCAST_INTERVAL = float(os.getenv("DELTA_BROADCAST_INTERVAL", "0.25"))
+DELTA_RESYNC_INTERVAL = float(os.getenv("DELTA_RESYNC_INTERVAL", "30"))
+# messages waiting for a slow /ws/delta client before they are replaced by a fresh snapshot,
+# and seconds a single send may take before the client is dropped
+DELTA_QUEUE_SIZE = int(os.getenv("DELTA_QUEUE_SIZE", "16"))
+DELTA_SEND_TIMEOUT = float(os.getenv("DELTA_SEND_TIMEOUT", "10"))
+# one API worker holding the lock builds the /ws/delta frames for all of them
+DELTA_LEADER_LOCK_SECONDS = int(os.getenv("DELTA_LEADER_LOCK_SECONDS", "15"))
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 
@@ -37,6 +58,9 @@ NEW_POSITIONS_TOKEN = os.getenv("NEW_MAIN_POSITION_TOKEN")
 TAOSHI_MAINNET_VALIDATOR_API_KEY = os.getenv("TAOSHI_MAINNET_VALIDATOR_API_KEY")
 
 
+# seconds a downloaded taoshi snapshot is served before it is revalidated
+TAOSHI_SNAPSHOT_TTL = float(os.getenv("TAOSHI_SNAPSHOT_TTL", "1.0"))
+
 STATISTICS_URL = os.getenv("MAIN_STATISTICS_URL")
 STATISTICS_TOKEN = os.getenv("MAIN_STATISTICS_TOKEN")
 
@@ -50,3 +74,7 @@ BUCKET_NAME = os.getenv("BUCKET_NAME")
 
 # DISCORD CONFIGURATION
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# POSITION MONITORING
+MONITOR_SHARDS = int(os.getenv("MONITOR_SHARDS", "4"))
+MONITOR_LEASE_SECONDS = int(os.getenv("MONITOR_LEASE_SECONDS", "30"))
@@ -1,6 +1,16 @@
-from celery import Celery
+import logging
+import math
+import threading
+import time
+from uuid import uuid4
+
+from celery import Celery, Task
 
 from src.config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND
+from src.utils.constants import TASK_LOCK_PREFIX, TASK_METRICS_PREFIX, TASK_NEXT_RUN_PREFIX
+from src.utils.redis_manager import redis_client, acquire_lock, renew_lock, release_lock
+
+logger = logging.getLogger(__name__)
 
 celery_app = Celery(
     'core.celery_app',
@@ -12,6 +22,8 @@ celery_app.conf.update(
     task_routes={
         'src.tasks.send_notification.send_notifications': {'queue': 'send_notifications'},
         'src.tasks.position_monitor_sync.monitor_positions': {'queue': 'position_monitoring'},
+        'src.tasks.position_monitor_sync.monitor_positions_shard': {'queue': 'position_monitoring'},
+        'src.tasks.position_monitor_sync.monitor_triggered_positions': {'queue': 'position_monitoring'},
         'src.tasks.redis_listener.event_listener': {'queue': 'event_listener'},
         'src.tasks.monitor_mainnet_challenges.monitor_mainnet_challenges': {'queue': 'monitor_mainnet_challenges'},
         'src.tasks.monitor_miner_positions.monitor_miner': {'queue': 'monitor_miner'},
@@ -27,6 +39,7 @@ celery_app.conf.update(
         'SL/TP-Limit-Price-Bot': {
             'task': 'src.tasks.position_monitor_sync.monitor_positions',
             'schedule': 2.0,  # every 1 second
+            'options': {'expires': 2.0},
         },
         # 'redis-listener-every-15-seconds': {
         #     'task': 'src.tasks.redis_listener.event_listener',
@@ -39,10 +52,12 @@ celery_app.conf.update(
         'Updates-Redis-with-Mainnet-Trades': {
             'task': 'src.tasks.monitor_miner_positions.monitor_miner',
             'schedule': 2.0,  # every 1 second
+            'options': {'expires': 2.0},
         },
         'Updates-Redis-with-TestNet-Trades-And-Checks-Pass-Fail': {
             'task': 'src.tasks.testnet_validator.testnet_validator',
             'schedule': 2.0,  # every 1 second
+            'options': {'expires': 2.0},
         },
         # 'send_discord_reminder-daily': {
         #     'task': 'src.tasks.tournament_notifications.send_discord_reminder',
@@ -68,6 +83,102 @@ celery_app.conf.update(
     timezone='UTC',
 )
 
+
+
+class ScheduledTask(Task):
+    """
+    Base of the beat tasks that must not overlap.
+
+    A run holds a redis lock for the task, a run fired while the previous one is still going
+    is skipped. The lock expires after `lock_intervals` schedule intervals and is renewed while
+    the run goes on, a killed worker only blocks the task until then. When runs take longer
+    than the beat interval the next run is pushed back to twice the average duration after
+    the last start, so a slow task gets at most half of its worker's time instead of running
+    back to back.
+    Lateness, duration, overruns and skips are kept in the `task_metrics:<task>` hash.
+    """
+    interval = None  # defaults to the beat schedule of `schedule_of` or of the task itself
+    schedule_of = None
+    lock_intervals = 5
+    min_lock_timeout = 10
+    lock_per_args = False  # e.g. one lock per shard
+    smoothing = 0.2
+
+    def schedule_interval(self) -> float:
+        if self.interval is None:
+            name = self.schedule_of or self.name
+            self.interval = next((float(entry['schedule']) for entry in self.app.conf.beat_schedule.values()
+                                  if entry['task'] == name), 0.0)
+        return self.interval
+
+    def lock_timeout(self) -> int:
+        return max(math.ceil(self.lock_intervals * self.schedule_interval()), self.min_lock_timeout)
+
+    def renew_run_lock(self, lock: str, owner: str, ttl: int, done: threading.Event):
+        while not done.wait(ttl / 3):
+            if not renew_lock(lock, owner, ttl):
+                logger.error(f"Lost the run lock {lock} while the run is still going")
+                return
+
+    def run_key(self, args) -> str:
+        return f"{self.name}:{':'.join(map(str, args))}" if self.lock_per_args else self.name
+
+    def __call__(self, *args, **kwargs):
+        key = self.run_key(args)
+        lock = f"{TASK_LOCK_PREFIX}:{key}"
+        owner = uuid4().hex
+        ttl = self.lock_timeout()
+        if not acquire_lock(lock, owner, ttl):
+            redis_client.hincrby(f"{TASK_METRICS_PREFIX}:{key}", "skipped_running", 1)
+            logger.info(f"Skipping {key}, the previous run is still going")
+            return None
+
+        done = threading.Event()
+        threading.Thread(target=self.renew_run_lock, args=(lock, owner, ttl, done), daemon=True).start()
+        try:
+            started = time.time()
+            next_run_at = redis_client.get(f"{TASK_NEXT_RUN_PREFIX}:{key}")
+            if next_run_at and started < float(next_run_at):
+                redis_client.hincrby(f"{TASK_METRICS_PREFIX}:{key}", "skipped_deferred", 1)
+                return None
+
+            try:
+                return super().__call__(*args, **kwargs)
+            finally:
+                self.record_run(key, started)
+        finally:
+            done.set()
+            release_lock(lock, owner)
+
+    def record_run(self, key: str, started: float):
+        duration = time.time() - started
+        interval = self.schedule_interval()
+        metrics = f"{TASK_METRICS_PREFIX}:{key}"
+        try:
+            last_started, average = redis_client.hmget(metrics, ["last_started", "avg_duration"])
+            average = duration if average is None else (1 - self.smoothing) * float(average) + self.smoothing * duration
+            lateness = max(0.0, started - float(last_started) - interval) if last_started else 0.0
+
+            pipeline = redis_client.pipeline()
+            if 2 * average > interval:
+                pipeline.set(f"{TASK_NEXT_RUN_PREFIX}:{key}", started + 2 * average, ex=max(int(4 * average), 1))
+            else:
+                pipeline.delete(f"{TASK_NEXT_RUN_PREFIX}:{key}")
+            pipeline.hset(metrics, mapping={
+                "last_started": started,
+                "last_duration": duration,
+                "avg_duration": average,
+                "lateness": lateness,
+                "overrun": max(0.0, duration - interval),
+            })
+            pipeline.hincrby(metrics, "runs", 1)
+            if duration > interval:
+                pipeline.hincrby(metrics, "overruns", 1)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(f"Failed to record the run metrics of {key}: {e}")
+
+
 celery_app.autodiscover_tasks(['src.tasks'])
 
 # Ensure tasks are loaded
@@ -1,6 +1,3 @@
-import asyncio
-import os
-
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.exc import ProgrammingError
@@ -28,8 +25,8 @@ from src.api.routes.favorite_trade_pairs import router as favorite_pairs_router
 from src.api.routes.notifications import router as notifications_router
 from src.api.routes.top_traders import router as top_traders_router
 
-from src.services.user_service import populate_ambassadors
-from src.utils.websocket_manager import forex_websocket_manager, crypto_websocket_manager, stocks_websocket_manager
+from src.services.trader_directory import trader_directory
+from src.utils.async_redis_manager import close_async_redis
 
 app = FastAPI()
 
@@ -66,15 +63,7 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup_event():
-    print("Starting to listen for prices multiple...")
-    print()
-    environment = os.getenv("ENVIRONMENT") or "dev"
-    if environment == "prod":
-        asyncio.create_task(stocks_websocket_manager.listen_for_prices_multiple())
-        asyncio.create_task(forex_websocket_manager.listen_for_prices_multiple())
-        asyncio.create_task(crypto_websocket_manager.listen_for_prices_multiple())
-
-    # asyncio.create_task(indices_websocket_manager.listen_for_prices_multiple()
+    # prices are written by the price ingest process (python -m src.price_ingest), the API only reads them
     default_db_url = DATABASE_URL.rsplit("/", 1)[0] + "/postgres"
     default_engine = create_async_engine(default_db_url, echo=True)
 
@@ -95,5 +84,12 @@ async def startup_event():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
-    print("Populate Ambassadors dict!")
-    populate_ambassadors()
+    print("Load the trader directory!")
+    await trader_directory.start_updates()
+    trader_directory.load()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await trader_directory.stop_updates()
+    await close_async_redis()
@@ -0,0 +1,140 @@
+"""
+Polygon price ingest, the only writer of the polygon_prices and polygon_quotes hashes.
+
+    python -m src.price_ingest
+
+The stocks, forex and crypto listeners and the trigger dispatcher run here, away from the
+API workers, which only read the quote store. A redis lock keeps a single ingest writing,
+another instance stands by until the lock is released or expires. The state of the ingest
+is reported in the price_ingest_health hash. Only the prod environment listens to Polygon and
+sends trigger signals, elsewhere the service idles until it is stopped.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+
+from src.config import INGEST_LOCK_SECONDS, INGEST_HEALTH_INTERVAL
+from src.database import SessionLocal
+from src.services.trigger_service import trigger_dispatcher
+from src.utils.async_redis_manager import (
+    async_redis_client,
+    acquire_lock,
+    renew_lock,
+    release_lock,
+    close_async_redis,
+)
+from src.utils.constants import INGEST_LOCK, INGEST_HEALTH
+from src.utils.logging import setup_logging
+from src.utils.quote_writer import quote_writer
+from src.utils.websocket_manager import (
+    WebSocketManager,
+    stocks_websocket_manager,
+    forex_websocket_manager,
+    crypto_websocket_manager,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LostIngestLock(Exception):
+    pass
+
+
+class PriceIngest:
+    def __init__(self, managers: list[WebSocketManager], lock_seconds=INGEST_LOCK_SECONDS,
+                 health_interval=INGEST_HEALTH_INTERVAL):
+        self.managers = managers
+        self.lock_seconds = lock_seconds
+        self.health_interval = health_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.started_at = None
+
+    async def acquire(self):
+        while not await acquire_lock(INGEST_LOCK, self.owner, self.lock_seconds):
+            logger.info(f"Another price ingest holds {INGEST_LOCK}, standing by")
+            await asyncio.sleep(self.lock_seconds / 3)
+        logger.info(f"Price ingest {self.owner} is the quotes writer")
+
+    def health(self) -> dict:
+        now = time.time()
+        health = {
+            "owner": self.owner,
+            "started_at": self.started_at,
+            "heartbeat": now,
+        }
+        for manager in self.managers:
+            asset_type = manager.asset_type
+            health[f"{asset_type}:last_tick"] = manager.last_tick_at or 0
+            health[f"{asset_type}:idle"] = round(now - manager.last_tick_at, 3) if manager.last_tick_at else -1
+            health[f"{asset_type}:lag"] = round(manager.last_tick_lag, 3) if manager.last_tick_lag is not None else -1
+            health[f"{asset_type}:received"] = quote_writer.received[asset_type]
+            health[f"{asset_type}:written"] = quote_writer.written[asset_type]
+        return health
+
+    async def keep_alive(self):
+        """
+        renew the lock and report the health until the lock is lost
+        """
+        while True:
+            await asyncio.sleep(self.health_interval)
+            if not await renew_lock(INGEST_LOCK, self.owner, self.lock_seconds):
+                raise LostIngestLock(f"{INGEST_LOCK} is no longer held by {self.owner}")
+            try:
+                await async_redis_client.hset(INGEST_HEALTH, mapping=self.health())
+            except Exception as e:
+                logger.error(f"Failed to report the price ingest health: {e}")
+
+    async def run(self):
+        await self.acquire()
+        self.started_at = time.time()
+        try:
+            async with SessionLocal() as db:
+                await trigger_dispatcher.rebuild(db)
+            trigger_dispatcher.start()
+            tasks = [asyncio.create_task(self.keep_alive())]
+            tasks += [asyncio.create_task(manager.listen_for_prices_multiple()) for manager in self.managers]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # gather leaves the listeners running when keep_alive fails, they would keep
+                # putting ticks after another ingest took the lock
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except LostIngestLock as e:
+            # another ingest took over, stop writing without touching its lock
+            logger.error(f"{e}, stopping")
+            quote_writer.pending = {}
+            raise
+        finally:
+            await quote_writer.close()
+            await release_lock(INGEST_LOCK, self.owner)
+
+
+async def main():
+    setup_logging()
+    environment = os.getenv("ENVIRONMENT") or "dev"
+    if environment == "prod":
+        ingest = PriceIngest([stocks_websocket_manager, forex_websocket_manager, crypto_websocket_manager])
+        task = asyncio.create_task(ingest.run())
+    else:
+        # stay up, an exit would only be restarted by the compose restart policy
+        logger.info(f"Price ingest is disabled in the {environment} environment")
+        task = asyncio.create_task(asyncio.Event().wait())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        logger.info("Price ingest stopped")
+    finally:
+        await close_async_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,35 +1,238 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+import httpx
 import requests
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.config import POSITIONS_URL, POSITIONS_TOKEN, TESTNET_CHECKPOINT_URL, STATISTICS_URL, STATISTICS_TOKEN
+from src.config import POSITIONS_URL, POSITIONS_TOKEN, TESTNET_CHECKPOINT_URL, STATISTICS_URL, STATISTICS_TOKEN, \
+    TAOSHI_SNAPSHOT_TTL
+from src.database_tasks import TaskSessionLocal_
+from src.services.snapshot_stream import StreamingDecoder, decode_main_net, decode_testnet
+from src.services.trade_service import get_cached_user_hotkey_map
+from src.services.trader_directory import trader_directory
 from src.services.user_service import get_hot_key
+from src.utils.async_redis_manager import push_to_redis_queue as push_to_redis_queue_async
 from src.utils.constants import ERROR_QUEUE_NAME
 from src.utils.redis_manager import push_to_redis_queue
 
+logger = logging.getLogger(__name__)
 
-def call_main_net(url=POSITIONS_URL, token=POSITIONS_TOKEN):
+
+class SnapshotCache:
+    """
+    Decoded taoshi snapshot shared by every caller of the process.
+
+    The snapshot is served from memory for `ttl` seconds, then revalidated with
+    If-None-Match / If-Modified-Since so an unchanged payload is not downloaded again.
+    Concurrent callers of a stale snapshot wait on the single fetch in flight.
+    With a `decoder` the response is parsed incrementally and only the tracked hot keys
+    are kept, a change of the tracked hot keys forces a full download.
+    The returned payload is shared, callers must not modify it.
+    """
+
+    def __init__(self, url, headers=None, ttl=TAOSHI_SNAPSHOT_TTL, decoder: StreamingDecoder = None):
+        self.url = url
+        self.headers = headers or {}
+        self.ttl = ttl
+        self.decoder = decoder if decoder and decoder.available else None
+        self.hot_keys = None
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.async_session = None
+        self.async_lock = None
+        self.data = None
+        self.fetched_at = 0.0
+        self.etag = None
+        self.last_modified = None
+        self.response = None
+        self.derived = {}
+
+    def fresh(self) -> bool:
+        return self.data is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    def get(self):
+        """
+        the cached snapshot, or None when the download does not return 200
+        """
+        if self.fresh():
+            return self.data
+        with self.lock:
+            if not self.fresh():
+                self.refresh()
+            return self.data
+
+    def derive(self, name, build):
+        """
+        a value computed from the snapshot with `build`, computed once per downloaded payload
+        """
+        data = self.get()
+        if data is None:
+            return None
+        with self.lock:
+            payload, value = self.derived.get(name, (None, None))
+            if payload is not data:
+                value = build(data)
+                self.derived[name] = (data, value)
+            return value
+
+    async def get_async(self):
+        """
+        get for coroutines, downloaded with httpx so the event loop is never blocked
+        """
+        if self.fresh():
+            return self.data
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        async with self.async_lock:
+            if not self.fresh():
+                await self.refresh_async()
+            return self.data
+
+    async def derive_async(self, name, build):
+        data = await self.get_async()
+        if data is None:
+            return None
+        payload, value = self.derived.get(name, (None, None))
+        if payload is not data:
+            value = await asyncio.to_thread(build, data)
+            self.derived[name] = (data, value)
+        return value
+
+    def tracked_hot_keys(self):
+        if not self.decoder:
+            return None
+        try:
+            return self.decoder.hot_keys()
+        except Exception as e:
+            logger.error(f"Tracked hot keys unavailable, decoding the full snapshot of {self.url}: {e}")
+
+    def request_headers(self, hot_keys) -> dict:
+        headers = dict(self.headers)
+        if self.data is not None and hot_keys == self.hot_keys:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def store(self, data, hot_keys, headers):
+        self.data = data
+        self.hot_keys = hot_keys
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+        self.fetched_at = time.monotonic()
+
+    def refresh(self):
+        hot_keys = self.tracked_hot_keys()
+        with self.session.get(self.url, headers=self.request_headers(hot_keys), stream=True) as response:
+            self.response = response
+            if response.status_code == 304:
+                self.fetched_at = time.monotonic()
+                return
+            if response.status_code != 200:
+                self.data = None
+                return
+
+            data = self.decoder(response, hot_keys) if hot_keys is not None else response.json()
+        self.store(data, hot_keys, response.headers)
+
+    async def refresh_async(self):
+        hot_keys = await asyncio.to_thread(self.tracked_hot_keys)
+        if self.async_session is None or self.async_session.is_closed:
+            self.async_session = httpx.AsyncClient(timeout=30)
+        response = await self.async_session.get(self.url, headers=self.request_headers(hot_keys))
+        self.response = response
+        if response.status_code == 304:
+            self.fetched_at = time.monotonic()
+            return
+        if response.status_code != 200:
+            self.data = None
+            return
+
+        # decoding a snapshot takes a while, keep it off the loop
+        if hot_keys is not None:
+            data = await asyncio.to_thread(self.decoder.decode, io.BytesIO(response.content), hot_keys)
+        else:
+            data = await asyncio.to_thread(json.loads, response.content)
+        self.store(data, hot_keys, response.headers)
+
+
+class PositionsIndex:
+    """
+    Lookups over the {hot_key: {"positions": [...]}} map of a snapshot, built once per download
+    """
+
+    def __init__(self, miners: dict):
+        self.by_uuid = {}  # (hot_key, position_uuid) -> position
+        self.by_trade_pair = {}  # (hot_key, trade_pair, open) -> first position in payload order
+        for hot_key, content in miners.items():
+            for position in content.get("positions", []):
+                self.by_uuid[(hot_key, position["position_uuid"])] = position
+                trade_pair = position.get("trade_pair", [None])[0]
+                self.by_trade_pair.setdefault((hot_key, trade_pair, not position["is_closed_position"]), position)
+
+    def get(self, hot_key, position_uuid=None, trade_pair=None):
+        """
+        the position with the uuid, else the open position of the trade pair
+        """
+        position = self.by_uuid.get((hot_key, position_uuid)) if position_uuid else None
+        return position or self.by_trade_pair.get((hot_key, trade_pair, True))
+
+
+snapshot_caches = {}
+snapshot_caches_lock = threading.Lock()
+
+
+def get_snapshot_cache(url, headers=None, decoder: StreamingDecoder = None) -> SnapshotCache:
+    key = (url, tuple(sorted((headers or {}).items())))
+    with snapshot_caches_lock:
+        if key not in snapshot_caches:
+            snapshot_caches[key] = SnapshotCache(url, headers, decoder=decoder)
+        return snapshot_caches[key]
+
+
+def tracked_hot_keys() -> frozenset:
+    """
+    hot keys of every challenge, the only miners whose positions are kept from the snapshots
+    """
+    with TaskSessionLocal_() as db:
+        return frozenset(get_cached_user_hotkey_map(db).data or {})
+
+
+main_net_decoder = StreamingDecoder(decode_main_net, tracked_hot_keys)
+testnet_decoder = StreamingDecoder(decode_testnet, tracked_hot_keys)
+
+
+def main_net_cache(url=POSITIONS_URL, token=POSITIONS_TOKEN) -> SnapshotCache:
     headers = {
         'Content-Type': 'application/json',
         'x-taoshi-consumer-request-key': token,
     }
+    return get_snapshot_cache(url, headers, decoder=main_net_decoder if url == POSITIONS_URL else None)
 
-    response = requests.request(method="GET", url=url, headers=headers)
-    if response.status_code != 200:
-        return {}
-    return response.json()
+
+def call_main_net(url=POSITIONS_URL, token=POSITIONS_TOKEN):
+    return main_net_cache(url, token).get() or {}
 
 
 
 
 def testnet_websocket(monitor=False):
     try:
-        response = requests.request(method="GET", url=TESTNET_CHECKPOINT_URL)
-        if response.status_code != 200:
+        cache = get_snapshot_cache(TESTNET_CHECKPOINT_URL, decoder=testnet_decoder)
+        testnet_data = cache.get()
+        if testnet_data is None:
             push_to_redis_queue(
-                data=f"**Testnet API Call** => Testnet Validator Checkpoint returns with status code other than 200, response => {response}",
+                data=f"**Testnet API Call** => Testnet Validator Checkpoint returns with status code other than 200, response => {cache.response}",
                 queue_name=ERROR_QUEUE_NAME
             )
             return {}
-        testnet_data = response.json()
         if monitor:
             return testnet_data
         return testnet_data["positions"]
@@ -42,37 +245,59 @@ def testnet_websocket(monitor=False):
         return {}
 
 
-def get_position(trader_id, trade_pair, main=True, position_uuid=None):
+def get_positions_index(main=True) -> Optional[PositionsIndex]:
+    """
+    Index of the mainnet or testnet snapshot positions, None when the download failed
+    """
     if main:
-        data = call_main_net()
+        data, cache, miners = call_main_net(), main_net_cache(), lambda payload: payload
     else:
-        data = testnet_websocket()
+        data, cache, miners = testnet_websocket(), get_snapshot_cache(TESTNET_CHECKPOINT_URL, decoder=testnet_decoder), lambda payload: payload["positions"]
 
     if not data:
-        return
+        return None
+    return cache.derive("positions_index", lambda payload: PositionsIndex(miners(payload)))
 
-    hot_key = get_hot_key(trader_id)
-    content = data.get(hot_key)
-    if not content:
-        return
 
-    positions = content["positions"]
-    for position in positions:
-        if position_uuid and position["position_uuid"] == position_uuid:
-            return position
+async def get_positions_index_async(main=True) -> Optional[PositionsIndex]:
+    """
+    get_positions_index for coroutines
+    """
+    if main:
+        cache, miners = main_net_cache(), lambda payload: payload
+    else:
+        cache, miners = get_snapshot_cache(TESTNET_CHECKPOINT_URL, decoder=testnet_decoder), lambda payload: payload["positions"]
+
+    try:
+        if not await cache.get_async():
+            await push_to_redis_queue_async(
+                data=f"**{'Mainnet' if main else 'Testnet'} API Call** => {cache.url} returns with status code other than 200, response => {cache.response}",
+                queue_name=ERROR_QUEUE_NAME
+            )
+            return None
+        return await cache.derive_async("positions_index", lambda payload: PositionsIndex(miners(payload)))
+    except Exception as e:
+        logger.error(f"Error downloading {cache.url}: {e}")
+        await push_to_redis_queue_async(
+            data=f"**{'Mainnet' if main else 'Testnet'} API Call** => {cache.url} ERROR => {e}",
+            queue_name=ERROR_QUEUE_NAME
+        )
+        return None
 
-        if position["is_closed_position"] is True:
-            continue
 
-        p_trade_pair = position.get("trade_pair", [])[0]
-        if p_trade_pair != trade_pair:
-            continue
-        return position
+def get_position(trader_id, trade_pair, main=True, position_uuid=None):
+    index = get_positions_index(main)
+    if not index:
+        return
 
+    return index.get(get_hot_key(trader_id), position_uuid=position_uuid, trade_pair=trade_pair)
 
-def get_profit_and_current_price(trader_id, trade_pair, main=True, position_uuid=None):
-    position = get_position(trader_id, trade_pair, main, position_uuid=position_uuid)
 
+def position_values(position) -> tuple:
+    """
+    (price, profit_loss, profit_loss_without_fee, taoshi_profit_loss, taoshi_profit_loss_without_fee,
+    position_uuid, hot_key, len_orders, average_entry_price, closed) of a snapshot position
+    """
     if position and position["orders"]:
         price, taoshi_profit_loss, taoshi_profit_loss_without_fee = position["orders"][-1]["price"], position[
             "return_at_close"], position["current_return"]
@@ -83,3 +308,16 @@ def get_profit_and_current_price(trader_id, trade_pair, main=True, position_uuid
         return price, profit_loss, profit_loss_without_fee, taoshi_profit_loss, taoshi_profit_loss_without_fee, position_uuid, hot_key, len(
             position["orders"]), position["average_entry_price"], position["is_closed_position"]
     return 0.0, 0.0, 0.0, 0.0, 0.0, "", "", 0, 0, False
+
+
+def get_profit_and_current_price(trader_id, trade_pair, main=True, position_uuid=None):
+    return position_values(get_position(trader_id, trade_pair, main, position_uuid=position_uuid))
+
+
+async def get_profit_and_current_price_async(db: AsyncSession, trader_id, trade_pair, main=True, position_uuid=None):
+    index = await get_positions_index_async(main)
+    position = None
+    if index:
+        trader = await trader_directory.get_async(db, trader_id)
+        position = index.get(trader.hot_key if trader else None, position_uuid=position_uuid, trade_pair=trade_pair)
+    return position_values(position)
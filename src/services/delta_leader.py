@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+
+from src.config import DELTA_BROADCAST_INTERVAL, DELTA_RESYNC_INTERVAL, DELTA_LEADER_LOCK_SECONDS
+from src.utils.async_redis_manager import (
+    async_redis_client,
+    get_many_hash_values,
+    acquire_lock,
+    renew_lock,
+    release_lock,
+)
+from src.utils.constants import (
+    POSITIONS_TABLE,
+    REDIS_LIVE_PRICES_TABLE,
+    REDIS_LIVE_QUOTES_TABLE,
+    STOP_LOSS_POSITIONS_TABLE,
+    HASH_UPDATES_CHANNEL,
+    DELTA_LEADER_LOCK,
+    DELTA_FRAMES_CHANNEL,
+    DELTA_SNAPSHOT_REQUESTS,
+)
+
+logger = logging.getLogger(__name__)
+
+HASHES = (REDIS_LIVE_PRICES_TABLE, REDIS_LIVE_QUOTES_TABLE, POSITIONS_TABLE, STOP_LOSS_POSITIONS_TABLE)
+
+
+class LostDeltaLeadership(Exception):
+    pass
+
+
+class DeltaLeader:
+    """
+    Builds the /ws/delta frames once for all the API workers.
+
+    The worker holding DELTA_LEADER_LOCK keeps a copy of the prices, quotes, positions and stop
+    loss hashes up to date from HASH_UPDATES_CHANNEL, reloads them every `resync_interval` seconds
+    for the writes that are not published, and every `interval` seconds publishes the trade pairs
+    and positions that changed as one "delta" frame on DELTA_FRAMES_CHANNEL. A "snapshot" frame with
+    everything is published when it starts leading and when a worker asks for one on
+    DELTA_SNAPSHOT_REQUESTS. Frames are numbered so the workers can tell when they missed one.
+    Only the leader reads the hashes, the workers only relay the frames to their sockets.
+    """
+
+    def __init__(self, interval=DELTA_BROADCAST_INTERVAL, resync_interval=DELTA_RESYNC_INTERVAL,
+                 lock_seconds=DELTA_LEADER_LOCK_SECONDS):
+        self.interval = interval
+        self.resync_interval = resync_interval
+        self.lock_seconds = lock_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.leading = False
+        self.seq = 0
+        self.books = {hash_name: {} for hash_name in HASHES}
+        self.changed = {hash_name: set() for hash_name in HASHES}
+
+    def apply(self, message: dict):
+        """
+        apply a HASH_UPDATES_CHANNEL message to the copy of the hashes
+        """
+        for hash_name, values in message.get("set", {}).items():
+            if hash_name in self.books:
+                self.books[hash_name].update(values)
+                self.changed[hash_name].update(values)
+        for hash_name, keys in message.get("delete", {}).items():
+            if hash_name in self.books:
+                for key in keys:
+                    self.books[hash_name].pop(key, None)
+                self.changed[hash_name].update(keys)
+
+    async def resync(self):
+        hashes = await get_many_hash_values(*HASHES)
+        for hash_name, values in zip(HASHES, hashes):
+            book = self.books[hash_name]
+            values = {key: json.loads(value) for key, value in values.items()}
+            self.changed[hash_name].update(key for key, value in values.items() if book.get(key) != value)
+            self.changed[hash_name].update(key for key in book if key not in values)
+            self.books[hash_name] = values
+
+    def price(self, trade_pair: str) -> dict:
+        return {
+            **self.books[REDIS_LIVE_PRICES_TABLE][trade_pair],
+            **self.books[REDIS_LIVE_QUOTES_TABLE].get(trade_pair, {}),
+        }
+
+    def position(self, key: str):
+        value = self.books[POSITIONS_TABLE].get(key)
+        if value is None:
+            return None
+        return {
+            "time": value[0],
+            "entry_price": value[1],
+            "profit_loss": value[2],
+            "profit_loss_without_fee": value[3],
+            "is_closed": value[-1],
+            "stop_loss": self.books[STOP_LOSS_POSITIONS_TABLE].get(key, 0),
+        }
+
+    def positions(self, keys) -> dict:
+        positions = {}
+        for key in keys:
+            trade_pair, trader_id = key.split("-")
+            positions.setdefault(trader_id, {})[trade_pair] = self.position(key)
+        return positions
+
+    def delta(self) -> dict:
+        """
+        the trade pairs and positions changed since the last call, a removed position is None
+        """
+        changed_pairs = self.changed[REDIS_LIVE_PRICES_TABLE] | self.changed[REDIS_LIVE_QUOTES_TABLE]
+        prices = {trade_pair: self.price(trade_pair) for trade_pair in changed_pairs
+                  if trade_pair in self.books[REDIS_LIVE_PRICES_TABLE]}
+        positions = self.positions(self.changed[POSITIONS_TABLE] | self.changed[STOP_LOSS_POSITIONS_TABLE])
+        for keys in self.changed.values():
+            keys.clear()
+        return {"prices": prices, "positions": positions}
+
+    def snapshot(self) -> dict:
+        for keys in self.changed.values():
+            keys.clear()
+        return {
+            "prices": {trade_pair: self.price(trade_pair) for trade_pair in self.books[REDIS_LIVE_PRICES_TABLE]},
+            "positions": self.positions(self.books[POSITIONS_TABLE]),
+        }
+
+    async def publish(self, kind: str, data: dict):
+        self.seq += 1
+        await async_redis_client.publish(DELTA_FRAMES_CHANNEL, json.dumps({
+            "leader": self.owner, "seq": self.seq, "type": kind, **data,
+        }))
+
+    async def lead(self):
+        """
+        publish the frames while holding the lock
+        """
+        loop = asyncio.get_running_loop()
+        pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+        self.leading = True
+        self.seq = 0
+        self.books = {hash_name: {} for hash_name in HASHES}
+        logger.info(f"{self.owner} leads the /ws/delta broadcast")
+        try:
+            await pubsub.subscribe(HASH_UPDATES_CHANNEL, DELTA_SNAPSHOT_REQUESTS)
+            # changes published while loading are applied on top of it
+            await self.resync()
+            await self.publish("snapshot", self.snapshot())
+            resync_at = loop.time() + self.resync_interval
+            renew_at = loop.time() + self.lock_seconds / 3
+            while True:
+                snapshot = False
+                try:
+                    deadline = loop.time() + self.interval
+                    while loop.time() < deadline:
+                        message = await pubsub.get_message(timeout=deadline - loop.time())
+                        if not message:
+                            continue
+                        if message["channel"] == DELTA_SNAPSHOT_REQUESTS:
+                            snapshot = True
+                        else:
+                            self.apply(json.loads(message["data"]))
+                    if loop.time() >= renew_at:
+                        if not await renew_lock(DELTA_LEADER_LOCK, self.owner, self.lock_seconds):
+                            raise LostDeltaLeadership(f"{DELTA_LEADER_LOCK} is no longer held by {self.owner}")
+                        renew_at = loop.time() + self.lock_seconds / 3
+                    if loop.time() >= resync_at:
+                        await self.resync()
+                        resync_at = loop.time() + self.resync_interval
+                    if snapshot:
+                        await self.publish("snapshot", self.snapshot())
+                    else:
+                        delta = self.delta()
+                        if delta["prices"] or delta["positions"]:
+                            await self.publish("delta", delta)
+                except LostDeltaLeadership:
+                    raise
+                except Exception as e:
+                    # changes may have been missed, the reload sends them as a delta
+                    logger.error(f"Error building the /ws/delta frames: {e}")
+                    await asyncio.sleep(self.interval)
+                    resync_at = loop.time()
+        finally:
+            self.leading = False
+            await pubsub.aclose()
+            await release_lock(DELTA_LEADER_LOCK, self.owner)
+
+    async def run(self):
+        """
+        lead whenever the lock is free, until cancelled
+        """
+        while True:
+            try:
+                if await acquire_lock(DELTA_LEADER_LOCK, self.owner, self.lock_seconds):
+                    await self.lead()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Stopped leading the /ws/delta broadcast: {e}")
+            await asyncio.sleep(self.lock_seconds / 3)
@@ -2,7 +2,10 @@ import json
 import logging
 from datetime import datetime, timedelta
 
-from src.services.api_service import get_profit_and_current_price
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.services.api_service import get_profit_and_current_price, get_profit_and_current_price_async
+from src.utils import async_redis_manager
 from src.utils.redis_manager import set_hash_value, get_hash_value
 
 logger = logging.getLogger(__name__)
@@ -31,5 +34,30 @@ def get_taoshi_values(trader_id, trade_pair, position_uuid=None, challenge="main
     value = [str(datetime.now()), price, profit_loss, profit_loss_without_fee, taoshi_profit_loss,
              taoshi_profit_loss_without_fee, uuid, hot_key, len_orders, avg_entry_price, closed]
     if price != 0:
-        set_hash_value(key=key, value=value)
+        set_hash_value(key=key, value=value, publish=True)
+    return value[1:last_index]
+
+
+async def get_taoshi_values_async(db: AsyncSession, trader_id, trade_pair, position_uuid=None, challenge="main",
+                                  closed=False) -> list:
+    """
+    get_taoshi_values for coroutines
+    """
+    key = f"{trade_pair}-{trader_id}"
+    last_index = 11 if closed else -1
+
+    position = await async_redis_manager.get_hash_value(key)
+    if position:
+        return json.loads(position)[1:last_index]
+
+    main = (challenge.lower() == "main")
+    value = [str(datetime.now()), *await get_profit_and_current_price_async(
+        db,
+        trader_id,
+        trade_pair,
+        main=main,
+        position_uuid=position_uuid
+    )]
+    if value[1] != 0:
+        await async_redis_manager.set_hash_value(key=key, value=value, publish=True)
     return value[1:last_index]
@@ -13,6 +13,7 @@ from src.models import Challenge
 from src.models.payments import Payment
 from src.schemas.user import PaymentCreate
 from src.services.email_service import send_mail, send_support_email
+from src.services.trader_directory import challenges_changed
 from src.services.user_service import get_firebase_user, get_challenge_by_id
 from src.utils.logging import setup_logging
 
@@ -46,6 +47,7 @@ def create_challenge(db, payment_data, network, phase, user, challenge_status="I
     )
     db.add(_challenge)
     db.commit()
+    challenges_changed(_challenge.trader_id)
     db.refresh(_challenge)
 
     if user.username:
@@ -177,6 +179,7 @@ def register_and_update_challenge(
                 )
 
             db.commit()
+            challenges_changed(challenge.trader_id)
             db.refresh(challenge)
 
         except Exception as e:
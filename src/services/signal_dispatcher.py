@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import aiohttp
+from throttler import Throttler
+
+from src.config import SIGNAL_API_KEY, SIGNAL_API_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Set the rate limit: max 10 requests per second
+signal_throttler = Throttler(rate_limit=10, period=1.0)
+
+
+class SignalDispatcher:
+    """
+    Long lived dispatcher of trade signals to the signal API.
+
+    Signals are sent from a dedicated event loop running in a background thread, over one
+    aiohttp session whose connections are reused, with bounded concurrency and the signal
+    rate limit. Sync callers (celery tasks) get a concurrent Future back immediately and
+    collect the result when they need it, async callers await `send`.
+    """
+
+    def __init__(self, max_concurrency=10, connection_limit=20, timeout=30):
+        self.max_concurrency = max_concurrency
+        self.connection_limit = connection_limit
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._session = None
+        self._semaphore = None
+
+    def _ensure_started(self):
+        # started lazily and once per process, celery forks its workers after import
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._session = None
+            self._semaphore = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="signal-dispatcher", daemon=True)
+            self._thread.start()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _submit_trade(self, trader_id, trade_pair, order_type, leverage) -> bool:
+        signal_api_url = SIGNAL_API_BASE_URL.format(id=trader_id)
+        params = {
+            "api_key": SIGNAL_API_KEY,
+            "trade_pair": trade_pair,
+            "order_type": order_type,
+            "leverage": leverage
+        }
+        logger.info(f"SIGNAL API REQUEST {trader_id} {trade_pair} {order_type} {leverage}")
+        session = await self._get_session()
+        async with self._semaphore:
+            async with signal_throttler:
+                async with session.post(signal_api_url, json=params) as response:
+                    response_text = await response.text()
+                    logger.info(f"Submit trade signal sent. Response: {response.status} {response_text}")
+                    return response.status == 200
+
+    def submit(self, trader_id, trade_pair, order_type, leverage) -> Future:
+        """
+        Hand a signal to the dispatcher without blocking, the Future resolves to True on a 200
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(
+            self._submit_trade(trader_id, trade_pair, order_type, leverage), self._loop
+        )
+
+    def submit_many(self, signals: List[Tuple]) -> List[Future]:
+        """
+        Submit a batch of (trader_id, trade_pair, order_type, leverage) signals, sent concurrently
+        """
+        return [self.submit(*signal) for signal in signals]
+
+    async def send(self, trader_id, trade_pair, order_type, leverage) -> bool:
+        """
+        Submit from a coroutine running on another event loop
+        """
+        return await asyncio.wrap_future(self.submit(trader_id, trade_pair, order_type, leverage))
+
+
+signal_dispatcher = SignalDispatcher()
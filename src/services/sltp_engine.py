@@ -0,0 +1,222 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from src.models.transaction import OrderType, Status, Transaction
+from src.utils.redis_manager import PositionsSnapshot
+
+
+@dataclass
+class PositionColumns:
+    """
+    Column view of the monitored positions, one array entry per position.
+    Nullable database columns are loaded as NaN so comparisons on them are False.
+    """
+    positions: List[Transaction]
+    order_ids: List[int]
+    keys: List[str]
+    trade_pairs: List[str]
+    is_open: np.ndarray
+    is_pending: np.ndarray
+    is_buy: np.ndarray
+    trailing: np.ndarray
+    stop_loss: np.ndarray
+    cumulative_stop_loss: np.ndarray
+    cumulative_take_profit: np.ndarray
+    entry_price: np.ndarray
+    initial_price: np.ndarray
+    limit_order: np.ndarray
+    leverage: np.ndarray
+    average_entry_price: np.ndarray
+
+    def __len__(self):
+        return len(self.positions)
+
+
+@dataclass
+class RedisColumns:
+    """
+    Values read from redis for the rows of a PositionColumns.
+    `present` is False where the position has no entry in the positions hash,
+    `stop_loss` is the trailing stop loss last written to sl_positions (NaN if none).
+    """
+    present: np.ndarray
+    price: np.ndarray
+    profit_loss: np.ndarray
+    closed: np.ndarray
+    stop_loss: np.ndarray
+    bid: np.ndarray
+    ask: np.ndarray
+    values: List[Optional[list]]
+
+
+@dataclass
+class SLTPDecisions:
+    """
+    Masks produced by a single evaluation pass
+    """
+    trail: np.ndarray
+    trail_price: np.ndarray
+    new_stop_loss: np.ndarray
+    close: np.ndarray
+    missing: np.ndarray
+    unusable: np.ndarray
+    open: np.ndarray
+    open_price: np.ndarray
+    limit_move: np.ndarray
+    no_quotes: np.ndarray
+
+
+def _column(positions, attr) -> np.ndarray:
+    return np.array([np.nan if getattr(p, attr) is None else getattr(p, attr) for p in positions], dtype=np.float64)
+
+
+def build_position_columns(positions: List[Transaction]) -> PositionColumns:
+    """
+    Load the monitored positions into numpy column arrays
+    """
+    return PositionColumns(
+        positions=list(positions),
+        order_ids=[p.order_id for p in positions],
+        keys=[f"{p.trade_pair}-{p.trader_id}" for p in positions],
+        trade_pairs=[p.trade_pair for p in positions],
+        is_open=np.array([p.status in [Status.open, Status.adjust_processing] for p in positions], dtype=bool),
+        is_pending=np.array([p.status == Status.pending for p in positions], dtype=bool),
+        is_buy=np.array([p.order_type == OrderType.buy for p in positions], dtype=bool),
+        trailing=np.array([bool(p.trailing) for p in positions], dtype=bool),
+        stop_loss=_column(positions, "stop_loss"),
+        cumulative_stop_loss=_column(positions, "cumulative_stop_loss"),
+        cumulative_take_profit=_column(positions, "cumulative_take_profit"),
+        entry_price=_column(positions, "entry_price"),
+        initial_price=_column(positions, "initial_price"),
+        limit_order=_column(positions, "limit_order"),
+        leverage=_column(positions, "cumulative_leverage"),
+        average_entry_price=_column(positions, "average_entry_price"),
+    )
+
+
+def build_redis_columns(columns: PositionColumns, snapshot: PositionsSnapshot) -> RedisColumns:
+    """
+    Load a redis snapshot of the positions (aligned with columns.keys) into arrays
+    """
+    size = len(columns)
+    present = np.zeros(size, dtype=bool)
+    price = np.zeros(size, dtype=np.float64)
+    profit_loss = np.zeros(size, dtype=np.float64)
+    closed = np.zeros(size, dtype=bool)
+
+    for i, value in enumerate(snapshot.positions):
+        if not value:
+            continue
+        present[i] = True
+        price[i] = value[1] or 0.0
+        profit_loss[i] = value[2] or 0.0
+        closed[i] = bool(value[-1])
+
+    stop_loss = np.array([np.nan if value is None else value for value in snapshot.stop_losses], dtype=np.float64)
+    bid = np.array([snapshot.quotes.get(tp, (0.0, 0.0))[0] for tp in columns.trade_pairs], dtype=np.float64)
+    ask = np.array([snapshot.quotes.get(tp, (0.0, 0.0))[1] for tp in columns.trade_pairs], dtype=np.float64)
+
+    return RedisColumns(present=present, price=price, profit_loss=profit_loss, closed=closed,
+                        stop_loss=stop_loss, bid=bid, ask=ask, values=list(snapshot.positions))
+
+
+def _trailing_limit(columns: PositionColumns) -> np.ndarray:
+    return (columns.trailing & (np.nan_to_num(columns.limit_order) != 0)
+            & (np.nan_to_num(columns.initial_price) != 0))
+
+
+def evaluate_positions(columns: PositionColumns, redis: RedisColumns) -> SLTPDecisions:
+    """
+    Vectorized equivalent of monitor_position for every row at once.
+
+    OPEN / ADJUST-PROCESSING: trailing stop loss moves first, the close check then
+    uses the moved stop loss, same as update_trailing_stop_loss + check_open_position.
+    PENDING: fill or re-anchor as in check_pending_position / check_trailing_limit.
+    """
+    c = columns
+    with np.errstate(invalid="ignore", divide="ignore"):
+        valid_quotes = (redis.bid != 0) & (redis.ask != 0)
+        market = np.where(c.is_buy, redis.bid, redis.ask)
+
+        # ---------------------------- OPENED POSITION ---------------------------------
+        favorable = np.where(c.is_buy, redis.bid > c.entry_price, redis.ask < c.entry_price)
+        trail = c.is_open & c.trailing & (c.stop_loss > 0) & valid_quotes & favorable
+        new_stop_loss = np.where(trail, c.stop_loss * market / c.entry_price, c.cumulative_stop_loss)
+
+        usable = redis.present & (redis.price != 0) & ~redis.closed
+        profit_loss = redis.profit_loss
+        stop_loss_hit = (profit_loss <= 0) & (new_stop_loss > 0) & (profit_loss <= -new_stop_loss)
+        take_profit_hit = (profit_loss > 0) & (c.cumulative_take_profit > 0) & (profit_loss >= c.cumulative_take_profit)
+        close = c.is_open & usable & (stop_loss_hit | take_profit_hit)
+        missing = c.is_open & ~redis.present
+
+        # ---------------------------- PENDING POSITION --------------------------------
+        pending = c.is_pending & valid_quotes
+        trailing_limit = _trailing_limit(c)
+
+        trailing_fill = np.where(c.is_buy, redis.bid >= c.entry_price, redis.ask <= c.entry_price)
+        trailing_move = ~trailing_fill & np.where(c.is_buy, redis.bid < c.initial_price,
+                                                  redis.ask > c.initial_price)
+        plain_fill = np.where(c.is_buy, redis.bid <= c.entry_price, redis.ask >= c.entry_price)
+
+        open_ = pending & np.where(trailing_limit, trailing_fill, plain_fill)
+        limit_move = pending & trailing_limit & trailing_move
+
+    return SLTPDecisions(
+        trail=trail,
+        trail_price=market,
+        new_stop_loss=new_stop_loss,
+        close=close,
+        missing=missing,
+        unusable=c.is_open & redis.present & ~usable,
+        open=open_,
+        open_price=market,
+        limit_move=limit_move,
+        no_quotes=c.is_pending & ~valid_quotes,
+    )
+
+
+def compute_trigger_prices(columns: PositionColumns, skip: Optional[np.ndarray] = None) -> dict:
+    """
+    Price levels at which the next evaluation of each position can fire.
+
+    Returns {trade_pair: [[order_id, is_buy, above, price], ...]}. A trigger is crossed
+    when the bid (LONG) or ask (SHORT) is >= price if `above`, <= price otherwise.
+    SL/TP levels of open positions are estimated from the average entry price and
+    leverage without fees, they only decide when to run the real evaluation early.
+    """
+    c = columns
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sign = np.where(c.is_buy, 1.0, -1.0)
+        base = np.where(np.nan_to_num(c.average_entry_price) != 0, c.average_entry_price, c.entry_price)
+        stop_loss_price = base * (1 - sign * c.cumulative_stop_loss / (100 * c.leverage))
+        take_profit_price = base * (1 + sign * c.cumulative_take_profit / (100 * c.leverage))
+        trailing_limit = _trailing_limit(c)
+        pending = c.is_pending & ~trailing_limit
+
+        kinds = [
+            # stop loss: LONG falls below, SHORT rises above
+            (c.is_open & (c.cumulative_stop_loss > 0), ~c.is_buy, stop_loss_price),
+            # take profit: LONG rises above, SHORT falls below
+            (c.is_open & (c.cumulative_take_profit > 0), c.is_buy, take_profit_price),
+            # trailing stop loss moves on any favorable move
+            (c.is_open & c.trailing & (c.stop_loss > 0), c.is_buy, c.entry_price),
+            # limit fill
+            (pending, ~c.is_buy, c.entry_price),
+            # trailing limit fill and re-anchor
+            (c.is_pending & trailing_limit, c.is_buy, c.entry_price),
+            (c.is_pending & trailing_limit, ~c.is_buy, c.initial_price),
+        ]
+
+    triggers = {}
+    for mask, above, price in kinds:
+        mask = mask & np.isfinite(price) & (price > 0)
+        if skip is not None:
+            mask &= ~skip
+        for i in mask.nonzero()[0]:
+            triggers.setdefault(c.trade_pairs[i], []).append(
+                [c.order_ids[i], bool(c.is_buy[i]), bool(above[i]), float(price[i])]
+            )
+    return triggers
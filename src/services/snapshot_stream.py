@@ -0,0 +1,152 @@
+import logging
+
+try:
+    import ijson
+except ImportError:  # streaming decode is optional, snapshots are then decoded with response.json()
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _build(events, event, value):
+    """
+    materialize the value starting with (event, value)
+    """
+    if event == "start_map":
+        result = {}
+        for event, key in events:
+            if event == "end_map":
+                return result
+            result[key] = _build(events, *next(events))
+    if event == "start_array":
+        result = []
+        for event, value in events:
+            if event == "end_array":
+                return result
+            result.append(_build(events, event, value))
+    return value
+
+
+def _skip(events, event):
+    """
+    consume the value starting with event without building it
+    """
+    if event not in ("start_map", "start_array"):
+        return
+    depth = 1
+    for event, _ in events:
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _items(events):
+    """
+    (key, first event, first value) of the map whose start_map was just consumed,
+    the caller must consume every value
+    """
+    for event, key in events:
+        if event == "end_map":
+            return
+        yield key, *next(events)
+
+
+def _summarize_miner(events, event, value) -> dict:
+    """
+    only what the top traders computation needs from a miner that is not tracked:
+    its all time returns and the number of positions per trade pair
+    """
+    summary = {"all_time_returns": None, "trade_pair_counts": {}}
+    if event != "start_map":
+        _skip(events, event)
+        return summary
+
+    counts = summary["trade_pair_counts"]
+    for key, event, value in _items(events):
+        if key == "all_time_returns":
+            summary["all_time_returns"] = _build(events, event, value)
+        elif key == "positions" and event == "start_array":
+            for event, value in events:
+                if event == "end_array":
+                    break
+                if event != "start_map":
+                    _skip(events, event)
+                    continue
+                for position_key, event, value in _items(events):
+                    if position_key == "trade_pair" and event == "start_array":
+                        trade_pair = _build(events, event, value)
+                        if trade_pair:
+                            counts[trade_pair[0]] = counts.get(trade_pair[0], 0) + 1
+                    else:
+                        _skip(events, event)
+        else:
+            _skip(events, event)
+    return summary
+
+
+def _filter_miners(events, event, value, hot_keys, summarize=False) -> dict:
+    """
+    {hot_key: content} map keeping only the tracked hot keys, the others are
+    summarized or dropped
+    """
+    miners = {}
+    if event != "start_map":
+        _skip(events, event)
+        return miners
+
+    for hot_key, event, value in _items(events):
+        if hot_key in hot_keys:
+            miners[hot_key] = _build(events, event, value)
+        elif summarize:
+            miners[hot_key] = _summarize_miner(events, event, value)
+        else:
+            _skip(events, event)
+    return miners
+
+
+def decode_main_net(stream, hot_keys) -> dict:
+    """
+    Mainnet positions payload, {hot_key: {"positions": [...], "all_time_returns": ...}}.
+    Untracked miners are reduced to {"all_time_returns", "trade_pair_counts"}.
+    """
+    events = iter(ijson.basic_parse(stream, use_float=True))
+    return _filter_miners(events, *next(events), hot_keys, summarize=True)
+
+
+def decode_testnet(stream, hot_keys) -> dict:
+    """
+    Testnet validator checkpoint, positions and perf_ledgers are kept for the tracked hot keys only
+    """
+    events = iter(ijson.basic_parse(stream, use_float=True))
+    event, _ = next(events)
+    checkpoint = {}
+    if event != "start_map":
+        return checkpoint
+
+    for key, event, value in _items(events):
+        if key in ("positions", "perf_ledgers"):
+            checkpoint[key] = _filter_miners(events, event, value, hot_keys)
+        else:
+            checkpoint[key] = _build(events, event, value)
+    return checkpoint
+
+
+class StreamingDecoder:
+    """
+    Decodes a snapshot response incrementally, keeping only the hot keys returned by `hot_keys`
+    """
+
+    def __init__(self, decode, hot_keys):
+        self.decode = decode
+        self.hot_keys = hot_keys
+
+    @property
+    def available(self) -> bool:
+        return ijson is not None
+
+    def __call__(self, response, hot_keys) -> dict:
+        response.raw.decode_content = True
+        return self.decode(response.raw, hot_keys)
@@ -13,6 +13,7 @@ from src.schemas.tournament import TournamentCreate, TournamentUpdate
 from src.schemas.user import PaymentCreate
 from src.services.email_service import send_mail
 from src.services.payment_service import create_challenge, create_payment_entry, register_and_update_challenge
+from src.services.trader_directory import challenges_changed
 from src.services.user_service import get_firebase_user
 from src.validations.time_validations import convert_to_etc
 
@@ -112,6 +113,7 @@ def register_tournament_payment(db, tournament_id, firebase_id, amount, referral
     tournament.challenges.append(new_challenge)
     db.add(new_challenge)
     db.commit()
+    challenges_changed(new_challenge.trader_id)
     db.refresh(new_challenge)
 
     context = {
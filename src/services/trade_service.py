@@ -1,6 +1,8 @@
+import time
 from datetime import datetime, timezone
 
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
 from sqlalchemy.future import select
 from sqlalchemy.sql import and_, or_, text
 from sqlalchemy.sql import func
@@ -16,6 +18,47 @@ from src.schemas.transaction import (
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 from src.schemas.trader import HotKeyMap
+from src.utils.logging import setup_logging
+from src.utils.redis_manager import (
+    get_user_hotkey_map_version,
+    get_cached_user_hotkey_map as get_redis_user_hotkey_map,
+    set_cached_user_hotkey_map,
+    invalidate_user_hotkey_map as bump_user_hotkey_map_version,
+)
+
+logger = setup_logging()
+
+
+class TransactionUnitOfWork:
+    """
+    Collects the transaction updates of one SL/TP monitor pass, keyed by order_id, and
+    flushes them with a single executemany UPDATE instead of a commit per row.
+    """
+
+    def __init__(self):
+        self.updates: Dict[int, Dict[str, Any]] = {}
+
+    def stage(self, order_id: int, values: Dict[str, Any]):
+        self.updates.setdefault(order_id, {}).update(values)
+
+    def flush(self, db: Session):
+        if not self.updates:
+            return
+        rows = [{"order_id": order_id, **values} for order_id, values in self.updates.items()]
+        self.updates = {}
+        try:
+            db.execute(update(Transaction), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Bulk transaction update failed, applying {len(rows)} rows one by one: {e}")
+            for row in rows:
+                try:
+                    db.execute(update(Transaction), [row])
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Could not update transaction {row['order_id']}: {e}")
 
 
 async def create_transaction(
@@ -219,8 +262,27 @@ def close_transaction_sync(
     average_entry_price: float = 0.0,
     operation_type="close",
     status="CLOSED",
+    uow: TransactionUnitOfWork = None,
 ):
     close_time = datetime.utcnow()
+    values = {
+        "operation_type": operation_type,
+        "status": status,
+        "old_status": old_status,
+        "close_time": close_time,
+        "close_price": close_price,
+        "profit_loss": profit_loss,
+        "modified_by": "monitor_position_sync",
+        "order_level": order_level,
+        "profit_loss_without_fee": profit_loss_without_fee,
+        "taoshi_profit_loss": taoshi_profit_loss,
+        "taoshi_profit_loss_without_fee": taoshi_profit_loss_without_fee,
+        "average_entry_price": average_entry_price,
+    }
+    if uow is not None:
+        uow.stage(order_id, values)
+        return
+
     statement = text(
         """
             UPDATE transactions
@@ -240,24 +302,7 @@ def close_transaction_sync(
         """
     )
 
-    db.execute(
-        statement,
-        {
-            "operation_type": operation_type,
-            "status": status,
-            "old_status": old_status,
-            "close_time": close_time,
-            "close_price": close_price,
-            "profit_loss": profit_loss,
-            "order_id": order_id,
-            "modified_by": "monitor_position_sync",
-            "order_level": order_level,
-            "profit_loss_without_fee": profit_loss_without_fee,
-            "taoshi_profit_loss": taoshi_profit_loss,
-            "taoshi_profit_loss_without_fee": taoshi_profit_loss_without_fee,
-            "average_entry_price": average_entry_price,
-        },
-    )
+    db.execute(statement, {**values, "order_id": order_id})
     db.commit()
 
 
@@ -268,6 +313,7 @@ def update_transaction_sync(
     entry_price: float,
     old_status: str,
     status: str,
+    uow: TransactionUnitOfWork = None,
 ):
     """
     Update a transaction record with processing status.
@@ -279,8 +325,18 @@ def update_transaction_sync(
         entry_price: float - entry price for the position
         old_status: str - previous status of the transaction
         status: str - new status to set
+        uow: TransactionUnitOfWork - stage the update instead of committing it
     """
     open_time = datetime.utcnow()
+    if uow is not None:
+        uow.stage(order_id, {
+            "status": status,
+            "old_status": old_status,
+            "open_time": open_time,
+            "entry_price": entry_price,
+            "modified_by": "monitor_position_sync",
+        })
+        return
 
     statement = text(
         """
@@ -333,15 +389,21 @@ async def update_transaction_async(
 
 
 def update_transaction_sync_gen(
-    db: Session, transaction: Transaction, updated_values: TransactionUpdateDatabaseGen
+    db: Session, transaction: Transaction, updated_values: TransactionUpdateDatabaseGen,
+    uow: TransactionUnitOfWork = None,
 ):
     """
     Update a transaction record with provided values status.
-
+    With a unit of work the values are staged and flushed with the rest of the pass.
     """
-    for key, value in updated_values.model_dump(exclude_unset=True).items():
+    values = updated_values.model_dump(exclude_unset=True)
+    for key, value in values.items():
         setattr(transaction, key, value)
 
+    if uow is not None:
+        uow.stage(transaction.order_id, values)
+        return transaction
+
     try:
         db.commit()
         db.refresh(transaction)
@@ -446,8 +508,11 @@ async def get_non_closed_position(
     return transaction
 
 
-def get_SLTP_pending_positions(db: Session) -> List[Transaction]:
-    """Get all SLTP_pending_positions positions with proper async handling"""
+def SLTP_pending_positions_query(order_ids: List[int] = None, shard: int = None, shards: int = 1):
+    """
+    Query of the positions watched by the SL/TP monitor, optionally only the given order ids
+    or the slice of a shard, positions are partitioned by trader_id % shards.
+    """
 
     # Base query for all statuses
     base_query = select(Transaction)
@@ -473,12 +538,27 @@ def get_SLTP_pending_positions(db: Session) -> List[Transaction]:
 
     # Apply the combined conditions
     query = base_query.where(status_conditions)
+    if order_ids is not None:
+        query = query.where(Transaction.order_id.in_(order_ids))
+    if shard is not None:
+        query = query.where(Transaction.trader_id % shards == shard)
+    return query
 
-    result = db.execute(query)
+
+def get_SLTP_pending_positions(db: Session, order_ids: List[int] = None, shard: int = None,
+                               shards: int = 1) -> List[Transaction]:
+    """Get all SLTP_pending_positions positions with proper async handling, optionally only the given order ids or shard"""
+
+    result = db.execute(SLTP_pending_positions_query(order_ids, shard, shards))
     positions = result.scalars().unique().all()
     return positions
 
 
+async def get_SLTP_pending_positions_async(db: AsyncSession) -> List[Transaction]:
+    result = await db.execute(SLTP_pending_positions_query())
+    return result.scalars().unique().all()
+
+
 def get_user_hotkey_map(db: Session) -> HotKeyMap:
     """
     Get a mapping of hot_keys to user details from challenges and firebase_users tables.
@@ -512,7 +592,46 @@ def get_user_hotkey_map(db: Session) -> HotKeyMap:
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"DB Error fetching user hotkey map: {str(e)}",
         )
-    return HotKeyMap(data=user_map)
+    # jsonb_object_agg gives NULL when there are no challenges
+    return HotKeyMap(data=user_map or {})
+
+
+# hot key map of this process and the version it was built for
+user_hotkey_map_cache = {"version": None, "data": None, "loaded_at": 0.0}
+USER_HOTKEY_MAP_TTL = 300  # safety net for writes that do not invalidate the map
+
+
+def get_cached_user_hotkey_map(db: Session) -> HotKeyMap:
+    """
+    get_user_hotkey_map served from memory while its version in redis is unchanged,
+    then from the redis copy and only then from the database.
+    Every call returns new UserDetails objects, callers are free to modify them.
+    """
+    try:
+        version = get_user_hotkey_map_version()
+        if (user_hotkey_map_cache["data"] is None or user_hotkey_map_cache["version"] != version
+                or time.monotonic() - user_hotkey_map_cache["loaded_at"] > USER_HOTKEY_MAP_TTL):
+            version, data = get_redis_user_hotkey_map()
+            if data is None:
+                data = get_user_hotkey_map(db).model_dump()["data"]
+                set_cached_user_hotkey_map(version, data, USER_HOTKEY_MAP_TTL)
+            user_hotkey_map_cache.update(version=version, data=data, loaded_at=time.monotonic())
+        return HotKeyMap(data=user_hotkey_map_cache["data"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"User hotkey map cache unavailable, reading it from the database: {e}")
+        return get_user_hotkey_map(db)
+
+
+def invalidate_user_hotkey_map():
+    """
+    Call after a write to challenges or firebase_users that changes hot keys or user details
+    """
+    try:
+        bump_user_hotkey_map_version()
+    except Exception as e:
+        logger.error(f"Failed to invalidate the user hotkey map: {e}")
 
 
 async def get_transaction_by_order_id(db: AsyncSession, order_id) -> Transaction:
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from src.database_tasks import TaskSessionLocal_
+from src.models.challenge import Challenge
+from src.services.trade_service import invalidate_user_hotkey_map
+from src.utils.async_redis_manager import subscribe_trader_updates as subscribe_trader_updates_async
+from src.utils.redis_manager import publish_trader_updates, subscribe_trader_updates
+
+logger = logging.getLogger(__name__)
+
+
+def all_challenges_query():
+    return select(Challenge).order_by(Challenge.id)
+
+
+def trader_challenge_query(trader_id: int):
+    return select(Challenge).where(Challenge.trader_id == trader_id).order_by(Challenge.id).limit(1)
+
+
+@dataclass(frozen=True)
+class TraderRecord:
+    """
+    The challenge columns needed to serve a trader, detached from any session
+    """
+    id: int
+    trader_id: int
+    hot_key: str
+    challenge: str
+    active: str
+    status: Optional[str]
+    tournament_id: Optional[int]
+    user_id: Optional[int]
+
+    @classmethod
+    def from_challenge(cls, challenge: Challenge) -> "TraderRecord":
+        return cls(
+            id=challenge.id,
+            trader_id=challenge.trader_id,
+            hot_key=challenge.hot_key,
+            challenge=challenge.challenge,
+            active=challenge.active,
+            status=challenge.status,
+            tournament_id=challenge.tournament_id,
+            user_id=challenge.user_id,
+        )
+
+
+class TraderDirectory:
+    """
+    trader_id -> TraderRecord lookups served from memory.
+
+    The whole challenges table is loaded once, a miss loads only that trader and an unknown
+    trader id is remembered for `negative_ttl` seconds so repeated lookups don't hit the database.
+    Writers call `challenges_changed` which publishes the changed trader ids, every process
+    (API and celery workers) drops those entries before its next lookup. The celery workers
+    read them from a sync subscription on lookup. The API process follows them from a
+    background task started with `start_updates`, `get_async` then makes no redis call and
+    takes no thread lock on the event loop.
+    """
+
+    def __init__(self, negative_ttl=30.0, ttl=600.0, poll_interval=5.0, retry_interval=1.0):
+        self.negative_ttl = negative_ttl
+        self.ttl = ttl  # safety net for writes that are not published
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._lock = threading.RLock()
+        self._records = {}  # trader_id -> (TraderRecord or None, expires at)
+        self._loaded_at = None
+        self._pubsub = None
+        self._pid = None
+        self._updates_task = None
+        self._updates_pid = None
+
+    def _follows_updates(self) -> bool:
+        return self._updates_pid == os.getpid()
+
+    def _subscribe(self):
+        # subscribed lazily and once per process, celery forks its workers after import
+        if self._follows_updates() or self._pid == os.getpid() and self._pubsub is not None:
+            return
+        self._pid = os.getpid()
+        self._pubsub = None
+        self._records = {}
+        self._loaded_at = None
+        try:
+            self._pubsub = subscribe_trader_updates()
+        except Exception as e:
+            logger.error(f"Trader directory updates unavailable, entries expire after {self.ttl}s: {e}")
+
+    def _apply_updates(self):
+        if self._pubsub is None:
+            return
+        try:
+            while message := self._pubsub.get_message():
+                self._apply_update(message["data"])
+        except Exception as e:
+            # updates may have been missed, resubscribe and reload
+            logger.error(f"Lost the trader directory updates: {e}")
+            self._pubsub = None
+            self._subscribe()
+
+    def _apply_update(self, data: str):
+        if data == "*":
+            self._reset()
+        else:
+            self._records.pop(int(data), None)
+
+    def _reset(self):
+        self._records = {}
+        self._loaded_at = None
+
+    async def start_updates(self):
+        """
+        Follow the published updates from a background task of the running loop
+        """
+        pubsub = await subscribe_trader_updates_async()
+        self._updates_pid = os.getpid()
+        self._updates_task = asyncio.create_task(self._follow_updates(pubsub))
+
+    async def stop_updates(self):
+        if self._updates_task:
+            self._updates_task.cancel()
+            await asyncio.gather(self._updates_task, return_exceptions=True)
+            self._updates_task = None
+            self._updates_pid = None
+
+    async def _follow_updates(self, pubsub):
+        try:
+            while True:
+                try:
+                    message = await pubsub.get_message(timeout=self.poll_interval)
+                    if message:
+                        self._apply_update(message["data"])
+                except Exception as e:
+                    # updates may have been missed, the pubsub subscribes again when it reconnects
+                    logger.error(f"Lost the trader directory updates, reloading: {e}")
+                    self._reset()
+                    await asyncio.sleep(self.retry_interval)
+        finally:
+            await pubsub.aclose()
+
+    def _expired(self, now) -> bool:
+        return self._loaded_at is None or now - self._loaded_at > self.ttl
+
+    def _store_all(self, challenges, now: float):
+        records = {}
+        for challenge in challenges:
+            records.setdefault(challenge.trader_id, (TraderRecord.from_challenge(challenge), now + self.ttl))
+        self._records = records
+        self._loaded_at = now
+        logger.info(f"Trader directory loaded {len(records)} traders")
+
+    def _store_one(self, trader_id: int, challenge, now: float) -> Optional[TraderRecord]:
+        if not challenge:
+            self._records[trader_id] = (None, now + self.negative_ttl)
+            return None
+        record = TraderRecord.from_challenge(challenge)
+        self._records[trader_id] = (record, now + self.ttl)
+        return record
+
+    def _lookup(self, trader_id: int, now: float):
+        """
+        (found, record) from memory, record is None for a known unknown trader id
+        """
+        if self._pid != os.getpid():
+            self._subscribe()
+        self._apply_updates()
+        return self._cached(trader_id, now)
+
+    def _cached(self, trader_id: int, now: float):
+        if self._expired(now):
+            return False, None
+        entry = self._records.get(trader_id)
+        if entry is not None and entry[1] > now:
+            return True, entry[0]
+        return False, None
+
+    def load(self):
+        """
+        (Re)load every trader with a single query
+        """
+        with self._lock:
+            self._subscribe()
+            self._apply_updates()
+            with TaskSessionLocal_() as db:
+                challenges = db.scalars(all_challenges_query()).all()
+            self._store_all(challenges, time.monotonic())
+
+    def get(self, trader_id: int) -> Optional[TraderRecord]:
+        with self._lock:
+            now = time.monotonic()
+            found, record = self._lookup(trader_id, now)
+            if found:
+                return record
+            if self._expired(now):
+                self.load()
+                entry = self._records.get(trader_id)
+                return entry[0] if entry else self._store_one(trader_id, None, now)
+            with TaskSessionLocal_() as db:
+                challenge = db.scalar(trader_challenge_query(trader_id))
+            return self._store_one(trader_id, challenge, now)
+
+    async def get_async(self, db: AsyncSession, trader_id: int) -> Optional[TraderRecord]:
+        """
+        get for coroutines, misses are loaded through the async session of the caller and
+        the updates come from `start_updates`
+        """
+        now = time.monotonic()
+        found, record = self._cached(trader_id, now)
+        if found:
+            return record
+        if self._expired(now):
+            challenges = (await db.scalars(all_challenges_query())).all()
+            self._store_all(challenges, now)
+            entry = self._records.get(trader_id)
+            return entry[0] if entry else self._store_one(trader_id, None, now)
+        challenge = await db.scalar(trader_challenge_query(trader_id))
+        return self._store_one(trader_id, challenge, now)
+
+    def hot_key(self, trader_id: int) -> Optional[str]:
+        record = self.get(trader_id)
+        return record.hot_key if record else None
+
+    def source(self, trader_id: int) -> Optional[str]:
+        record = self.get(trader_id)
+        return record.challenge if record else None
+
+
+trader_directory = TraderDirectory()
+
+
+def challenges_changed(*trader_ids):
+    """
+    Call after a write to challenges, the trader ids that changed or none when unknown
+    """
+    invalidate_user_hotkey_map()
+    try:
+        publish_trader_updates(trader_ids)
+    except Exception as e:
+        logger.error(f"Failed to publish trader updates {trader_ids}: {e}")
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import MONITOR_SHARDS
+from src.models.transaction import Transaction
+from src.services.sltp_engine import build_position_columns, compute_trigger_prices
+from src.services.trade_service import get_SLTP_pending_positions_async
+from src.utils.async_redis_manager import publish_trigger_update
+from src.utils.celery_utils import make_celery
+from src.utils.redis_manager import (
+    get_trigger_prices,
+    get_trigger_prices_version,
+    subscribe_trigger_updates,
+)
+
+logger = logging.getLogger(__name__)
+
+TRIGGERED_POSITIONS_TASK = 'src.tasks.position_monitor_sync.monitor_triggered_positions'
+
+
+class TriggerIndex:
+    """
+    Trigger prices of the monitored positions, kept sorted per trade pair, side and direction.
+
+    LONG triggers are compared with the bid and SHORT triggers with the ask, so a quote
+    finds every crossed trigger with a bisect and a slice instead of scanning all positions.
+    """
+
+    def __init__(self):
+        self.books = {}  # (trade_pair, is_buy, above) -> ([sorted prices], [order ids])
+        self.orders = {}  # order_id -> [(book key, price)]
+
+    def load(self, triggers: dict):
+        """
+        Replace the whole index with {trade_pair: [[order_id, is_buy, above, price], ...]}
+        """
+        entries = {}
+        self.orders = {}
+        for trade_pair, rows in triggers.items():
+            for order_id, is_buy, above, price in rows:
+                key = (trade_pair, is_buy, above)
+                entries.setdefault(key, []).append((price, order_id))
+                self.orders.setdefault(order_id, []).append((key, price))
+
+        self.books = {}
+        for key, rows in entries.items():
+            rows.sort()
+            self.books[key] = ([price for price, _ in rows], [order_id for _, order_id in rows])
+
+    def add(self, order_id: int, trade_pair: str, rows: list):
+        """
+        Replace the triggers of a single order
+        """
+        self.remove(order_id)
+        for _, is_buy, above, price in rows:
+            key = (trade_pair, is_buy, above)
+            prices, order_ids = self.books.setdefault(key, ([], []))
+            i = bisect_right(prices, price)
+            prices.insert(i, price)
+            order_ids.insert(i, order_id)
+            self.orders.setdefault(order_id, []).append((key, price))
+
+    def remove(self, order_id: int):
+        for key, price in self.orders.pop(order_id, []):
+            prices, order_ids = self.books[key]
+            i = bisect_left(prices, price)
+            while i < len(prices) and prices[i] == price:
+                if order_ids[i] == order_id:
+                    del prices[i]
+                    del order_ids[i]
+                    break
+                i += 1
+
+    def crossed(self, trade_pair: str, bid: float, ask: float) -> list:
+        """
+        order ids whose trigger price is crossed by the quote
+        """
+        order_ids = []
+        for is_buy, market in ((True, bid), (False, ask)):
+            book = self.books.get((trade_pair, is_buy, True))
+            if book:
+                order_ids.extend(book[1][:bisect_right(book[0], market)])
+            book = self.books.get((trade_pair, is_buy, False))
+            if book:
+                order_ids.extend(book[1][bisect_left(book[0], market):])
+        return list(dict.fromkeys(order_ids))
+
+
+class TriggerDispatcher:
+    """
+    Checks every incoming quote against the trigger index and enqueues the crossed
+    positions for an immediate evaluation instead of waiting for the next beat.
+
+    The index is rebuilt from the transactions table at startup, follows the per-order
+    updates published by the trade routes and is reconciled with the table published
+    by every monitor pass.
+    """
+
+    def __init__(self, refresh_interval=1.0, poll_interval=0.25, cooldown=2.0, expires=10):
+        self.index = TriggerIndex()
+        self.version = None
+        self.refresh_interval = refresh_interval
+        self.poll_interval = poll_interval
+        self.cooldown = cooldown  # seconds before the same order can be enqueued again
+        self.expires = expires
+        self.enqueued = {}
+        self.celery = make_celery("trigger_dispatcher")
+        self._watch_task = None
+
+    async def rebuild(self, db: AsyncSession):
+        try:
+            positions = await get_SLTP_pending_positions_async(db)
+            self.version = get_trigger_prices_version()
+            self.index.load(compute_trigger_prices(build_position_columns(positions)) if positions else {})
+            logger.info(f"Trigger index rebuilt from {len(positions)} positions")
+        except Exception as e:
+            logger.error(f"Failed to rebuild trigger index from the transactions table: {e}")
+
+    def refresh(self):
+        version = get_trigger_prices_version()
+        if version == self.version:
+            return
+        self.index.load(get_trigger_prices(MONITOR_SHARDS))
+        self.version = version
+
+        now = time.monotonic()
+        self.enqueued = {k: v for k, v in self.enqueued.items() if now - v < self.cooldown}
+
+    def apply_updates(self, pubsub):
+        while message := pubsub.get_message():
+            order_id, trade_pair, rows = json.loads(message["data"])
+            self.index.add(order_id, trade_pair, rows)
+
+    async def watch(self):
+        pubsub = subscribe_trigger_updates()
+        refreshed = 0.0
+        while True:
+            try:
+                self.apply_updates(pubsub)
+                if time.monotonic() - refreshed >= self.refresh_interval:
+                    self.refresh()
+                    refreshed = time.monotonic()
+            except Exception as e:
+                logger.error(f"Failed to refresh trigger prices: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self.watch())
+
+    def on_quote(self, trade_pair: str, bid: float, ask: float):
+        if not bid or not ask:
+            return
+        order_ids = self.index.crossed(trade_pair, bid, ask)
+        if not order_ids:
+            return
+
+        now = time.monotonic()
+        order_ids = [o for o in order_ids if now - self.enqueued.get(o, float("-inf")) >= self.cooldown]
+        if not order_ids:
+            return
+        for order_id in order_ids:
+            self.enqueued[order_id] = now
+
+        logger.info(f"Trigger crossed for {trade_pair} bp {bid} ap {ask}: {order_ids}")
+        # the broker call is blocking, keep it off the loop reading the socket
+        asyncio.get_running_loop().run_in_executor(None, self.enqueue, order_ids)
+
+    def enqueue(self, order_ids: list):
+        try:
+            self.celery.send_task(TRIGGERED_POSITIONS_TASK, args=[order_ids], queue='position_monitoring',
+                                  expires=self.expires)
+        except Exception as e:
+            logger.error(f"Failed to enqueue triggered positions {order_ids}: {e}")
+
+
+async def publish_position_triggers(position: Transaction):
+    """
+    Keep the trigger index in sync after a position is initiated or adjusted
+    """
+    try:
+        triggers = compute_trigger_prices(build_position_columns([position]))
+        await publish_trigger_update(position.order_id, position.trade_pair, triggers.get(position.trade_pair, []))
+    except Exception as e:
+        logger.error(f"Failed to publish triggers of {position.order_id}: {e}")
+
+
+async def remove_position_triggers(position: Transaction):
+    """
+    Drop a closed position from the trigger index
+    """
+    try:
+        await publish_trigger_update(position.order_id, position.trade_pair, [])
+    except Exception as e:
+        logger.error(f"Failed to remove triggers of {position.order_id}: {e}")
+
+
+trigger_dispatcher = TriggerDispatcher()
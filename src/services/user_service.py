@@ -14,10 +14,11 @@ from src.models.firebase_user import FirebaseUser
 from src.models.users import Users
 from src.schemas.user import UsersBase, FavoriteTradePairs
 from src.services.email_service import send_mail
+from src.services.trade_service import invalidate_user_hotkey_map
+from src.services.trader_directory import challenges_changed, trader_directory
 from src.utils.logging import setup_logging
 
 logger = setup_logging()
-ambassadors = {}
 
 
 async def get_user(db: AsyncSession, trader_id: int):
@@ -120,6 +121,7 @@ def create_firebase_user(db: Session, firebase_id: str, name: str = "", email: s
         firebase_user.email = email
         firebase_user.username = username
     db.commit()
+    invalidate_user_hotkey_map()
     db.refresh(firebase_user)
     return firebase_user
 
@@ -151,6 +153,7 @@ def create_or_update_challenges(db: Session, user, challenges):
             db.add(new_challenge)
 
         db.commit()
+        challenges_changed(challenge_data.trader_id)
         db.refresh(user)
 
     return user
@@ -162,17 +165,19 @@ def construct_username(email):
 
 
 def get_challenge(trader_id: int, source=False):
-    with TaskSessionLocal_() as db:
-        challenge = db.scalar(
-            select(Challenge).where(
-                and_(Challenge.trader_id == trader_id, )
-            )
-        )
-        if not challenge:
-            return
-        if source:
-            return challenge.challenge
-        return challenge
+    """
+    TraderRecord of the trader's challenge, or only its source when `source`
+    """
+    if source:
+        return trader_directory.source(trader_id)
+    return trader_directory.get(trader_id)
+
+
+async def get_challenge_async(db: AsyncSession, trader_id: int, source=False):
+    challenge = await trader_directory.get_async(db, trader_id)
+    if source:
+        return challenge.challenge if challenge else None
+    return challenge
 
 
 def get_challenge_by_id(db: Session, challenge_id: int):
@@ -196,21 +201,8 @@ def get_challenge_for_hotkey(hot_key):
         return challenge
 
 
-def populate_ambassadors():
-    global ambassadors
-    with TaskSessionLocal_() as db:
-        challenges = db.query(Challenge).all()
-        for challenge in challenges:
-            ambassadors[challenge.trader_id] = challenge.hot_key
-
-
 def get_hot_key(trader_id: int):
-    global ambassadors
-    hot_key = ambassadors.get(trader_id)
-    if not hot_key:
-        populate_ambassadors()
-        hot_key = ambassadors.get(trader_id)
-    return hot_key
+    return trader_directory.hot_key(trader_id)
 
 
 def bulk_update_challenges(db: Session, data):
@@ -219,6 +211,7 @@ def bulk_update_challenges(db: Session, data):
         data,
     )
     db.commit()
+    challenges_changed()
 
 
 # ---------------------- USER BALANCE ------------------------------
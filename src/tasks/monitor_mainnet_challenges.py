@@ -13,6 +13,7 @@ from src.models.firebase_user import FirebaseUser
 
 from src.services.api_service import call_main_net
 from src.services.email_service import send_mail
+from src.services.trader_directory import challenges_changed
 from src.services.s3_services import send_certificate_email
 from src.utils.constants import ERROR_QUEUE_NAME
 from src.utils.redis_manager import push_to_redis_queue
@@ -51,10 +52,12 @@ def get_monitored_challenges(db: Session, challenge="test", status="In Challenge
 def update_challenge(db: Session, challenge, data):
     logger.info(f"Updating monitored challenge: {challenge.trader_id} - {challenge.hot_key}")
 
+    previous_trader_id = challenge.trader_id
     for key, value in data.items():
         setattr(challenge, key, value)
 
     db.commit()
+    challenges_changed(previous_trader_id, challenge.trader_id)
     db.refresh(challenge)
 
 
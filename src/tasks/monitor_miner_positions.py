@@ -2,13 +2,13 @@ import logging
 from datetime import datetime, timedelta
 from collections import defaultdict
 from heapq import heappush, heappop
-from src.core.celery_app import celery_app
+from src.core.celery_app import celery_app, ScheduledTask
 from src.database_tasks import TaskSessionLocal_
 from src.services.api_service import call_main_net
 from src.utils.constants import ERROR_QUEUE_NAME
-from src.utils.redis_manager import set_hash_data, set_hash_value, push_to_redis_queue, delete_hash_value
+from src.utils.redis_manager import set_hash_data_if_changed, push_to_redis_queue, update_positions_diff
 from src.validations.time_validations import convert_timestamp_to_datetime
-from src.services.trade_service import get_user_hotkey_map
+from src.services.trade_service import get_cached_user_hotkey_map
 from src.schemas.trader import HotKeyMap , UserDetails
 from src.utils.constants import TOP_TRADERS
 logger = logging.getLogger(__name__)
@@ -16,14 +16,44 @@ import json
 
 
 
-def update_position_in_redis(position , trader_id, trade_pair , hot_key):
+class PositionChanges:
+    """
+    Redis writes of a populate_redis_positions run, the last write of a key wins
+    like the sequential HSET / HDEL it replaces
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.fingerprints = {}
+        self.deletes = set()
+
+    def set(self, key, value, fingerprint):
+        self.deletes.discard(key)
+        self.values[key] = value
+        self.fingerprints[key] = fingerprint
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.fingerprints.pop(key, None)
+        self.deletes.add(key)
+
+    def write(self):
+        return update_positions_diff(self.values, self.fingerprints, self.deletes)
+
+
+def position_fingerprint(position) -> str:
+    return json.dumps([position["position_uuid"], len(position["orders"]), position["return_at_close"],
+                       position["is_closed_position"]])
+
+
+def update_position_in_redis(position , trader_id, trade_pair , hot_key, changes : PositionChanges):
          
         key = f"{trade_pair}-{trader_id}"
         current_time = datetime.utcnow() - timedelta(hours=1)
         close_time = convert_timestamp_to_datetime(position["close_ms"])
 
         if position["is_closed_position"] and current_time > close_time:
-            delete_hash_value(key)
+            changes.delete(key)
             return
 
         price, taoshi_profit_loss, taoshi_profit_loss_without_fee = position["orders"][-1]["price"], \
@@ -41,7 +71,7 @@ def update_position_in_redis(position , trader_id, trade_pair , hot_key):
             position["average_entry_price"], position["is_closed_position"]
         ]
         
-        set_hash_value(key=key, value=value)
+        changes.set(key, value, position_fingerprint(position))
         
 def add_top_trades_and_returns(trade_pair_counter : dict, k : int, trader_data : UserDetails , all_time_returns : int):
         
@@ -64,18 +94,20 @@ def add_top_trades_and_returns(trade_pair_counter : dict, k : int, trader_data :
 def populate_redis_positions(data, _type="Mainnet", top_k = 3):
       
     with TaskSessionLocal_() as db:
-        challenges : HotKeyMap = get_user_hotkey_map(db)
+        challenges : HotKeyMap = get_cached_user_hotkey_map(db)
         challenges = challenges.data
         
         logger.info('Challenges', challenges)
         
         trade_pair_counter = defaultdict(int)
+        changes = PositionChanges()
                 
         for hot_key, content in data.items():
             if not content:
                 continue
             
-            positions = content.get('positions')
+            # miners without a challenge only carry a summary, see snapshot_stream.decode_main_net
+            positions = content.get('positions') or []
             all_time_returns = content.get('all_time_returns')
             trader_data = UserDetails ( 
                                     name = '',
@@ -89,10 +121,13 @@ def populate_redis_positions(data, _type="Mainnet", top_k = 3):
 
                 if hot_key in challenges:
                     trader_data : UserDetails = challenges[hot_key]
-                    update_position_in_redis(position,  trader_data.trader_id, trade_pair, hot_key)
+                    update_position_in_redis(position,  trader_data.trader_id, trade_pair, hot_key, changes)
                     
                 
                 trade_pair_counter[trade_pair] += 1  # Increment the count for the currency pair
+
+            for trade_pair, count in content.get('trade_pair_counts', {}).items():
+                trade_pair_counter[trade_pair] += count
             
             logger.info(f'Counter {hot_key} {trade_pair_counter}')
 
@@ -105,17 +140,19 @@ def populate_redis_positions(data, _type="Mainnet", top_k = 3):
                 add_top_trades_and_returns(trade_pair_counter, top_k, trader_data, all_time_returns )       
                 
                 logger.info(f'Top Trades {trader_data}')
+                trade_pair_counter = defaultdict(int)
 
-                # Convert the model data to JSON strings before storing in Redis
+        written, deleted = changes.write()
+        logger.info(f"{_type} positions in redis: {written} written, {deleted} deleted")
 
-                serialized_data = {k: json.dumps(v.model_dump()) for k, v in challenges.items() if v.top_trader_pairs}
-                  
-                set_hash_data(TOP_TRADERS, data=serialized_data)
-                trade_pair_counter = defaultdict(int)
+        if _type == 'Mainnet' and data:
+            # Convert the model data to JSON strings before storing in Redis
+            serialized_data = {k: json.dumps(v.model_dump()) for k, v in challenges.items() if v.top_trader_pairs}
+            set_hash_data_if_changed(TOP_TRADERS, data=serialized_data)
             
 
 
-@celery_app.task(name='src.tasks.monitor_miner_positions.monitor_miner')
+@celery_app.task(name='src.tasks.monitor_miner_positions.monitor_miner', base=ScheduledTask)
 def monitor_miner():
     logger.info("Starting monitor miner positions task")
     main_net_data = call_main_net()
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from datetime import datetime
 from datetime import timedelta
@@ -15,7 +14,7 @@ from src.services.email_service import send_mail
 from src.services.fee_service import get_taoshi_values
 from src.utils.constants import ERROR_QUEUE_NAME
 from src.utils.redis_manager import push_to_redis_queue, delete_hash_value
-from src.utils.websocket_manager import websocket_manager
+from src.services.signal_dispatcher import signal_dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -102,7 +101,7 @@ def check_initiate_position(db, position, data):
                  f"are unable to get price from taoshi till 5 minutes => {position.trader_id}-{position.trade_pair}-{position.order_id}",
             queue_name=ERROR_QUEUE_NAME
         )
-        asyncio.run(websocket_manager.submit_trade(position.trader_id, position.trade_pair, "FLAT", 1))
+        signal_dispatcher.submit(position.trader_id, position.trade_pair, "FLAT", 1).result()
         data.update({
             "operation_type": "close",
             "status": "CLOSED",
@@ -143,7 +142,7 @@ def check_adjust_position(db, position, data):
                  f"are unable to get price from taoshi till 20 minutes => {position.trader_id}-{position.trade_pair}-{position.order_id}",
             queue_name=ERROR_QUEUE_NAME
         )
-        asyncio.run(websocket_manager.submit_trade(position.trader_id, position.trade_pair, "FLAT", 1))
+        signal_dispatcher.submit(position.trader_id, position.trade_pair, "FLAT", 1).result()
         data.update({
             "operation_type": "close",
             "status": "CLOSED",
@@ -174,7 +173,7 @@ def check_close_position(db, position, data, closed):
         if data["profit_loss"] > position.max_profit_loss:
             data["max_profit_loss"] = data["profit_loss"]
         update_position(db, position, data)
-        delete_hash_value(key)
+        delete_hash_value(key, publish=True)
         return
 
     # close position if it's been 5 minutes and price is still zero
@@ -186,12 +185,12 @@ def check_close_position(db, position, data, closed):
                  f"are unable to get price from taoshi till 5 minutes => {position.trader_id}-{position.trade_pair}-{position.order_id}",
             queue_name=ERROR_QUEUE_NAME
         )
-        asyncio.run(websocket_manager.submit_trade(position.trader_id, position.trade_pair, "FLAT", 1))
+        signal_dispatcher.submit(position.trader_id, position.trade_pair, "FLAT", 1).result()
         data.update({
             "modified_by" : "processing_positions_task"
         })
         update_position(db, position, data)
-        delete_hash_value(key)
+        delete_hash_value(key, publish=True)
         # send_email_to_user(position, _type="CLOSE")
 
 
@@ -1,30 +1,36 @@
 import logging
-import asyncio
-from src.core.celery_app import celery_app
+import threading
+from uuid import uuid4
+
+import numpy as np
+from src.config import MONITOR_SHARDS, MONITOR_LEASE_SECONDS
+from src.core.celery_app import celery_app, ScheduledTask
 from src.database_tasks import TaskSessionLocal_
 from src.models.transaction import Transaction , Status, OrderType 
 from src.services.fee_service import get_taoshi_values
 from src.utils.constants import ERROR_QUEUE_NAME, STOP_LOSS_POSITIONS_TABLE
-from src.utils.redis_manager import set_hash_value, push_to_redis_queue , get_bid_ask_price
-from src.utils.websocket_manager import websocket_manager
+from src.utils.redis_manager import set_hash_value, push_to_redis_queue , get_bid_ask_price, get_positions_snapshot, get_stale_trade_pairs, set_hash_values, set_trigger_prices, acquire_leases, release_leases, renew_leases
+from src.services.signal_dispatcher import signal_dispatcher
 from src.schemas.redis_position import RedisPosition 
-from src.services.trade_service import get_SLTP_pending_positions , close_transaction_sync, update_transaction_sync , update_transaction_sync_gen
+from src.services.trade_service import get_SLTP_pending_positions , close_transaction_sync, update_transaction_sync , update_transaction_sync_gen, TransactionUnitOfWork
 from src.services.notification_service import NotificationService
 from src.schemas.transaction import TransactionUpdateDatabaseGen
+from src.services.sltp_engine import build_position_columns, build_redis_columns, evaluate_positions, compute_trigger_prices
 
 logger = logging.getLogger(__name__)
 
 
-def open_position(db, position : Transaction, current_price : float):
+def open_position(db, position : Transaction, current_price : float, signal=None, uow=None):
    
     try:
         
-        asyncio.run( websocket_manager.submit_trade(position.trader_id, position.trade_pair, position.order_type,
-                                           position.leverage))
+        signal = signal or signal_dispatcher.submit(position.trader_id, position.trade_pair, position.order_type,
+                                                    position.leverage)
+        signal.result()
         
         #Creating a position immediately with status PROCESSING
         update_transaction_sync(db, position.order_id, position.trader_id, entry_price= current_price,old_status=position.status
-                                , status=Status.processing)
+                                , status=Status.processing, uow=uow)
 
         logger.info(f"Save notification called for  redis profit_loss: id : {position.order_id}  redis entry price: {current_price} , position entry price {position.entry_price} - upward {position.upward}")
         NotificationService.save_notification(db, position , f" {position.trader_id} - {position.trade_pair} Opened @ market: {current_price}, limit: {position.entry_price} - Order: {position.order_type}"  )
@@ -37,18 +43,19 @@ def open_position(db, position : Transaction, current_price : float):
         logger.error(f"An error occurred while opening position {position.position_id}: {e}")
 
 
-def close_position( db , position : Transaction, redis_position : RedisPosition):
+def close_position( db , position : Transaction, redis_position : RedisPosition, signal=None, uow=None):
 
     try:
 
-        asyncio.run( websocket_manager.submit_trade(position.trader_id, position.trade_pair, "FLAT", 1))
+        signal = signal or signal_dispatcher.submit(position.trader_id, position.trade_pair, "FLAT", 1)
+        signal.result()
  
         #Closing a position immediately with status CLOSE_PROCESSING
         close_transaction_sync(db, position.order_id, position.trader_id, redis_position.price, profit_loss=redis_position.profit_loss,
                                 old_status=position.status, profit_loss_without_fee=redis_position.profit_loss_without_fee,
                                 taoshi_profit_loss=redis_position.taoshi_profit_loss, status=Status.close,
                                 taoshi_profit_loss_without_fee=redis_position.taoshi_profit_loss_without_fee, order_level=redis_position.len_order,
-                                average_entry_price=redis_position.average_entry_price)
+                                average_entry_price=redis_position.average_entry_price, uow=uow)
 
         NotificationService.save_notification(db, position , f"{position.trader_id} - {position.trade_pair} Closed @ pl:{ round(redis_position.profit_loss, 6)} , position SL {position.stop_loss} - TP {position.take_profit}"  )
                 
@@ -88,17 +95,23 @@ def check_stop_loss( stop_loss, profit_loss) -> bool:
     return False
 
 
-def update_stop_loss(db , new_trailing_stop_loss : float , position : Transaction , new_entry_price : float):
+def update_stop_loss(db , new_trailing_stop_loss : float , position : Transaction , new_entry_price : float, uow=None,
+                     stop_losses : dict = None):
         new_trailing_stop_loss_percent = (new_trailing_stop_loss / position.entry_price) * 100
         position.stop_loss = new_trailing_stop_loss_percent
         position.cumulative_stop_loss =  position.stop_loss
         
         # NotificationService.save_notification(db, position , f" {position.trader_id} - {position.trade_pair} - {position.order_type} Trail SL: {new_trailing_stop_loss_percent}, E: {position.entry_price} - NE: {new_entry_price}"  )
-        set_hash_value(f'{position.trade_pair}-{position.trader_id}',new_trailing_stop_loss_percent ,STOP_LOSS_POSITIONS_TABLE  )
+        key = f'{position.trade_pair}-{position.trader_id}'
+        if stop_losses is not None:
+            # collected by the batch pass and written in one call
+            stop_losses[key] = new_trailing_stop_loss_percent
+        else:
+            set_hash_value(key, new_trailing_stop_loss_percent ,STOP_LOSS_POSITIONS_TABLE, publish=True)
         update_transaction_gen(db , position , { "stop_loss" : new_trailing_stop_loss_percent , 
                                                 "cumulative_stop_loss" : new_trailing_stop_loss_percent,
                                                 "entry_price" : new_entry_price
-                                            })
+                                            }, uow=uow)
 
 
 
@@ -164,7 +177,7 @@ def should_close_position(redis_position : RedisPosition , position : Transactio
 
 
 
-def update_transaction_gen(db, position: int, update_values: dict):
+def update_transaction_gen(db, position: int, update_values: dict, uow=None):
     """
     Update transaction with provided values using dictionary unpacking
     """
@@ -172,36 +185,37 @@ def update_transaction_gen(db, position: int, update_values: dict):
     update_transaction_sync_gen(
         db, 
         position, 
-        TransactionUpdateDatabaseGen(**update_values)
+        TransactionUpdateDatabaseGen(**update_values),
+        uow=uow
     )
 
 
-def check_trailing_limit(db, position : Transaction , buy_price : float , sell_price : float):
+def check_trailing_limit(db, position : Transaction , buy_price : float , sell_price : float, uow=None):
     
     if position.order_type == OrderType.buy:
         
         #Market Moves in favorable direction
         if buy_price >= position.entry_price:
-            open_position(db, position, buy_price)
+            open_position(db, position, buy_price, uow=uow)
 
         elif buy_price < position.initial_price:
             #Trailing Percent Moves Up
             entry_price_increment = (buy_price * (position.limit_order/ 100))
             new_entry_price = buy_price +  entry_price_increment
-            update_transaction_gen(db , position , { "entry_price" : new_entry_price , "initial_price" : buy_price  })
+            update_transaction_gen(db , position , { "entry_price" : new_entry_price , "initial_price" : buy_price  }, uow=uow)
             NotificationService.save_notification(db, position , f"{position.trader_id} - {position.trade_pair} - {position.order_type} Limit: {new_entry_price}, M: {buy_price} - LO: {position.limit_order}" )
 
     
     elif position.order_type == OrderType.sell:
         
         if sell_price <= position.entry_price:
-            open_position(db, position, sell_price)
+            open_position(db, position, sell_price, uow=uow)
         #Market Moves in favorable direction
         elif sell_price > position.initial_price:
             #Stop Loss moves down
             entry_price_decrement = (sell_price * (position.limit_order/ 100))
             new_entry_price = sell_price -  entry_price_decrement
-            update_transaction_gen(db , position , { "entry_price" : new_entry_price , "initial_price" : buy_price  })
+            update_transaction_gen(db , position , { "entry_price" : new_entry_price , "initial_price" : buy_price  }, uow=uow)
             NotificationService.save_notification(db, position , f"{position.trader_id} - {position.trade_pair} - {position.order_type} Limit: {new_entry_price}, M: {sell_price} - LO: {position.limit_order}" )
 
     
@@ -222,7 +236,7 @@ def check_pending_position(db, position : Transaction , buy_price : float, sell_
     if opened:
         open_position(db, position, buy_price if position.order_type == OrderType.buy else sell_price )
 
-def check_open_position(db, position):
+def check_open_position(db, position, uow=None):
     """
     For Open Position to be Closed
     """
@@ -249,7 +263,7 @@ def check_open_position(db, position):
 
     if should_close_position(redis_position , position):
         logger.info(f"Position should be closed: {position.position_id}: {position.trader_id}: {position.trade_pair}")
-        close_position(db, position, redis_position)
+        close_position(db, position, redis_position, uow=uow)
         return True
 
 
@@ -310,8 +324,202 @@ def monitor_positions_sync():
 
 
 
-@celery_app.task(name='src.tasks.position_monitor_sync.monitor_positions')
+def dispatch_position(position : Transaction, action, *args):
+    """
+    Run a single scalar action for a position that fired in the batch evaluation
+    """
+    try:
+        return action(*args)
+    except Exception as e:
+        push_to_redis_queue(
+            data=f"**Monitor Positions** While Monitoring Position {position.trader_id}-{position.trade_pair}-{position.order_id} - {e}",
+            queue_name=ERROR_QUEUE_NAME
+        )
+        logger.error(f"An error occurred while monitoring position {position.position_id} in SL/TP task: {e}")
+
+
+def is_trailing_limit(position : Transaction) -> bool:
+    return bool(position.trailing and position.limit_order and position.initial_price)
+
+
+def evaluate_and_dispatch(db, positions):
+    """
+    Evaluate the positions as one vectorized pass and dispatch only the rows that fired
+    to the scalar helpers. The whole pass runs against one redis snapshot of the positions,
+    their trailing stop losses and quotes, status transitions are staged and written in one
+    bulk update at the end of the pass.
+    """
+    # positions are only read from here on, every write goes through the unit of work
+    db.expunge_all()
+    uow = TransactionUnitOfWork()
+    columns = build_position_columns(positions)
+    snapshot = get_positions_snapshot(columns.keys, list(set(columns.trade_pairs)))
+    # no trailing or limit fills on the last quotes of a feed that went quiet
+    stale = get_stale_trade_pairs(snapshot.quotes)
+    if stale:
+        logger.warning(f"Skipping quote based decisions on stale quotes of {sorted(stale)}")
+        snapshot.quotes.update({trade_pair: (0.0, 0.0) for trade_pair in stale})
+
+    redis_columns = build_redis_columns(columns, snapshot)
+    decisions = evaluate_positions(columns, redis_columns)
+
+    stop_losses = {}
+    for i in decisions.trail.nonzero()[0]:
+        position = columns.positions[i]
+        price = float(decisions.trail_price[i])
+        dispatch_position(position, update_stop_loss, db, price * (position.stop_loss / 100), position, price, uow,
+                          stop_losses)
+    previous = dict(zip(columns.keys, redis_columns.stop_loss))
+    set_hash_values({k: v for k, v in stop_losses.items() if previous.get(k) != v}, STOP_LOSS_POSITIONS_TABLE,
+                    publish=True)
+
+    # hand every FLAT signal of the pass to the dispatcher first, they are sent concurrently
+    close_rows = decisions.close.nonzero()[0]
+    close_signals = signal_dispatcher.submit_many(
+        [(columns.positions[i].trader_id, columns.positions[i].trade_pair, "FLAT", 1) for i in close_rows]
+    )
+    for i, signal in zip(close_rows, close_signals):
+        position = columns.positions[i]
+        redis_position = RedisPosition.from_redis_array(redis_columns.values[i][1:11])
+        logger.info(f"Position should be closed: {position.position_id}: {position.trader_id}: {position.trade_pair}")
+        dispatch_position(position, close_position, db, position, redis_position, signal, uow)
+
+    # Not in the positions hash yet, monitor_miner / testnet_validator write them on their next
+    # pass, downloading the taoshi payload per position here would stall the whole pass
+    missing = [columns.keys[i] for i in decisions.missing.nonzero()[0]]
+    if missing:
+        logger.info(f"Skipping {len(missing)} open positions missing from redis: {missing}")
+
+    # If position doesnt exits in redis (taoshi) it can mean anything, so we shouldnt process
+    for i in decisions.unusable.nonzero()[0]:
+        position = columns.positions[i]
+        push_to_redis_queue(
+            data=f"**Monitor Positions** While Checking Open Position {position.trader_id}-{position.trade_pair}-{position.order_id} - Price is Zero in Redis Queue or Trades in Queue for pair are stale and closed",
+            queue_name=ERROR_QUEUE_NAME
+        )
+
+    open_rows = [i for i in decisions.open.nonzero()[0] if not is_trailing_limit(columns.positions[i])]
+    open_signals = dict(zip(open_rows, signal_dispatcher.submit_many(
+        [(columns.positions[i].trader_id, columns.positions[i].trade_pair, columns.positions[i].order_type,
+          columns.positions[i].leverage) for i in open_rows]
+    )))
+    for i in (decisions.open | decisions.limit_move).nonzero()[0]:
+        position = columns.positions[i]
+        bid, ask = float(redis_columns.bid[i]), float(redis_columns.ask[i])
+        if is_trailing_limit(position):
+            dispatch_position(position, check_trailing_limit, db, position, bid, ask, uow)
+        else:
+            dispatch_position(position, open_position, db, position, float(decisions.open_price[i]), open_signals[i],
+                              uow)
+
+    staged = len(uow.updates)
+    uow.flush(db)
+
+    if (decisions.no_quotes & ~np.isin(columns.trade_pairs, list(stale))).any():
+        logger.error("BUY SELL in Redis is 0, cannot process pending orders")
+
+    logger.info(f"Evaluated {len(columns)} positions: "
+                f"{int(decisions.close.sum())} closed, {int(decisions.open.sum())} opened, "
+                f"{int(decisions.trail.sum())} trailed, {int(decisions.limit_move.sum())} limits moved, "
+                f"{staged} transactions updated")
+    return columns, decisions
+
+
+def renew_leases_while_running(leased_ids, owner, ttl, done: threading.Event):
+    while not done.wait(ttl / 3):
+        renewed = renew_leases(leased_ids, owner, ttl)
+        if renewed < len(leased_ids):
+            logger.error(f"Lost {len(leased_ids) - renewed} position leases while the pass is still going")
+            return
+
+
+def evaluate_leased_positions(db, positions):
+    """
+    Evaluate only the positions this worker holds a lease on, a position picked up by two
+    tasks at once (a shard pass and a triggered evaluation) is acted on by one of them.
+    The positions were loaded before the leases were taken, another worker may have closed or
+    opened them and released its leases in between, so the leased rows are read again.
+    The leases are renewed while the pass goes on, the state changes are only written at its
+    end and a pass waiting on throttled signals can outlast MONITOR_LEASE_SECONDS.
+    """
+    owner = uuid4().hex
+    leased_ids = acquire_leases([p.order_id for p in positions], owner, MONITOR_LEASE_SECONDS)
+    if len(leased_ids) < len(positions):
+        logger.info(f"Skipping {len(positions) - len(leased_ids)} positions leased by another worker")
+    if not leased_ids:
+        return None, None
+
+    done = threading.Event()
+    threading.Thread(target=renew_leases_while_running, args=(leased_ids, owner, MONITOR_LEASE_SECONDS, done),
+                     daemon=True).start()
+    try:
+        # the identity map still holds the copies loaded before the leases
+        db.expunge_all()
+        positions = get_SLTP_pending_positions(db, order_ids=leased_ids)
+        return evaluate_and_dispatch(db, positions) if positions else (None, None)
+    finally:
+        done.set()
+        release_leases(leased_ids, owner)
+
+
+def publish_trigger_prices(positions, columns, decisions, shard=0):
+    """
+    Publish the trigger prices of the shard positions that did not change state in this pass,
+    the quote listeners use them to enqueue an evaluation as soon as a price is crossed.
+    """
+    changed = []
+    if columns is not None:
+        changed = [columns.order_ids[i] for i in (decisions.close | decisions.open | decisions.limit_move).nonzero()[0]]
+
+    triggers = {}
+    if positions:
+        columns = build_position_columns(positions)
+        triggers = compute_trigger_prices(columns, skip=np.isin(columns.order_ids, changed))
+    set_trigger_prices(triggers, shard)
+
+
+def monitor_positions_batch(shard=0, shards=1):
+    """
+    Batch evaluation mode of monitor_positions_sync for one shard of the positions.
+
+    All monitored positions of the shard are loaded into column arrays, profit/loss and quotes
+    are read from redis in one round trip each and the SL/TP, trailing and limit checks run
+    as one vectorized pass. Only the rows that fired are dispatched to the scalar helpers.
+    """
+    logger.info(f"Starting monitor_positions_batch shard {shard}/{shards}")
+
+    with TaskSessionLocal_() as db:
+        positions = get_SLTP_pending_positions(db, shard=shard, shards=shards)
+        columns, decisions = evaluate_leased_positions(db, positions)
+        publish_trigger_prices(positions, columns, decisions, shard)
+
+    logger.info(f"Finished monitor_positions_batch shard {shard}/{shards}")
+
+
+@celery_app.task(name='src.tasks.position_monitor_sync.monitor_positions', base=ScheduledTask)
 def monitor_positions():
-    logger.info("Starting monitor_positions task")
-    monitor_positions_sync() 
-   
\ No newline at end of file
+    """
+    Fan the monitoring pass out to one task per shard, positions are partitioned by trader_id
+    so every shard can run on a different worker of the position_monitoring queue.
+    """
+    logger.info(f"Starting monitor_positions task over {MONITOR_SHARDS} shards")
+    for shard in range(MONITOR_SHARDS):
+        monitor_positions_shard.apply_async(args=[shard, MONITOR_SHARDS], expires=monitor_positions.schedule_interval())
+
+
+@celery_app.task(name='src.tasks.position_monitor_sync.monitor_positions_shard', base=ScheduledTask,
+                 schedule_of='src.tasks.position_monitor_sync.monitor_positions', lock_per_args=True)
+def monitor_positions_shard(shard, shards):
+    monitor_positions_batch(shard, shards)
+
+
+@celery_app.task(name='src.tasks.position_monitor_sync.monitor_triggered_positions')
+def monitor_triggered_positions(order_ids):
+    """
+    Evaluate the positions whose trigger price was crossed by a live quote
+    """
+    logger.info(f"Starting monitor_triggered_positions task: {order_ids}")
+    with TaskSessionLocal_() as db:
+        positions = get_SLTP_pending_positions(db, order_ids=order_ids)
+        if positions:
+            evaluate_leased_positions(db, positions)
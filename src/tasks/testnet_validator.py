@@ -5,7 +5,7 @@ import traceback
 import requests
 from .vali_config import DeltaValiConfig
 from src.config import SWITCH_TO_MAINNET_URL
-from src.core.celery_app import celery_app
+from src.core.celery_app import celery_app, ScheduledTask
 from src.database_tasks import TaskSessionLocal_
 from src.services.api_service import testnet_websocket
 from src.services.email_service import send_mail, send_support_email
@@ -192,7 +192,7 @@ def monitor_testnet_challenges(test_net_positions, perf_ledgers , eliminations ,
         logger.error(f"Error in Pass/Fail TestNet task - {stack_trace}")
 
 
-@celery_app.task(name='src.tasks.testnet_validator.testnet_validator')
+@celery_app.task(name='src.tasks.testnet_validator.testnet_validator', base=ScheduledTask)
 def testnet_validator():
     """
         perf ledgers object have only eliminated hotkeys.
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from datetime import datetime
 from datetime import timedelta
@@ -17,7 +16,7 @@ from src.services.user_service import bulk_update_challenges
 # from src.tasks.testnet_validator import get_profit_sum_and_draw_down
 from src.utils.constants import ERROR_QUEUE_NAME, TOURNAMENT
 from src.utils.redis_manager import push_to_redis_queue, set_hash_value
-from src.utils.websocket_manager import websocket_manager
+from src.services.signal_dispatcher import signal_dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -122,6 +121,7 @@ def monitor_tournaments():
 
         for tournament in tournaments:
             challenges = tournament.challenges
+            signals = []
             for challenge in challenges:
                 transactions = db.query(Transaction).filter(
                     and_(
@@ -135,12 +135,14 @@ def monitor_tournaments():
 
                 for position in transactions:
                     if position.status == "OPEN":  # taoshi
-                        asyncio.run(websocket_manager.submit_trade(position.trader_id, position.trade_pair, "FLAT", 1))
+                        signals.append(signal_dispatcher.submit(position.trader_id, position.trade_pair, "FLAT", 1))
                     position.status = "CLOSED"
                     position.close_time = datetime.now(pytz.utc).replace(tzinfo=None)
                     position.old_status = position.status
                     position.operation_type = "tournament_closed"
                     position.modified_by = "system"
+            for signal in signals:
+                signal.result()
             db.commit()
             calculate_tournament_results(db, tournament, challenges)
 
@@ -0,0 +1,223 @@
+import json
+
+import redis.asyncio as aioredis
+
+from src.config import REDIS_ASYNC_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT, REDIS_SOCKET_TIMEOUT
+from src.models.transaction import OrderType
+from src.schemas.redis_position import RedisQuotesData
+from src.utils.redis_manager import hash_update_message, stale_trade_pairs
+from src.utils.constants import (
+    REDIS_LIVE_QUOTES_TABLE,
+    REDIS_LIVE_PRICES_TABLE,
+    POSITIONS_TABLE,
+    TRIGGER_UPDATES_CHANNEL,
+    OPERATION_QUEUE_NAME,
+    PRICE_FEED_STATUS,
+    HASH_UPDATES_CHANNEL,
+    TRADER_UPDATES_CHANNEL,
+)
+
+# asyncio counterpart of redis_manager for the coroutines of the API and the price ingest,
+# the same keys and value layout are used by both.
+# Connections are reused from a bounded pool, a burst of coroutines waits for a free
+# connection instead of opening new ones, dead connections are detected by the health check.
+async_redis_pool = aioredis.BlockingConnectionPool(
+    host="redis",
+    port=6379,
+    decode_responses=True,
+    max_connections=REDIS_ASYNC_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_keepalive=True,
+    health_check_interval=30,
+)
+async_redis_client = aioredis.StrictRedis(connection_pool=async_redis_pool)
+
+
+async def close_async_redis():
+    await async_redis_pool.disconnect()
+
+
+# extend or release a lock only while it is still held by the same owner
+_renew_owned_lock = async_redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+_release_owned_lock = async_redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+async def acquire_lock(key: str, owner: str, ttl: int) -> bool:
+    return bool(await async_redis_client.set(key, owner, nx=True, ex=ttl))
+
+
+async def renew_lock(key: str, owner: str, ttl: int) -> bool:
+    """
+    False when the lock expired or was taken by another owner
+    """
+    return bool(await _renew_owned_lock(keys=[key], args=[owner, ttl]))
+
+
+async def release_lock(key: str, owner: str):
+    await _release_owned_lock(keys=[key], args=[owner])
+
+
+async def get_bid_ask_price(trade_pair: str) -> RedisQuotesData:
+    """
+    get the bid and ask of the trade pair
+    """
+    quotes = {"bp": 0.0, "ap": 0.0}
+    price_object = await async_redis_client.hget(REDIS_LIVE_QUOTES_TABLE, trade_pair)
+    if price_object:
+        quotes = json.loads(price_object)
+    return RedisQuotesData(bp=quotes.get("bp"), ap=quotes.get("ap"))
+
+
+async def is_quote_stale(trade_pair: str) -> bool:
+    """
+    True when the feed of the trade pair is disconnected or went quiet, its quotes are old
+    """
+    return bool(stale_trade_pairs(await async_redis_client.hgetall(PRICE_FEED_STATUS), [trade_pair]))
+
+
+async def get_hash_value(key, hash_name=POSITIONS_TABLE):
+    return await async_redis_client.hget(hash_name, key)
+
+
+async def get_hash_values(hash_name=REDIS_LIVE_PRICES_TABLE) -> dict:
+    """
+    get all the hash values against a key
+    """
+    return await async_redis_client.hgetall(hash_name)
+
+
+async def get_many_hash_values(*hash_names) -> list:
+    """
+    get_hash_values of several hashes in one pipelined round trip
+    """
+    pipeline = async_redis_client.pipeline(transaction=False)
+    for hash_name in hash_names:
+        pipeline.hgetall(hash_name)
+    return await pipeline.execute()
+
+
+async def set_hash_value(key, value, hash_name=POSITIONS_TABLE, publish=False):
+    """
+    with `publish` the change is also published on HASH_UPDATES_CHANNEL
+    """
+    if not publish:
+        await async_redis_client.hset(hash_name, key, json.dumps(value))
+        return
+    pipeline = async_redis_client.pipeline(transaction=False)
+    pipeline.hset(hash_name, key, json.dumps(value))
+    pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message({hash_name: {key: value}}))
+    await pipeline.execute()
+
+
+async def set_hash_values(values: dict, hash_name=POSITIONS_TABLE):
+    """
+    set many key, value pairs of a hash in one call, values are json encoded like set_hash_value
+    """
+    if values:
+        await async_redis_client.hset(hash_name, mapping={k: json.dumps(v) for k, v in values.items()})
+
+
+async def set_many_hash_values(values: dict, publish=()):
+    """
+    set_hash_values of several hashes, {hash_name: {key: value}}, in one pipelined round trip,
+    the writes to the hashes in `publish` are also published on HASH_UPDATES_CHANNEL
+    """
+    pipeline = async_redis_client.pipeline(transaction=False)
+    for hash_name, mapping in values.items():
+        if mapping:
+            pipeline.hset(hash_name, mapping={k: json.dumps(v) for k, v in mapping.items()})
+    published = {hash_name: values[hash_name] for hash_name in publish if values.get(hash_name)}
+    if published:
+        pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message(published))
+    await pipeline.execute()
+
+
+async def set_live_price(key: str, value: dict):
+    await set_hash_value(key, value, REDIS_LIVE_PRICES_TABLE, publish=True)
+
+
+async def set_quotes(key: str, value: dict, format=False):
+    if format:
+        value["bp"] = value.get("b")
+        value["ap"] = value.get("a")
+    await set_hash_value(key, value, REDIS_LIVE_QUOTES_TABLE, publish=True)
+
+
+async def delete_hash_value(key, hash_name=POSITIONS_TABLE, publish=False):
+    if not publish:
+        await async_redis_client.hdel(hash_name, key)
+        return
+    pipeline = async_redis_client.pipeline(transaction=False)
+    pipeline.hdel(hash_name, key)
+    pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message(deletes={hash_name: [key]}))
+    await pipeline.execute()
+
+
+async def get_profit_loss_from_redis(trade_pair: str, trader_id: int):
+    redis_position = await get_hash_value(f"{trade_pair}-{trader_id}")
+    return json.loads(redis_position)[2] if redis_position else None
+
+
+async def get_live_quote_from_redis(trade_pair: str, order_type):
+    live_quotes = await get_hash_value(trade_pair, REDIS_LIVE_QUOTES_TABLE)
+    if not live_quotes:
+        return None
+    quotes = json.loads(live_quotes)
+    return quotes.get("bp") if order_type == OrderType.buy else quotes.get("ap")
+
+
+async def publish_trigger_update(order_id: int, trade_pair: str, triggers: list):
+    """
+    publish the new trigger prices of a single order, an empty list removes it
+    """
+    await async_redis_client.publish(TRIGGER_UPDATES_CHANNEL, json.dumps([order_id, trade_pair, triggers]))
+
+
+async def subscribe_trader_updates():
+    pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(TRADER_UPDATES_CHANNEL)
+    return pubsub
+
+
+async def push_to_redis_queue(data, queue_name=OPERATION_QUEUE_NAME):
+    await async_redis_client.lpush(queue_name, data)
+
+
+async def push_many_to_redis_queue(items: list, queue_name=OPERATION_QUEUE_NAME):
+    """
+    push_to_redis_queue of many items with one LPUSH, in the same order as pushing them one by one
+    """
+    if items:
+        await async_redis_client.lpush(queue_name, *items)
+
+
+async def set_feed_connected(feed: str, gap: float = None):
+    """
+    mark a polygon feed connected, `gap` is the time it went without ticks before reconnecting
+    """
+    pipeline = async_redis_client.pipeline()
+    pipeline.hset(PRICE_FEED_STATUS, f"{feed}:connected", 1)
+    if gap is not None:
+        pipeline.hset(PRICE_FEED_STATUS, f"{feed}:last_gap", round(gap, 3))
+        pipeline.hincrbyfloat(PRICE_FEED_STATUS, f"{feed}:total_gap", gap)
+        pipeline.hincrby(PRICE_FEED_STATUS, f"{feed}:gaps", 1)
+    await pipeline.execute()
+
+
+async def set_feed_disconnected(feed: str, disconnected_at: float):
+    await async_redis_client.hset(PRICE_FEED_STATUS, mapping={
+        f"{feed}:connected": 0,
+        f"{feed}:disconnected_at": disconnected_at,
+    })
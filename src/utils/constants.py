@@ -31,6 +31,27 @@ OPERATION_QUEUE_NAME = 'db_operations_queue'
 ERROR_QUEUE_NAME = 'errors'
 TOURNAMENT = 'tournament_score'
 TOP_TRADERS = 'top_traders'
+POSITION_FINGERPRINTS_TABLE = 'position_fingerprints'
+HASH_DIGESTS_TABLE = 'hash_digests'
+USER_HOTKEY_MAP = 'user_hotkey_map'
+USER_HOTKEY_MAP_VERSION = 'user_hotkey_map_version'
+TRADER_UPDATES_CHANNEL = 'trader_updates'
+TRIGGER_PRICES_TABLE = 'trigger_prices'
+TRIGGER_PRICES_VERSION = 'trigger_prices_version'
+TRIGGER_UPDATES_CHANNEL = 'trigger_updates'
+TRIGGER_PRICES_DIGESTS = 'trigger_prices_digests'
+MONITOR_LEASE_PREFIX = 'monitor_lease'
+TASK_LOCK_PREFIX = 'task_lock'
+TASK_NEXT_RUN_PREFIX = 'task_next_run'
+TASK_METRICS_PREFIX = 'task_metrics'
+INGEST_METRICS = 'ingest_metrics'
+INGEST_LOCK = 'price_ingest_lock'
+INGEST_HEALTH = 'price_ingest_health'
+PRICE_FEED_STATUS = 'price_feed_status'
+HASH_UPDATES_CHANNEL = 'hash_updates'
+DELTA_LEADER_LOCK = 'delta_leader_lock'
+DELTA_FRAMES_CHANNEL = 'delta_frames'
+DELTA_SNAPSHOT_REQUESTS = 'delta_snapshot_requests'
 
 # -------------------- Assets Minimum and Maximum Leverages -------------------------
 CRYPTO_MIN_LEVERAGE = 0.01
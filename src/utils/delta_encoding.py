@@ -0,0 +1,273 @@
+"""
+Compact encoding of the /ws/delta price and position messages, opted in with ?encoding=compact.
+
+A message is a binary MessagePack map with columns instead of one JSON object per entry:
+    ids      uint16 trade pair ids of the rows, UNKNOWN_PAIR for a pair outside PAIRS whose
+             name is then taken in order from `names`
+    columns  {name: [dtype, bytes]} float columns, float32 ("f4") when every value survives the
+             round trip at FLOAT32_DECIMALS decimals, float64 ("f8") otherwise
+    times    {name: [dtype, base, bytes]} millisecond times, uint32 offsets from `base` ("u4") or
+             int64 ("i8") when they do not fit. A position `time` is the str(datetime) Redis
+             holds, sent as microseconds since DATETIME_EPOCH with a fourth "datetime" item
+    extra    the changed fields no column holds, a {name: value} map or None per row
+The columns are little endian. They are built with the array module, a message usually has a
+handful of rows and numpy's overhead per call would cost more than the packing itself.
+A cell is only filled when its value changed since the previous message for that row, NaN for
+floats and NO_TIME / NO_FLAG for the others mean unchanged, so "prices_update" and
+"positions_update" carry the changed cells only. The "prices" and "positions" snapshots carry
+every cell and the `pairs` dictionary. Position rows also have uint32 `traders`, uint8 `removed`,
+`closed`, and a `time` list when their times are neither ints nor str(datetime). Empty fields
+are left out. `decode` turns a message back into the JSON
+layout, without the unchanged cells.
+"""
+import math
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, /ws/delta then only speaks JSON
+    msgpack = None
+
+from src.utils.constants import forex_pairs, stocks_pairs, crypto_pairs, indices_pairs
+
+# ids are positions in this list, new trade pairs are only ever appended
+PAIRS = forex_pairs + stocks_pairs + crypto_pairs + indices_pairs
+PAIR_IDS = {trade_pair: i for i, trade_pair in enumerate(PAIRS)}
+UNKNOWN_PAIR = 0xFFFF
+
+PRICE_COLUMNS = ("bp", "ap", "o", "h", "l", "c", "v", "vw")
+PRICE_TIMES = ("t", "s", "e")
+POSITION_COLUMNS = ("entry_price", "profit_loss", "profit_loss_without_fee", "stop_loss")
+FLOAT32_DECIMALS = 5
+NO_TIME = 0xFFFFFFFF
+NO_FLAG = 0xFF
+DATETIME_EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+NUMBERS = (int, float)
+
+ENCODINGS = ("json", "compact") if msgpack else ("json",)
+
+# dtype of the messages: array typecode
+TYPECODES = {"f4": "f", "f8": "d", "u2": "H", "u4": "I", "i8": "q"}
+
+
+def to_bytes(dtype: str, values) -> bytes:
+    column = array(TYPECODES[dtype], values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def from_bytes(dtype: str, data: bytes) -> list:
+    column = array(TYPECODES[dtype])
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tolist()
+
+
+def pair_ids(trade_pairs: list) -> tuple:
+    ids = to_bytes("u2", [PAIR_IDS.get(trade_pair, UNKNOWN_PAIR) for trade_pair in trade_pairs])
+    return ids, [trade_pair for trade_pair in trade_pairs if trade_pair not in PAIR_IDS]
+
+
+def float_column(values: list) -> list:
+    column = [math.nan if value is None else value for value in values]
+    single = array("f", column)
+    if all(round(a, FLOAT32_DECIMALS) == round(b, FLOAT32_DECIMALS)
+           for a, b in zip(single, column) if b == b):
+        return ["f4", to_bytes("f4", single)]
+    return ["f8", to_bytes("f8", column)]
+
+
+def time_column(values: list) -> list:
+    filled = [value for value in values if value is not None]
+    base = min(filled)
+    if max(filled) - base < NO_TIME:
+        return ["u4", base, to_bytes("u4", [NO_TIME if value is None else value - base for value in values])]
+    # int64 has no free value for unchanged, the base of an i8 column is that marker
+    base = -1
+    return ["i8", base, to_bytes("i8", [base if value is None else value for value in values])]
+
+
+def datetime_micros(value: str):
+    """
+    microseconds since DATETIME_EPOCH of a str(datetime), None for anything decode could not give back
+    """
+    try:
+        micros = (datetime.fromisoformat(value) - DATETIME_EPOCH) // MICROSECOND
+    except (TypeError, ValueError):  # not a date, or a timezone aware one
+        return None
+    return micros if datetime_text(micros) == value else None
+
+
+def datetime_text(micros: int) -> str:
+    return str(DATETIME_EPOCH + micros * MICROSECOND)
+
+
+def flag_column(values: list) -> bytes:
+    return bytes(NO_FLAG if value is None else int(value) for value in values)
+
+
+def changes(rows: list, previous: list, name: str, types=NUMBERS) -> list:
+    """
+    the values of `name` that differ from `previous`, None for the unchanged ones and those not of `types`,
+    an empty list when nothing changed
+    """
+    values, filled = [], False
+    for row, before in zip(rows, previous):
+        value = row.get(name) if row else None
+        if value.__class__ in types and before.get(name) != value:
+            values.append(value)
+            filled = True
+        else:
+            values.append(None)
+    return values if filled else []
+
+
+def columns(rows: list, previous: list, names: tuple) -> dict:
+    encoded = {}
+    for name in names:
+        values = changes(rows, previous, name)
+        if values:
+            encoded[name] = float_column(values)
+    return encoded
+
+
+def extra_fields(rows: list, previous: list, types: dict) -> list:
+    """
+    per row the changed fields that are not of the `types` of their column, an empty list when there are none
+    """
+    extra, filled = [], False
+    for row, before in zip(rows, previous):
+        fields = {name: value for name, value in (row or {}).items()
+                  if value.__class__ not in types.get(name, ()) and (name not in before or before[name] != value)}
+        extra.append(fields or None)
+        filled = filled or bool(fields)
+    return extra if filled else []
+
+
+def pack(message: dict) -> bytes:
+    return msgpack.packb({key: value for key, value in message.items() if value or key == "ids"})
+
+
+def encode_prices(kind: str, prices: dict, previous: dict = None) -> bytes:
+    """
+    {trade_pair: price} as a compact message, only the cells that differ from `previous`
+    """
+    previous = previous or {}
+    trade_pairs = list(prices)
+    ids, names = pair_ids(trade_pairs)
+    rows = [prices[trade_pair] for trade_pair in trade_pairs]
+    before = [previous.get(trade_pair) or {} for trade_pair in trade_pairs]
+    times = {}
+    for name in PRICE_TIMES:
+        values = changes(rows, before, name, (int,))
+        if values:
+            times[name] = time_column(values)
+    types = {**{name: NUMBERS for name in PRICE_COLUMNS}, **{name: (int,) for name in PRICE_TIMES}}
+    message = {"type": kind, "ids": ids, "names": names, "columns": columns(rows, before, PRICE_COLUMNS),
+               "times": times, "extra": extra_fields(rows, before, types)}
+    if kind == "prices":
+        message["pairs"] = PAIRS
+    return pack(message)
+
+
+def encode_positions(kind: str, positions: dict, previous: dict = None) -> bytes:
+    """
+    {trader_id: {trade_pair: position or None}} as a compact message, only the cells that differ
+    from `previous`
+    """
+    previous = previous or {}
+    keys = [(trader_id, trade_pair) for trader_id, entries in positions.items() for trade_pair in entries]
+    rows = [positions[trader_id][trade_pair] for trader_id, trade_pair in keys]
+    before = [previous.get(trader_id, {}).get(trade_pair) or {} for trader_id, trade_pair in keys]
+    ids, names = pair_ids([trade_pair for _, trade_pair in keys])
+    closed = changes(rows, before, "is_closed", (bool,))
+    times = changes(rows, before, "time", (int, str))
+    micros = [None if time is None else datetime_micros(time) for time in times]
+    if not times or all(time.__class__ is int for time in times if time is not None):
+        time_columns = {"time": time_column(times)} if times else {}
+    elif all(micro is not None for micro, time in zip(micros, times) if time is not None):
+        time_columns, times = {"time": time_column(micros) + ["datetime"]}, []
+    else:
+        time_columns = {}
+    types = {**{name: NUMBERS for name in POSITION_COLUMNS}, "is_closed": (bool,), "time": (int, str)}
+    message = {
+        "type": kind,
+        "traders": to_bytes("u4", [int(trader_id) for trader_id, _ in keys]),
+        "ids": ids,
+        "names": names,
+        "removed": flag_column([row is None for row in rows]) if None in rows else None,
+        "columns": columns(rows, before, POSITION_COLUMNS),
+        "closed": flag_column(closed) if closed else None,
+        "times": time_columns,
+        "time": times if times and not time_columns else None,
+        "extra": extra_fields(rows, before, types),
+    }
+    if kind == "positions":
+        message["pairs"] = PAIRS
+    return pack(message)
+
+
+def decode_pairs(message: dict) -> list:
+    names = iter(message.get("names", []))
+    return [PAIRS[i] if i != UNKNOWN_PAIR else next(names)
+            for i in from_bytes("u2", message["ids"])]
+
+
+def decode_columns(message: dict, rows: list):
+    for name, (dtype, data) in message.get("columns", {}).items():
+        for row, value in zip(rows, from_bytes(dtype, data)):
+            if row is not None and value == value:
+                row[name] = round(value, FLOAT32_DECIMALS) if dtype == "f4" else value
+
+
+def decode_times(message: dict, rows: list):
+    for name, (dtype, base, values, *kind) in message.get("times", {}).items():
+        for row, value in zip(rows, from_bytes(dtype, values)):
+            if row is None or dtype == "u4" and value == NO_TIME or dtype == "i8" and value == base:
+                continue
+            value = base + value if dtype == "u4" else value
+            row[name] = datetime_text(value) if kind == ["datetime"] else value
+
+
+def decode_extra(message: dict, rows: list):
+    for row, fields in zip(rows, message.get("extra", [])):
+        if row is not None and fields:
+            row.update(fields)
+
+
+def decode(data: bytes) -> dict:
+    """
+    a compact message in the JSON layout, {"type": ..., "data": ...}
+    """
+    message = msgpack.unpackb(data)
+    trade_pairs = decode_pairs(message)
+    rows = [{} for _ in trade_pairs]
+    if message["type"] in ("prices", "prices_update"):
+        decode_columns(message, rows)
+        decode_times(message, rows)
+        decode_extra(message, rows)
+        return {"type": message["type"], "data": dict(zip(trade_pairs, rows))}
+
+    if "removed" in message:
+        removed = list(message["removed"])
+        rows = [None if gone else row for row, gone in zip(rows, removed)]
+    decode_columns(message, rows)
+    decode_times(message, rows)
+    decode_extra(message, rows)
+    closed = list(message["closed"]) if "closed" in message else [NO_FLAG] * len(rows)
+    times = message.get("time", [None] * len(rows))
+    positions = {}
+    for trader_id, trade_pair, row, is_closed, time in zip(
+            from_bytes("u4", message.get("traders", b"")), trade_pairs, rows, closed, times):
+        if row is not None:
+            if is_closed != NO_FLAG:
+                row["is_closed"] = bool(is_closed)
+            if time is not None:
+                row["time"] = time
+        positions.setdefault(str(trader_id), {})[trade_pair] = row
+    return {"type": message["type"], "data": positions}
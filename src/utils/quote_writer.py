@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from src.config import POLYGON_FLUSH_INTERVAL
+from src.utils.async_redis_manager import async_redis_client, set_many_hash_values
+from src.utils.constants import INGEST_METRICS, PRICE_FEED_STATUS, REDIS_LIVE_PRICES_TABLE, REDIS_LIVE_QUOTES_TABLE
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteWriter:
+    """
+    Coalescing writer of the Polygon ticks.
+
+    Ticks are kept in memory, only the latest value per (hash, trade pair) survives, and are
+    written `interval` seconds after the first tick of a batch with one pipelined HSET per hash.
+    Received and written tick counts per asset class are logged and kept in the ingest_metrics hash,
+    the time of the last write per asset class is kept in the price_feed_status hash.
+    Every batch is published on HASH_UPDATES_CHANNEL for the /ws/delta broadcaster.
+    A failed batch is retried, the delay doubles with every consecutive failure up to `max_backoff`
+    seconds and the failure is logged at most once per `error_log_interval` seconds.
+    """
+
+    def __init__(self, interval=POLYGON_FLUSH_INTERVAL, report_interval=60.0, max_backoff=5.0,
+                 error_log_interval=10.0):
+        self.interval = interval
+        self.report_interval = report_interval
+        self.max_backoff = max_backoff
+        self.error_log_interval = error_log_interval
+        self.failures = 0
+        self.error_logged_at = None
+        self.pending = {}  # hash_name -> {trade_pair: (value, source)}
+        self.received = Counter()
+        self.written = Counter()
+        self.reported = {"received": Counter(), "written": Counter(), "at": time.monotonic()}
+        self._ready = None
+        self._task = None
+
+    def put(self, hash_name: str, key: str, value, source: str):
+        self.pending.setdefault(hash_name, {})[key] = (value, source)
+        self.received[source] += 1
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+        self._ready.set()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            await asyncio.sleep(self.delay())
+            self._ready.clear()
+            await self.flush()
+            if time.monotonic() - self.reported["at"] >= self.report_interval:
+                await self.report()
+
+    def delay(self) -> float:
+        if not self.failures:
+            return self.interval
+        return min(self.interval * 2 ** self.failures, self.max_backoff)
+
+    async def flush(self):
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        values = {
+            hash_name: {key: value for key, (value, _) in entries.items()}
+            for hash_name, entries in batch.items()
+        }
+        now = time.time()
+        values[PRICE_FEED_STATUS] = {
+            f"{source}:last_tick": now for entries in batch.values() for _, source in entries.values()
+        }
+        try:
+            await set_many_hash_values(values, publish=(REDIS_LIVE_PRICES_TABLE, REDIS_LIVE_QUOTES_TABLE))
+        except Exception as e:
+            self.failures += 1
+            now = time.monotonic()
+            if self.error_logged_at is None or now - self.error_logged_at >= self.error_log_interval:
+                self.error_logged_at = now
+                logger.error(f"Failed to write {sum(map(len, batch.values()))} ticks "
+                             f"({self.failures} failures in a row, retrying in {self.delay():.2f}s): {e}")
+            # keep them for the next flush unless a newer tick arrived meanwhile
+            for hash_name, entries in batch.items():
+                pending = self.pending.setdefault(hash_name, {})
+                for key, entry in entries.items():
+                    pending.setdefault(key, entry)
+            self._ready.set()
+            return
+        if self.failures:
+            logger.info(f"Writing ticks again after {self.failures} failed batches")
+            self.failures = 0
+            self.error_logged_at = None
+        for entries in batch.values():
+            self.written.update(source for _, source in entries.values())
+
+    async def report(self):
+        elapsed = time.monotonic() - self.reported["at"]
+        received = self.received - self.reported["received"]
+        written = self.written - self.reported["written"]
+        for source in sorted(received):
+            logger.info(f"{source} ticks in the last {elapsed:.0f}s: received {received[source]}, "
+                        f"written {written[source]} ({received[source] / max(written[source], 1):.1f}x saved)")
+        self.reported = {"received": self.received.copy(), "written": self.written.copy(), "at": time.monotonic()}
+        try:
+            mapping = {f"{source}:received": count for source, count in self.received.items()}
+            mapping.update({f"{source}:written": count for source, count in self.written.items()})
+            if mapping:
+                await async_redis_client.hset(INGEST_METRICS, mapping=mapping)
+        except Exception as e:
+            logger.error(f"Failed to report the ingest metrics: {e}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+quote_writer = QuoteWriter()
@@ -1,17 +1,48 @@
+import hashlib
 import json
+import time
+from typing import NamedTuple, Optional
+
 import redis
+from src.config import QUOTE_STALE_SECONDS
 from src.models.transaction import OrderType
 from src.schemas.redis_position import RedisQuotesData
 from src.utils.constants import (
     REDIS_LIVE_QUOTES_TABLE,
     REDIS_LIVE_PRICES_TABLE,
     POSITIONS_TABLE,
+    STOP_LOSS_POSITIONS_TABLE,
     OPERATION_QUEUE_NAME,
+    TRIGGER_PRICES_TABLE,
+    TRIGGER_PRICES_VERSION,
+    TRIGGER_UPDATES_CHANNEL,
+    TRIGGER_PRICES_DIGESTS,
+    MONITOR_LEASE_PREFIX,
+    POSITION_FINGERPRINTS_TABLE,
+    HASH_DIGESTS_TABLE,
+    USER_HOTKEY_MAP,
+    USER_HOTKEY_MAP_VERSION,
+    TRADER_UPDATES_CHANNEL,
+    PRICE_FEED_STATUS,
+    HASH_UPDATES_CHANNEL,
+    crypto_pairs,
+    forex_pairs,
+    stocks_pairs,
 )
 
 redis_client = redis.StrictRedis(host="redis", port=6379, decode_responses=True)
 
 
+class PositionsSnapshot(NamedTuple):
+    """
+    Parsed redis state of a set of positions, `positions` and `stop_losses` are aligned
+    with the requested keys (None where missing), `quotes` maps trade pair -> (bp, ap).
+    """
+    positions: list
+    stop_losses: list
+    quotes: dict
+
+
 def get_hash_values(hash_name=REDIS_LIVE_PRICES_TABLE):
     """
     get all the hash values against a key
@@ -30,6 +61,36 @@ def get_bid_ask_price(trade_pair: str) -> RedisQuotesData:
     return RedisQuotesData(bp=quotes.get("bp"), ap=quotes.get("ap"))
 
 
+# polygon feed writing the quotes of each trade pair
+QUOTE_FEEDS = {
+    **{pair: "crypto" for pair in crypto_pairs},
+    **{pair: "forex" for pair in forex_pairs},
+    **{pair: "stocks" for pair in stocks_pairs},
+}
+
+
+def stale_trade_pairs(status: dict, trade_pairs, max_age=QUOTE_STALE_SECONDS) -> set:
+    """
+    the trade pairs whose feed is disconnected or has not written a tick for `max_age` seconds
+    according to the price_feed_status hash, pairs of a feed that never reported its status
+    are not considered stale
+    """
+    if not status:
+        return set()
+
+    now = time.time()
+    stale_feeds = set()
+    for feed in set(QUOTE_FEEDS.values()):
+        last_tick = status.get(f"{feed}:last_tick")
+        if status.get(f"{feed}:connected") == "0" or (last_tick and now - float(last_tick) > max_age):
+            stale_feeds.add(feed)
+    return {pair for pair in trade_pairs if QUOTE_FEEDS.get(pair) in stale_feeds}
+
+
+def get_stale_trade_pairs(trade_pairs, max_age=QUOTE_STALE_SECONDS) -> set:
+    return stale_trade_pairs(redis_client.hgetall(PRICE_FEED_STATUS), trade_pairs, max_age)
+
+
 def get_hash_value(key, hash_name=POSITIONS_TABLE):
     """
     get the value of the hash
@@ -37,6 +98,36 @@ def get_hash_value(key, hash_name=POSITIONS_TABLE):
     return redis_client.hget(hash_name, key)
 
 
+def _loads(value) -> Optional[object]:
+    return json.loads(value) if value else None
+
+
+def get_positions_snapshot(keys: list, trade_pairs: list) -> PositionsSnapshot:
+    """
+    read the positions, sl_positions and polygon_quotes values of the given
+    `{trade_pair}-{trader_id}` keys and trade pairs in one pipelined round trip
+    """
+    if not keys:
+        return PositionsSnapshot([], [], {})
+
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hmget(POSITIONS_TABLE, keys)
+    pipeline.hmget(STOP_LOSS_POSITIONS_TABLE, keys)
+    pipeline.hmget(REDIS_LIVE_QUOTES_TABLE, trade_pairs)
+    positions, stop_losses, quotes = pipeline.execute()
+
+    parsed_quotes = {}
+    for trade_pair, value in zip(trade_pairs, quotes):
+        quote = _loads(value) or {}
+        parsed_quotes[trade_pair] = (quote.get("bp") or 0.0, quote.get("ap") or 0.0)
+
+    return PositionsSnapshot(
+        positions=[_loads(value) for value in positions],
+        stop_losses=[_loads(value) for value in stop_losses],
+        quotes=parsed_quotes,
+    )
+
+
 def get_all_hash_value(hash_name=POSITIONS_TABLE):
     """
     get the value of the hash
@@ -44,11 +135,17 @@ def get_all_hash_value(hash_name=POSITIONS_TABLE):
     return redis_client.hgetall(hash_name)
 
 
-def set_hash_value(key, value, hash_name=POSITIONS_TABLE):
+def set_hash_value(key, value, hash_name=POSITIONS_TABLE, publish=False):
     """
-    set the key, value against a hash set
+    set the key, value against a hash set, with `publish` the change is also published on HASH_UPDATES_CHANNEL
     """
-    redis_client.hset(hash_name, key, json.dumps(value))
+    if not publish:
+        redis_client.hset(hash_name, key, json.dumps(value))
+        return
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hset(hash_name, key, json.dumps(value))
+    pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message({hash_name: {key: value}}))
+    pipeline.execute()
 
 
 def set_hash_data(hash_name, data):
@@ -58,6 +155,70 @@ def set_hash_data(hash_name, data):
     redis_client.hmset(hash_name, data)
 
 
+def hash_update_message(values: dict = None, deletes: dict = None) -> str:
+    """
+    HASH_UPDATES_CHANNEL message of {hash_name: {key: value}} writes and {hash_name: [keys]} deletes
+    """
+    return json.dumps({"set": values or {}, "delete": deletes or {}})
+
+
+def set_hash_values(values: dict, hash_name=POSITIONS_TABLE, publish=False):
+    """
+    set many key, value pairs of a hash in one call, values are json encoded like set_hash_value,
+    with `publish` the change is also published on HASH_UPDATES_CHANNEL
+    """
+    if not values:
+        return
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hset(hash_name, mapping={k: json.dumps(v) for k, v in values.items()})
+    if publish:
+        pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message({hash_name: values}))
+    pipeline.execute()
+
+
+def set_hash_data_if_changed(hash_name, data: dict) -> bool:
+    """
+    set_hash_data, skipped when the same data was already written to the hash
+    """
+    digest = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    if not data or redis_client.hget(HASH_DIGESTS_TABLE, hash_name) == digest:
+        return False
+
+    pipeline = redis_client.pipeline()
+    pipeline.hset(hash_name, mapping=data)
+    pipeline.hset(HASH_DIGESTS_TABLE, hash_name, digest)
+    pipeline.execute()
+    return True
+
+
+def update_positions_diff(values: dict, fingerprints: dict, deletes=(), hash_name=POSITIONS_TABLE) -> tuple:
+    """
+    Write only the positions whose fingerprint changed since the last write, or that are
+    missing from the hash, and delete `deletes`, all in one pipeline that also publishes the change.
+    Returns the number of positions written and deleted.
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hkeys(hash_name)
+    pipeline.hgetall(POSITION_FINGERPRINTS_TABLE)
+    existing, stored = pipeline.execute()
+    existing = set(existing)
+
+    changed = {k: v for k, v in values.items() if k not in existing or stored.get(k) != fingerprints[k]}
+    deletes = [k for k in deletes if k in existing or k in stored]
+
+    pipeline = redis_client.pipeline()
+    if changed:
+        pipeline.hset(hash_name, mapping={k: json.dumps(v) for k, v in changed.items()})
+        pipeline.hset(POSITION_FINGERPRINTS_TABLE, mapping={k: fingerprints[k] for k in changed})
+    if deletes:
+        pipeline.hdel(hash_name, *deletes)
+        pipeline.hdel(POSITION_FINGERPRINTS_TABLE, *deletes)
+    if changed or deletes:
+        pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message({hash_name: changed}, {hash_name: deletes}))
+    pipeline.execute()
+    return len(changed), len(deletes)
+
+
 def set_live_price(key: str, value: dict):
     """
     set the key, value against a hash set, preserving the types in value object
@@ -76,6 +237,167 @@ def set_quotes(key: str, value: dict, format=False):
     redis_client.hset(REDIS_LIVE_QUOTES_TABLE, key, json.dumps(value))
 
 
+def set_trigger_prices(triggers: dict, shard: int = 0) -> bool:
+    """
+    replace the trigger prices table of a monitor shard atomically and bump the version,
+    nothing is written when the table did not change since the last pass of the shard
+    """
+    digest = hashlib.md5(json.dumps(triggers, sort_keys=True).encode()).hexdigest()
+    if redis_client.hget(TRIGGER_PRICES_DIGESTS, shard) == digest:
+        return False
+
+    table = f"{TRIGGER_PRICES_TABLE}:{shard}"
+    pipeline = redis_client.pipeline()
+    pipeline.delete(table)
+    if triggers:
+        pipeline.hset(table, mapping={k: json.dumps(v) for k, v in triggers.items()})
+    pipeline.hset(TRIGGER_PRICES_DIGESTS, shard, digest)
+    pipeline.incr(TRIGGER_PRICES_VERSION)
+    pipeline.execute()
+    return True
+
+
+def get_trigger_prices_version():
+    return redis_client.get(TRIGGER_PRICES_VERSION)
+
+
+def get_trigger_prices(shards: int = 1) -> dict:
+    """
+    trigger prices of every monitor shard merged into {trade_pair: rows}
+    """
+    pipeline = redis_client.pipeline()
+    for shard in range(shards):
+        pipeline.hgetall(f"{TRIGGER_PRICES_TABLE}:{shard}")
+
+    triggers = {}
+    for table in pipeline.execute():
+        for trade_pair, rows in table.items():
+            triggers.setdefault(trade_pair, []).extend(json.loads(rows))
+    return triggers
+
+
+def publish_trigger_update(order_id: int, trade_pair: str, triggers: list):
+    """
+    publish the new trigger prices of a single order, an empty list removes it
+    """
+    redis_client.publish(TRIGGER_UPDATES_CHANNEL, json.dumps([order_id, trade_pair, triggers]))
+
+
+def subscribe_trigger_updates():
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(TRIGGER_UPDATES_CHANNEL)
+    return pubsub
+
+
+# release keys only while they are still held by the same owner
+_release_owned_keys = redis_client.register_script("""
+for _, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[1] then
+        redis.call('del', key)
+    end
+end
+""")
+# extend a lock only while it is still held by the same owner
+_renew_owned_lock = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+# extend the keys still held by the same owner, returns how many were extended
+_renew_owned_keys = redis_client.register_script("""
+local renewed = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[1] then
+        renewed = renewed + redis.call('expire', key, ARGV[2])
+    end
+end
+return renewed
+""")
+
+
+def acquire_leases(ids, owner: str, ttl: int) -> list:
+    """
+    claim a lease per id for ttl seconds in one round trip, returns the ids that were claimed
+    """
+    if not ids:
+        return []
+    pipeline = redis_client.pipeline()
+    for id_ in ids:
+        pipeline.set(f"{MONITOR_LEASE_PREFIX}:{id_}", owner, nx=True, ex=ttl)
+    return [id_ for id_, claimed in zip(ids, pipeline.execute()) if claimed]
+
+
+def release_leases(ids, owner: str):
+    if ids:
+        _release_owned_keys(keys=[f"{MONITOR_LEASE_PREFIX}:{id_}" for id_ in ids], args=[owner])
+
+
+def renew_leases(ids, owner: str, ttl: int) -> int:
+    """
+    extend the leases of ids still held by owner, returns how many were extended
+    """
+    if not ids:
+        return 0
+    return int(_renew_owned_keys(keys=[f"{MONITOR_LEASE_PREFIX}:{id_}" for id_ in ids], args=[owner, ttl]))
+
+
+def acquire_lock(key: str, owner: str, ttl: int) -> bool:
+    return bool(redis_client.set(key, owner, nx=True, ex=ttl))
+
+
+def renew_lock(key: str, owner: str, ttl: int) -> bool:
+    """
+    False when the lock expired or was taken by another owner
+    """
+    return bool(_renew_owned_lock(keys=[key], args=[owner, ttl]))
+
+
+def release_lock(key: str, owner: str):
+    _release_owned_keys(keys=[key], args=[owner])
+
+
+def get_user_hotkey_map_version():
+    return redis_client.get(USER_HOTKEY_MAP_VERSION)
+
+
+def get_cached_user_hotkey_map() -> tuple:
+    """
+    (current version, cached map or None when it was built for another version)
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.get(USER_HOTKEY_MAP_VERSION)
+    pipeline.get(USER_HOTKEY_MAP)
+    version, cached = pipeline.execute()
+    cached = json.loads(cached) if cached else {}
+    return version, cached.get("data") if cached.get("version") == version else None
+
+
+def set_cached_user_hotkey_map(version, data: dict, ttl: int):
+    redis_client.set(USER_HOTKEY_MAP, json.dumps({"version": version, "data": data}), ex=ttl)
+
+
+def invalidate_user_hotkey_map():
+    redis_client.incr(USER_HOTKEY_MAP_VERSION)
+
+
+def publish_trader_updates(trader_ids=()):
+    """
+    tell every trader directory that these trader ids changed, no ids means all of them
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for trader_id in trader_ids or ["*"]:
+        pipeline.publish(TRADER_UPDATES_CHANNEL, str(trader_id))
+    pipeline.execute()
+
+
+def subscribe_trader_updates():
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(TRADER_UPDATES_CHANNEL)
+    return pubsub
+
+
 def push_to_redis_queue(data, queue_name=OPERATION_QUEUE_NAME):
     redis_client.lpush(queue_name, data)
 
@@ -92,8 +414,14 @@ def pop_queue_right_item(queue_name=OPERATION_QUEUE_NAME, count=1):
     redis_client.rpop(queue_name, count=count)
 
 
-def delete_hash_value(key, hash_name=POSITIONS_TABLE):
-    redis_client.hdel(hash_name, key)
+def delete_hash_value(key, hash_name=POSITIONS_TABLE, publish=False):
+    if not publish:
+        redis_client.hdel(hash_name, key)
+        return
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hdel(hash_name, key)
+    pipeline.publish(HASH_UPDATES_CHANNEL, hash_update_message(deletes={hash_name: [key]}))
+    pipeline.execute()
 
 
 def get_profit_loss_from_redis(trade_pair: str, trader_id: int) -> int:
@@ -1,15 +1,29 @@
 import asyncio
 import json
+import random
+import time
 from typing import List
 
-import aiohttp
 import websockets
 from throttler import Throttler
 
-from src.config import POLYGON_API_KEY, SIGNAL_API_KEY, SIGNAL_API_BASE_URL
-from src.utils.constants import forex_pairs, crypto_pairs, indices_pairs, stocks_pairs
+from src.config import POLYGON_API_KEY
+from src.services.signal_dispatcher import signal_dispatcher
+from src.services.trigger_service import trigger_dispatcher
+from src.utils.constants import forex_pairs, crypto_pairs, indices_pairs, stocks_pairs, REDIS_LIVE_QUOTES_TABLE, \
+    REDIS_LIVE_PRICES_TABLE
 from src.utils.logging import setup_logging
-from src.utils.redis_manager import set_live_price, set_quotes
+from src.utils.async_redis_manager import set_feed_connected, set_feed_disconnected
+from src.utils.quote_writer import quote_writer
+
+try:
+    from orjson import loads
+except ImportError:  # orjson is optional, frames are then decoded with json
+    from json import loads
+
+TICK_EVENTS = frozenset(["CAS", "XAS", "A", "XQ", "C", "Q"])
+QUOTE_EVENTS = frozenset(["XQ", "C", "Q"])
+PAIR_TRANSLATION = str.maketrans('', '', '-/')
 
 # Set the rate limit: max 10 requests per second
 throttler = Throttler(rate_limit=10, period=1.0)
@@ -24,35 +38,87 @@ class WebSocketManager:
         self.asset_type = asset_type
         self.alt_pair_key = alt_pair_key
         self.trade_pair = None
-        self.reconnect_interval = 5  # seconds
+        self.reconnect_interval = 1  # seconds, doubled on every failed attempt up to max_reconnect_interval
+        self.max_reconnect_interval = 60
         self._recv_lock = asyncio.Lock()  # Lock to ensure single access to recv
         self.aggregates = []
         self.quotes = []
         self.pair_key = pair_key
+        self.pair_names = {}
+        self.last_tick_at = None  # epoch seconds of the last tick received
+        self.last_tick_lag = None  # seconds between polygon's timestamp of that tick and its reception
+        self.disconnected_at = None
+        self.dropped_keys = frozenset(["ev", pair_key, alt_pair_key])
 
     async def connect(self):
         self.websocket_url = f"wss://socket.polygon.io/{self.asset_type}"
-        try:
-            self.websocket = await websockets.connect(self.websocket_url)
-            await self.authenticate()
-            return self.websocket
-        except Exception as e:
-            logger.error(f"Connection failed: {e}. Retrying in {self.reconnect_interval} seconds...")
-            await asyncio.sleep(self.reconnect_interval)
+        self.websocket = await websockets.connect(self.websocket_url)
+        await self.authenticate()
+        return self.websocket
+
+    def reconnect_delay(self, attempt: int) -> float:
+        """
+        exponential backoff with jitter, listeners dropped together don't reconnect in lockstep
+        """
+        delay = min(self.max_reconnect_interval, self.reconnect_interval * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
 
     async def listen_for_prices_multiple(self):
+        """
+        Supervised listener, reconnects with backoff until cancelled
+        """
         if not self.quotes or not self.asset_type:
             logger.error(
                 "WebSocket, trade pairs, or asset type is not set. Please set them before calling this method.")
             return
+        attempt = 0
+        while True:
+            connected_at = None
+            try:
+                logger.info(f"Starting to listen for prices multiple {self.asset_type}...")
+                await self.connect()
+                await self.manage_subscriptions('subscribe')
+                connected_at = time.monotonic()
+                await self.feed_connected()
+                await self.receive_and_log()
+            except asyncio.CancelledError:
+                await self.close()
+                raise
+            except Exception as e:
+                logger.error(f"{self.asset_type} websocket error: {e}")
+
+            await self.close()
+            await self.feed_disconnected()
+            # a connection that stayed up for a while starts the backoff over
+            if connected_at and time.monotonic() - connected_at > self.max_reconnect_interval:
+                attempt = 0
+            delay = self.reconnect_delay(attempt)
+            attempt += 1
+            logger.info(f"Reconnecting the {self.asset_type} websocket in {delay:.1f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    async def feed_connected(self):
+        """
+        mark the feed live again and record how long it went without ticks
+        """
+        gap = None
+        if self.disconnected_at:
+            gap = time.time() - (self.last_tick_at or self.disconnected_at)
+            logger.info(f"{self.asset_type} feed is back after a {gap:.1f}s gap")
+            self.disconnected_at = None
+        try:
+            await set_feed_connected(self.asset_type, gap)
+        except Exception as e:
+            logger.error(f"Failed to record the {self.asset_type} feed status: {e}")
+
+    async def feed_disconnected(self):
+        if self.disconnected_at:
+            return
+        self.disconnected_at = time.time()
         try:
-            logger.info(f"Starting to listen for prices multiple {self.asset_type}...")
-            await self.connect()
-            await self.manage_subscriptions('subscribe')
-            await self.receive_and_log()
+            await set_feed_disconnected(self.asset_type, self.disconnected_at)
         except Exception as e:
-            print(f"WebSocket error: {e}. Reconnecting...")
-            await asyncio.sleep(5)
+            logger.error(f"Failed to record the {self.asset_type} feed status: {e}")
 
     async def authenticate(self):
         logger.info("Authenticating WebSocket connection...")
@@ -84,53 +150,63 @@ class WebSocketManager:
         logger.info(f"{action} response: {response}")
 
     async def receive_and_log(self):
+        """
+        Handle frames until the connection fails, the error is left to the supervising loop
+        """
         print("Displaying prices for all trade pairs...")
         while True:
+            message = await self.websocket.recv()
             try:
-                message = await self.websocket.recv()
-                data = json.loads(message)
-
-                for item in data:
-
-                    if item.get("ev") not in ["CAS", "XAS", "A", "XQ","C", "Q"]:
-                        print(f"Skipping non-CAS event: {item}")
-                        continue
-                    
-                    trade_pair = item.pop(self.pair_key, None) or item.pop(self.alt_pair_key, None)
-                    ev_type = item.pop("ev", None)
-
-                    try:
-                        trade_pair = trade_pair.translate(str.maketrans('', '', '-/'))
-                        if not 'A' in ev_type:
-                            set_quotes(trade_pair, item , format= True  if self.alt_pair_key == 'p' else False)
-                        else:
-                            set_live_price(trade_pair, item)
-                    except Exception as e:
-                        print(f"Failed to add to Redis: {e}")
+                self.handle_message(message)
             except Exception as e:
-                print("WebSocket connection closed. Reconnecting...")
-                await self.close()
-                await asyncio.sleep(self.reconnect_interval)
-                await self.listen_for_prices_multiple()
+                logger.error(f"Failed to handle a {self.asset_type} frame: {e}")
+
+    def pair_name(self, pair: str) -> str:
+        """
+        trade pair of a polygon pair or symbol, EUR/USD and BTC-USD become EURUSD and BTCUSD
+        """
+        name = self.pair_names.get(pair)
+        if name is None:
+            name = self.pair_names[pair] = pair.translate(PAIR_TRANSLATION)
+        return name
+
+    def handle_message(self, message) -> int:
+        """
+        Queue the quotes and aggregates of a polygon frame for redis, returns the number of ticks
+        """
+        ticks = 0
+        timestamp = None
+        for item in loads(message):
+            ev_type = item.get("ev")
+            if ev_type not in TICK_EVENTS:
+                print(f"Skipping non-CAS event: {item}")
+                continue
 
+            try:
+                trade_pair = self.pair_name(item.get(self.pair_key) or item.get(self.alt_pair_key))
+                # every field is kept, the /ws/delta clients get the quotes and aggregates as polygon sends them
+                tick = {k: v for k, v in item.items() if k not in self.dropped_keys}
+                if ev_type in QUOTE_EVENTS:
+                    # forex quotes carry the bid and ask as b and a
+                    if "bp" not in tick:
+                        tick["bp"], tick["ap"] = tick.get("b"), tick.get("a")
+                    timestamp = tick.get("t")
+                    quote_writer.put(REDIS_LIVE_QUOTES_TABLE, trade_pair, tick, self.asset_type)
+                    trigger_dispatcher.on_quote(trade_pair, tick["bp"], tick["ap"])
+                else:
+                    quote_writer.put(REDIS_LIVE_PRICES_TABLE, trade_pair, tick, self.asset_type)
+                ticks += 1
+            except Exception as e:
+                print(f"Failed to add to Redis: {e}")
+
+        if ticks:
+            self.last_tick_at = time.time()
+            if timestamp:
+                self.last_tick_lag = self.last_tick_at - timestamp / 1000
+        return ticks
 
     async def submit_trade(self, trader_id, trade_pair, order_type, leverage):
-        signal_api_url = SIGNAL_API_BASE_URL.format(id=trader_id)
-        params = {
-            "api_key": SIGNAL_API_KEY,
-            "trade_pair": trade_pair,
-            "order_type": order_type,
-            "leverage": leverage
-        }
-        print("SIGNAL API REQUEST", params)
-        async with aiohttp.ClientSession() as session:
-            async with throttler:
-                async with session.post(signal_api_url, json=params) as response:
-                    print("SIGNAL API RESPONSE", response)
-                    response_text = await response.text()
-                    print("SIGNAL API RESPONSE TEXT", response_text)
-                    logger.info(f"Submit trade signal sent. Response: {response_text}")
-                    return response.status == 200
+        return await signal_dispatcher.send(trader_id, trade_pair, order_type, leverage)
 
     async def close(self):
         if self.websocket:
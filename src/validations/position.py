@@ -5,7 +5,7 @@ from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.tournament_service import get_tournament
-from src.services.user_service import get_challenge
+from src.services.user_service import get_challenge_async
 from src.utils.constants import *
 from src.utils.logging import setup_logging
 
@@ -73,7 +73,7 @@ def validate_leverage(asset_type, leverage):
 
 
 async def check_get_challenge(db: AsyncSession, position_data):
-    challenge = get_challenge(position_data.trader_id)
+    challenge = await get_challenge_async(db, position_data.trader_id)
 
 
     if not challenge.tournament_id:
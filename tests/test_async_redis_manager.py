@@ -0,0 +1,49 @@
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from src.utils import async_redis_manager
+
+
+@pytest.mark.asyncio
+async def test_bulk_helpers_use_one_round_trip():
+    pipeline = MagicMock()
+    pipeline.execute = AsyncMock(return_value=[{"BTCUSD": "{}"}, {}])
+    client = MagicMock(pipeline=MagicMock(return_value=pipeline), lpush=AsyncMock(), hset=AsyncMock())
+
+    with patch.object(async_redis_manager, "async_redis_client", client):
+        prices, quotes = await async_redis_manager.get_many_hash_values("polygon_prices", "polygon_quotes")
+        await async_redis_manager.set_many_hash_values({"positions": {"BTCUSD-1": [1]}, "sl_positions": {}})
+        await async_redis_manager.push_many_to_redis_queue(["a", "b"], "errors")
+        await async_redis_manager.push_many_to_redis_queue([], "errors")
+
+    assert prices == {"BTCUSD": "{}"} and quotes == {}
+    assert pipeline.execute.await_count == 2
+    pipeline.hset.assert_called_once_with("positions", mapping={"BTCUSD-1": json.dumps([1])})
+    client.lpush.assert_awaited_once_with("errors", "a", "b")
+
+
+@pytest.mark.asyncio
+async def test_quotes_of_a_disconnected_feed_are_stale():
+    status = {"forex:connected": "0", "crypto:connected": "1"}
+    client = MagicMock(hgetall=AsyncMock(return_value=status))
+    with patch.object(async_redis_manager, "async_redis_client", client):
+        assert await async_redis_manager.is_quote_stale("EURUSD")
+        assert not await async_redis_manager.is_quote_stale("BTCUSD")
+
+
+@pytest.mark.asyncio
+async def test_published_writes_reach_the_delta_broadcast():
+    pipeline = MagicMock(execute=AsyncMock())
+    client = MagicMock(pipeline=MagicMock(return_value=pipeline))
+    with patch.object(async_redis_manager, "async_redis_client", client):
+        await async_redis_manager.set_hash_value("BTCUSD-1", [1], publish=True)
+        await async_redis_manager.delete_hash_value("BTCUSD-1", publish=True)
+
+    published = [json.loads(call.args[1]) for call in pipeline.publish.call_args_list]
+    assert published == [
+        {"set": {"positions": {"BTCUSD-1": [1]}}, "delete": {}},
+        {"set": {}, "delete": {"positions": ["BTCUSD-1"]}},
+    ]
+    assert pipeline.execute.await_count == 2
@@ -0,0 +1,253 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from src.api.routes.websocket import ConnectionManager
+from src.services import delta_leader as module
+from src.services.delta_leader import DeltaLeader
+from src.utils.constants import POSITIONS_TABLE, REDIS_LIVE_QUOTES_TABLE
+from src.utils.delta_encoding import decode
+
+
+HASHES = [
+    {"BTCUSD": json.dumps({"c": 100}), "ETHUSD": json.dumps({"c": 10})},
+    {"BTCUSD": json.dumps({"bp": 99, "ap": 101, "bs": 1.5, "x": 1, "t": 1735732800123})},
+    # the time is the str(datetime.now()) the position writers store
+    {"BTCUSD-4040": json.dumps(["2025-01-01 12:00:00.123456", 100.0, 1.5, 1.6, 0, 0, "uuid", "hk", 1, 100.0, False]),
+     "ETHUSD-4041": json.dumps(["2025-01-01 13:30:00", 10.0, 0.5, 0.6, 0, 0, "uuid", "hk", 1, 10.0, False])},
+    {},
+]
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(message))
+
+    async def send_bytes(self, message):
+        self.sent.append(decode(message))
+
+
+async def connect(manager, *sockets, encoding="json"):
+    with patch.object(manager, "run", AsyncMock()):
+        for socket in sockets:
+            await manager.connect(socket, encoding)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def publish(leader, kind, data, *managers):
+    """
+    the frame as the managers get it from DELTA_FRAMES_CHANNEL
+    """
+    leader.seq += 1
+    frame = json.dumps({"leader": leader.owner, "seq": leader.seq, "type": kind, **data})
+    return [manager.receive(json.loads(frame)) for manager in managers]
+
+
+async def leading(hashes=HASHES, *managers):
+    leader = DeltaLeader()
+    with patch.object(module, "get_many_hash_values", AsyncMock(return_value=hashes)):
+        await leader.resync()
+    publish(leader, "snapshot", leader.snapshot(), *managers)
+    return leader
+
+
+@pytest.mark.asyncio
+async def test_snapshot_on_join_then_only_changes():
+    manager = ConnectionManager()
+    hashes = list(HASHES)
+    socket = FakeSocket()
+    await connect(manager, socket)
+    leader = await leading(hashes, manager)
+    manager.admit()
+    await settle()
+    snapshots = {message["type"]: message["data"] for message in socket.sent}
+    assert set(snapshots) == {"prices", "positions"}
+    assert snapshots["prices"]["BTCUSD"] == {"c": 100, "bp": 99, "ap": 101, "bs": 1.5, "x": 1, "t": 1735732800123}
+    assert snapshots["positions"]["4040"]["BTCUSD"]["profit_loss"] == 1.5
+
+    socket.sent.clear()
+    leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"ETHUSD": {"bp": 9, "ap": 11}}}, "delete": {}})
+    leader.apply({"set": {}, "delete": {POSITIONS_TABLE: ["BTCUSD-4040"]}})
+    publish(leader, "delta", leader.delta(), manager)
+    await settle()
+    assert socket.sent == [
+        {"type": "prices_update", "data": {"ETHUSD": {"c": 10, "bp": 9, "ap": 11}}},
+        {"type": "positions_update", "data": {"4040": {"BTCUSD": None}}},
+    ]
+    assert leader.delta() == {"prices": {}, "positions": {}}
+
+    # writes that were not published are found by the resync
+    hashes[0] = {**hashes[0], "SOLUSD": json.dumps({"c": 1})}
+    hashes[1] = {**hashes[1], "ETHUSD": json.dumps({"bp": 9, "ap": 11})}
+    hashes[2] = {"ETHUSD-4041": HASHES[2]["ETHUSD-4041"]}
+    socket.sent.clear()
+    with patch.object(module, "get_many_hash_values", AsyncMock(return_value=hashes)):
+        await leader.resync()
+    publish(leader, "delta", leader.delta(), manager)
+    await settle()
+    assert socket.sent == [{"type": "prices_update", "data": {"SOLUSD": {"c": 1}}}]
+    assert "SOLUSD" in json.loads(manager.snapshot("prices"))["data"]
+    manager.disconnect(socket)
+
+
+@pytest.mark.asyncio
+async def test_changes_only_reach_the_subscribers_of_their_topics():
+    manager = ConnectionManager()
+    trader, watcher, everyone = FakeSocket(), FakeSocket(), FakeSocket()
+    await connect(manager, trader, watcher, everyone)
+    leader = await leading(HASHES, manager)
+    manager.admit()
+    await settle()
+    for socket in (trader, watcher, everyone):
+        socket.sent.clear()
+
+    await manager.handle(trader, json.dumps({"action": "subscribe", "trader_ids": [4040]}))
+    await manager.handle(watcher, json.dumps({"action": "subscribe", "trade_pairs": ["ETHUSD"]}))
+    await manager.handle(watcher, "not json")
+    await settle()
+    assert trader.sent == [
+        {"type": "positions", "data": {"4040": {"BTCUSD": {
+            "time": "2025-01-01 12:00:00.123456", "entry_price": 100.0, "profit_loss": 1.5,
+            "profit_loss_without_fee": 1.6, "is_closed": False, "stop_loss": 0}}}},
+        {"type": "subscriptions", "topics": ["positions:4040"]},
+    ]
+    assert watcher.sent[-2] == {"type": "subscriptions", "topics": ["prices:ETHUSD"]}
+    assert watcher.sent[-1]["type"] == "error"
+    for socket in (trader, watcher):
+        socket.sent.clear()
+
+    leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"BTCUSD": {"bp": 98, "ap": 100}}}, "delete": {}})
+    leader.apply({"set": {}, "delete": {POSITIONS_TABLE: ["ETHUSD-4041"]}})
+    publish(leader, "delta", leader.delta(), manager)
+    await settle()
+    assert trader.sent == []
+    assert watcher.sent == []
+    assert [message["type"] for message in everyone.sent] == ["prices_update", "positions_update"]
+
+    leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"ETHUSD": {"bp": 9, "ap": 11}}}, "delete": {}})
+    leader.apply({"set": {}, "delete": {POSITIONS_TABLE: ["BTCUSD-4040"]}})
+    publish(leader, "delta", leader.delta(), manager)
+    await settle()
+    assert trader.sent == [{"type": "positions_update", "data": {"4040": {"BTCUSD": None}}}]
+    assert watcher.sent == [{"type": "prices_update", "data": {"ETHUSD": {"c": 10, "bp": 9, "ap": 11}}}]
+
+    for socket in (trader, watcher, everyone):
+        manager.disconnect(socket)
+    assert not manager.topics
+
+
+@pytest.mark.asyncio
+async def test_a_slow_client_is_resynced_without_delaying_the_others():
+    manager = ConnectionManager()
+    slow, fast = FakeSocket(delay=0.05), FakeSocket()
+    await connect(manager, slow, fast)
+    manager.clients[slow].max_queue = 2
+    leader = await leading(HASHES, manager)
+    manager.admit()
+    await settle()
+
+    for i in range(5):
+        leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"BTCUSD": {"bp": i, "ap": i + 2}}}, "delete": {}})
+        publish(leader, "delta", leader.delta(), manager)
+    await asyncio.sleep(0.01)
+    assert [message["data"]["BTCUSD"]["bp"] for message in fast.sent[2:]] == [0, 1, 2, 3, 4]
+    assert len(slow.sent) < 2
+
+    await asyncio.sleep(0.5)
+    stats = manager.clients[slow].stats()
+    assert stats["dropped"] > 0 and stats["resyncs"] == 2 and stats["queued"] == 0
+    # the last thing the slow client got is a snapshot with the latest quote
+    assert slow.sent[-2]["type"] == "prices" and slow.sent[-2]["data"]["BTCUSD"]["bp"] == 4
+    assert manager.stats()["connections"] == 2
+    for socket in (slow, fast):
+        manager.disconnect(socket)
+
+
+@pytest.mark.asyncio
+async def test_workers_relay_the_frames_of_one_leader_and_recover_missed_ones():
+    first, second = ConnectionManager(), ConnectionManager()
+    a, b = FakeSocket(), FakeSocket()
+    await connect(first, a)
+    await connect(second, b)
+    hashes = AsyncMock(return_value=HASHES)
+    leader = DeltaLeader()
+    with patch.object(module, "get_many_hash_values", hashes):
+        await leader.resync()
+    # a delta before the first snapshot is not relayed
+    assert publish(leader, "delta", {"prices": {}, "positions": {}}, first, second) == [False, False]
+    publish(leader, "snapshot", leader.snapshot(), first, second)
+    for manager in (first, second):
+        manager.admit()
+    await settle()
+    assert a.sent == b.sent and len(a.sent) == 2
+    assert hashes.await_count == 1
+
+    # the second worker misses a frame, it gets fresh snapshots from the next snapshot frame
+    a.sent.clear(), b.sent.clear()
+    leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"BTCUSD": {"bp": 1, "ap": 2}}}, "delete": {}})
+    publish(leader, "delta", leader.delta(), first)
+    leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"ETHUSD": {"bp": 3, "ap": 4}}}, "delete": {}})
+    assert publish(leader, "delta", leader.delta(), first, second) == [True, False]
+    assert not second.synced
+    publish(leader, "snapshot", leader.snapshot(), first, second)
+    await settle()
+    # in sync, the first worker only gets what changed since its last frame: nothing
+    assert [message["type"] for message in a.sent] == ["prices_update", "prices_update"]
+    assert [message["type"] for message in b.sent] == ["prices", "positions"]
+    assert b.sent[0]["data"]["BTCUSD"]["bp"] == 1 and b.sent[0]["data"]["ETHUSD"]["bp"] == 3
+    for manager, socket in ((first, a), (second, b)):
+        manager.disconnect(socket)
+
+
+@pytest.mark.asyncio
+async def test_compact_clients_get_only_the_changed_cells():
+    pytest.importorskip("msgpack")
+    manager = ConnectionManager()
+    compact, plain = FakeSocket(), FakeSocket()
+    await connect(manager, compact, encoding="compact")
+    await connect(manager, plain)
+    leader = await leading(HASHES, manager)
+    manager.admit()
+    await settle()
+    # the snapshots hold the same values in both encodings
+    assert compact.sent == plain.sent
+
+    compact.sent.clear(), plain.sent.clear()
+    quote = {"bp": 98.25, "ap": 101, "bs": 2.5, "x": 1, "t": 1735732800456}
+    position = ["2025-01-01 12:00:05.500000", 100.0, 1.25, 1.6, 0, 0, "uuid", "hk", 2, 100.0, False]
+    leader.apply({"set": {REDIS_LIVE_QUOTES_TABLE: {"BTCUSD": quote}, POSITIONS_TABLE: {"BTCUSD-4040": position}},
+                  "delete": {}})
+    leader.apply({"set": {}, "delete": {POSITIONS_TABLE: ["ETHUSD-4041"]}})
+    publish(leader, "delta", leader.delta(), manager)
+    await settle()
+    assert compact.sent == [
+        {"type": "prices_update", "data": {"BTCUSD": {"bp": 98.25, "bs": 2.5, "t": 1735732800456}}},
+        {"type": "positions_update", "data": {
+            "4040": {"BTCUSD": {"time": "2025-01-01 12:00:05.500000", "profit_loss": 1.25}},
+            "4041": {"ETHUSD": None}}},
+    ]
+    assert plain.sent[0]["data"]["BTCUSD"] == {"c": 100, **quote}
+    assert plain.sent[1]["data"]["4040"]["BTCUSD"]["time"] == "2025-01-01 12:00:05.500000"
+    assert manager.clients[compact].stats()["encoding"] == "compact"
+
+    unknown = FakeSocket()
+    await connect(manager, unknown, encoding="xml")
+    await settle()
+    assert manager.clients[unknown].encoding == "json" and unknown.sent[0]["type"] == "error"
+    for socket in (compact, plain, unknown):
+        manager.disconnect(socket)
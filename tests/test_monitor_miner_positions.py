@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock, patch
+
+import src.core.celery_app  # noqa: F401 task modules import each other, load them through the app
+from src.tasks.monitor_miner_positions import PositionChanges
+from src.utils import redis_manager
+
+
+def test_last_change_of_a_key_wins():
+    changes = PositionChanges()
+    changes.set("BTCUSD-1", [1], "a")
+    changes.delete("BTCUSD-1")
+    changes.set("ETHUSD-1", [2], "b")
+    changes.delete("ETHUSD-1")
+    changes.set("ETHUSD-1", [3], "c")
+
+    assert changes.values == {"ETHUSD-1": [3]}
+    assert changes.deletes == {"BTCUSD-1"}
+
+
+def test_only_changed_positions_are_written():
+    reads, writes = MagicMock(), MagicMock()
+    reads.execute.return_value = [["BTCUSD-1", "ETHUSD-1", "old-1"], {"BTCUSD-1": "a", "ETHUSD-1": "b", "old-1": "x"}]
+    client = MagicMock()
+    client.pipeline.side_effect = [reads, writes]
+
+    with patch.object(redis_manager, "redis_client", client):
+        written, deleted = redis_manager.update_positions_diff(
+            {"BTCUSD-1": [1], "ETHUSD-1": [2], "SOLUSD-1": [3]},
+            {"BTCUSD-1": "a", "ETHUSD-1": "changed", "SOLUSD-1": "c"},
+            deletes={"old-1", "gone-1"},
+        )
+
+    assert (written, deleted) == (2, 1)
+    positions = writes.hset.call_args_list[0].kwargs["mapping"]
+    assert sorted(positions) == ["ETHUSD-1", "SOLUSD-1"]
+    writes.hdel.assert_any_call(redis_manager.POSITIONS_TABLE, "old-1")
+
+
+def test_hotkey_map_is_reloaded_only_when_its_version_changes():
+    from src.schemas.trader import HotKeyMap
+    from src.services import trade_service
+
+    versions = iter(["1", "1", "2"])
+    db_map = HotKeyMap(data={"hk": {"trader_id": 4}})
+    with patch.object(trade_service, "user_hotkey_map_cache", {"version": None, "data": None, "loaded_at": 0.0}), \
+            patch.object(trade_service, "get_user_hotkey_map_version", side_effect=lambda: next(versions)), \
+            patch.object(trade_service, "get_redis_user_hotkey_map", side_effect=lambda: ("1", None)), \
+            patch.object(trade_service, "set_cached_user_hotkey_map"), \
+            patch.object(trade_service, "get_user_hotkey_map", return_value=db_map) as query:
+        first = trade_service.get_cached_user_hotkey_map(None)
+        first.data["hk"].trader_id = 5
+        second = trade_service.get_cached_user_hotkey_map(None)
+        assert query.call_count == 1
+        assert second.data["hk"].trader_id == 4
+
+        trade_service.get_cached_user_hotkey_map(None)
+        assert query.call_count == 2
+
+
+def test_an_empty_hotkey_map_is_cached():
+    from src.services import trade_service
+
+    db = MagicMock()
+    db.execute.return_value.scalar.return_value = None  # no challenges
+    with patch.object(trade_service, "user_hotkey_map_cache", {"version": None, "data": None, "loaded_at": 0.0}), \
+            patch.object(trade_service, "get_user_hotkey_map_version", return_value="1"), \
+            patch.object(trade_service, "get_redis_user_hotkey_map", return_value=("1", None)), \
+            patch.object(trade_service, "set_cached_user_hotkey_map"):
+        assert trade_service.get_cached_user_hotkey_map(db).data == {}
+        assert trade_service.get_cached_user_hotkey_map(db).data == {}
+    assert db.execute.call_count == 1
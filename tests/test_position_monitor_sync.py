@@ -0,0 +1,108 @@
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import src.models.notifications  # noqa: F401 registers Notification for the FirebaseUser mapper
+from src.models.transaction import Status
+from src.tasks import position_monitor_sync as module
+
+
+class Leases:
+    """
+    the MONITOR_LEASE_PREFIX keys, claimed with SET NX, extended and released by their owner,
+    they expire when `clock` passes their ttl
+    """
+
+    def __init__(self):
+        self.owners = {}
+        self.expires = {}
+        self.clock = 0.0
+        self.renewed = threading.Event()
+
+    def held(self, id_, owner=None):
+        return id_ in self.owners and self.expires[id_] > self.clock and owner in (None, self.owners[id_])
+
+    def acquire(self, ids, owner, ttl):
+        claimed = [id_ for id_ in ids if not self.held(id_)]
+        self.owners.update({id_: owner for id_ in claimed})
+        self.expires.update({id_: self.clock + ttl for id_ in claimed})
+        return claimed
+
+    def renew(self, ids, owner, ttl):
+        renewed = [id_ for id_ in ids if self.held(id_, owner)]
+        self.expires.update({id_: self.clock + ttl for id_ in renewed})
+        self.renewed.set()
+        return len(renewed)
+
+    def release(self, ids, owner):
+        for id_ in ids:
+            if self.owners.get(id_) == owner:
+                del self.owners[id_]
+
+
+def test_overlapping_evaluations_act_on_a_position_once():
+    rows = {1: Status.open}
+
+    def pending(db, order_ids=None, **kwargs):
+        return [SimpleNamespace(order_id=order_id, status=status) for order_id, status in rows.items()
+                if status == Status.open and (order_ids is None or order_id in order_ids)]
+
+    acted = []
+
+    def close(db, positions):
+        acted.append([position.order_id for position in positions])
+        # a triggered evaluation starting while the shard pass holds the lease
+        assert module.evaluate_leased_positions(db, pending(db)) == (None, None)
+        for position in positions:
+            rows[position.order_id] = Status.close
+        return None, None
+
+    leases = Leases()
+    with patch.object(module, "acquire_leases", leases.acquire), \
+            patch.object(module, "renew_leases", leases.renew), \
+            patch.object(module, "release_leases", leases.release), \
+            patch.object(module, "get_SLTP_pending_positions", pending), \
+            patch.object(module, "evaluate_and_dispatch", close):
+        # loaded while the row is open, evaluated after the shard pass closed it and released its lease
+        stale = pending(MagicMock())
+        module.evaluate_leased_positions(MagicMock(), pending(MagicMock()))
+        module.evaluate_leased_positions(MagicMock(), stale)
+
+    assert acted == [[1]]
+    assert leases.owners == {}
+
+
+def test_the_leases_outlive_a_long_pass():
+    rows = {1: Status.open}
+
+    def pending(db, order_ids=None, **kwargs):
+        return [SimpleNamespace(order_id=order_id, status=status) for order_id, status in rows.items()
+                if status == Status.open and (order_ids is None or order_id in order_ids)]
+
+    acted = []
+    leases = Leases()
+
+    def close(db, positions):
+        acted.append([position.order_id for position in positions])
+        if len(acted) > 1:
+            return None, None
+        # signals throttled for three lease lifetimes, the renewal keeps the lease
+        for _ in range(6):
+            leases.renewed.clear()
+            leases.clock += module.MONITOR_LEASE_SECONDS / 2
+            leases.renewed.wait(timeout=1)
+        module.evaluate_leased_positions(db, pending(db))
+        for position in positions:
+            rows[position.order_id] = Status.close
+        return None, None
+
+    with patch.object(module, "MONITOR_LEASE_SECONDS", 0.03), \
+            patch.object(module, "acquire_leases", leases.acquire), \
+            patch.object(module, "renew_leases", leases.renew), \
+            patch.object(module, "release_leases", leases.release), \
+            patch.object(module, "get_SLTP_pending_positions", pending), \
+            patch.object(module, "evaluate_and_dispatch", close):
+        module.evaluate_leased_positions(MagicMock(), pending(MagicMock()))
+
+    assert acted == [[1]]
+    assert leases.owners == {}
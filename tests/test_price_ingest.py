@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from src import price_ingest
+from src.price_ingest import LostIngestLock, PriceIngest
+from src.utils.websocket_manager import CryptoWebSocketManager
+
+
+@pytest.mark.asyncio
+async def test_ingest_stands_by_until_it_holds_the_lock():
+    ingest = PriceIngest([], lock_seconds=0.03)
+    acquire = AsyncMock(side_effect=[False, False, True])
+    with patch.object(price_ingest, "acquire_lock", acquire):
+        await asyncio.wait_for(ingest.acquire(), 1)
+    assert acquire.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_stops_when_the_lock_is_lost():
+    manager = CryptoWebSocketManager()
+    ingest = PriceIngest([manager], health_interval=0.01)
+    hset = AsyncMock()
+    with patch.object(price_ingest, "renew_lock", AsyncMock(side_effect=[True, False])), \
+            patch.object(price_ingest.async_redis_client, "hset", hset):
+        with pytest.raises(LostIngestLock):
+            await asyncio.wait_for(ingest.keep_alive(), 1)
+
+    health = hset.await_args.kwargs["mapping"]
+    assert health["owner"] == ingest.owner
+    assert health["crypto:idle"] == -1
+
+
+@pytest.mark.asyncio
+async def test_no_tick_is_written_after_the_lock_is_lost():
+    events = []
+    writer = MagicMock(put=MagicMock(side_effect=lambda *args: events.append("put")),
+                       close=AsyncMock(side_effect=lambda: events.append("close")))
+
+    async def listen():
+        while True:
+            writer.put("polygon_quotes", "BTCUSD", {"bp": 1}, "crypto")
+            await asyncio.sleep(0.001)
+
+    async def keep_alive():
+        await asyncio.sleep(0.02)
+        raise LostIngestLock("lost")
+
+    ingest = PriceIngest([SimpleNamespace(listen_for_prices_multiple=listen)])
+    with patch.object(price_ingest, "quote_writer", writer), \
+            patch.object(price_ingest, "acquire_lock", AsyncMock(return_value=True)), \
+            patch.object(price_ingest, "release_lock", AsyncMock()), \
+            patch.object(price_ingest, "SessionLocal", MagicMock()), \
+            patch.object(price_ingest.trigger_dispatcher, "rebuild", AsyncMock()), \
+            patch.object(price_ingest.trigger_dispatcher, "start"), \
+            patch.object(ingest, "keep_alive", keep_alive):
+        with pytest.raises(LostIngestLock):
+            await asyncio.wait_for(ingest.run(), 1)
+        await asyncio.sleep(0.02)
+
+    assert "put" in events and events[-1] == "close"
+    assert writer.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_only_prod_listens_to_polygon():
+    run = AsyncMock()
+    with patch.dict(price_ingest.os.environ, {"ENVIRONMENT": "dev"}), \
+            patch.object(PriceIngest, "run", run), \
+            patch.object(price_ingest, "close_async_redis", AsyncMock()):
+        main = asyncio.create_task(price_ingest.main())
+        await asyncio.sleep(0.05)
+        assert not main.done()
+        main.cancel()
+        await asyncio.gather(main, return_exceptions=True)
+    run.assert_not_called()
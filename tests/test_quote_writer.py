@@ -0,0 +1,70 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from src.utils import quote_writer as module
+from src.utils.quote_writer import QuoteWriter
+
+
+@pytest.mark.asyncio
+async def test_ticks_are_coalesced_per_trade_pair():
+    write = AsyncMock()
+    with patch.object(module, "set_many_hash_values", write):
+        writer = QuoteWriter(interval=0.01)
+        for price in range(100):
+            writer.put("polygon_quotes", "BTCUSD", {"bp": price}, "crypto")
+        writer.put("polygon_quotes", "ETHUSD", {"bp": 1}, "crypto")
+        writer.put("polygon_prices", "EURUSD", {"c": 1}, "forex")
+        await asyncio.sleep(0.05)
+        await writer.close()
+
+    write.assert_awaited_once()
+    written = write.await_args.args[0]
+    assert written["polygon_quotes"] == {"BTCUSD": {"bp": 99}, "ETHUSD": {"bp": 1}}
+    assert written["polygon_prices"] == {"EURUSD": {"c": 1}}
+    assert sorted(written["price_feed_status"]) == ["crypto:last_tick", "forex:last_tick"]
+    assert writer.received == {"crypto": 101, "forex": 1}
+    assert writer.written == {"crypto": 2, "forex": 1}
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_without_overwriting_newer_ticks():
+    write = AsyncMock(side_effect=[ConnectionError, None])
+    with patch.object(module, "set_many_hash_values", write):
+        writer = QuoteWriter(interval=0.01)
+        writer.put("polygon_quotes", "BTCUSD", {"bp": 1}, "crypto")
+        writer.put("polygon_quotes", "ETHUSD", {"bp": 1}, "crypto")
+        await writer.flush()
+        writer.put("polygon_quotes", "BTCUSD", {"bp": 2}, "crypto")
+        await writer.close()
+
+    assert write.await_args.args[0]["polygon_quotes"] == {"BTCUSD": {"bp": 2}, "ETHUSD": {"bp": 1}}
+
+
+@pytest.mark.asyncio
+async def test_an_outage_backs_off_and_logs_once():
+    write = AsyncMock(side_effect=ConnectionError)
+    sleep, delays = asyncio.sleep, []
+
+    async def recorded_sleep(delay):
+        delays.append(delay)
+        if len(delays) == 6:
+            write.side_effect = None
+        await sleep(0)
+
+    with patch.object(module, "set_many_hash_values", write), patch.object(module, "logger") as logger, \
+            patch.object(module.asyncio, "sleep", recorded_sleep):
+        writer = QuoteWriter(interval=0.01, max_backoff=0.08)
+        writer.put("polygon_quotes", "BTCUSD", {"bp": 1}, "crypto")
+        for _ in range(100):
+            if writer.written:
+                break
+            await sleep(0)
+        await writer.close()
+
+    # doubled after every failed write up to max_backoff instead of retrying every interval
+    assert delays == pytest.approx([0.01, 0.02, 0.04, 0.08, 0.08, 0.08])
+    assert write.await_count == 6
+    assert logger.error.call_count == 1
+    assert writer.failures == 0 and writer.written == {"crypto": 1}
@@ -0,0 +1,14 @@
+import time
+from unittest.mock import patch
+
+from src.utils import redis_manager
+
+
+def test_feeds_that_went_quiet_make_their_quotes_stale():
+    status = {"crypto:connected": "1", "crypto:last_tick": str(time.time()),
+              "forex:connected": "1", "forex:last_tick": str(time.time() - 120),
+              "stocks:connected": "0"}
+    with patch.object(redis_manager.redis_client, "hgetall", return_value=status):
+        assert redis_manager.get_stale_trade_pairs(["BTCUSD", "EURUSD", "AAPL", "SPX"]) == {"EURUSD", "AAPL"}
+    with patch.object(redis_manager.redis_client, "hgetall", return_value={}):
+        assert not redis_manager.get_stale_trade_pairs(["EURUSD"])
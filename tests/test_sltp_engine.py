@@ -0,0 +1,147 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+import src.models.notifications  # noqa: F401 registers Notification for the FirebaseUser mapper
+from src.models.transaction import OrderType, Status
+from src.services.sltp_engine import build_position_columns, build_redis_columns, evaluate_positions, compute_trigger_prices
+from src.services.trade_service import SLTP_pending_positions_query, TransactionUnitOfWork
+from src.services.trigger_service import TriggerIndex
+from src.utils.redis_manager import PositionsSnapshot
+
+
+def make_position(**kwargs):
+    values = dict(
+        order_id=1,
+        trader_id=1,
+        trade_pair="BTCUSD",
+        status=Status.open,
+        order_type=OrderType.buy,
+        trailing=False,
+        stop_loss=2,
+        cumulative_stop_loss=2,
+        cumulative_take_profit=5,
+        entry_price=1000.0,
+        initial_price=1000.0,
+        limit_order=0.0,
+        cumulative_leverage=1.0,
+        average_entry_price=1000.0,
+    )
+    values.update(kwargs)
+    return SimpleNamespace(**values)
+
+
+def redis_value(profit_loss, price=1000.0, closed=False):
+    return ["2025-01-01", price, profit_loss, profit_loss, 1.0, 1.0, "uuid", "hot_key", 1, price, closed]
+
+
+def evaluate(positions, position_values, bid=1000.0, ask=1000.0):
+    columns = build_position_columns(positions)
+    snapshot = PositionsSnapshot(position_values, [None] * len(positions), {tp: (bid, ask) for tp in columns.trade_pairs})
+    return evaluate_positions(columns, build_redis_columns(columns, snapshot))
+
+
+@pytest.mark.parametrize(
+    "profit_loss, should_close",
+    [
+        pytest.param(-3.0, True, id="stop_loss_hit"),
+        pytest.param(6.0, True, id="take_profit_hit"),
+        pytest.param(1.0, False, id="inside_range"),
+    ]
+)
+def test_close_mask(profit_loss, should_close):
+    decisions = evaluate([make_position()], [redis_value(profit_loss)])
+    assert bool(decisions.close[0]) is should_close
+
+
+def test_missing_and_closed_redis_values_do_not_close():
+    positions = [make_position(), make_position(trader_id=2)]
+    decisions = evaluate(positions, [None, redis_value(-10.0, closed=True)])
+    assert not decisions.close.any()
+    assert decisions.missing.tolist() == [True, False]
+    # reported to the error queue as check_open_position did
+    assert decisions.unusable.tolist() == [False, True]
+
+
+def test_trailing_stop_loss_moves_before_close_check():
+    # bid moved 10% above entry, 2% stop loss becomes 2.2% and a -2.1% loss no longer closes
+    position = make_position(trailing=True, cumulative_stop_loss=2)
+    decisions = evaluate([position], [redis_value(-2.1)], bid=1100.0, ask=1100.0)
+    assert decisions.trail[0]
+    assert decisions.new_stop_loss[0] == pytest.approx(2.2)
+    assert not decisions.close[0]
+
+
+@pytest.mark.parametrize(
+    "order_type, bid, ask, should_open",
+    [
+        pytest.param(OrderType.buy, 990.0, 990.0, True, id="buy_below_limit"),
+        pytest.param(OrderType.buy, 1010.0, 1010.0, False, id="buy_above_limit"),
+        pytest.param(OrderType.sell, 1010.0, 1010.0, True, id="sell_above_limit"),
+        pytest.param(OrderType.sell, 990.0, 990.0, False, id="sell_below_limit"),
+    ]
+)
+def test_pending_fill(order_type, bid, ask, should_open):
+    position = make_position(status=Status.pending, order_type=order_type)
+    decisions = evaluate([position], [None], bid=bid, ask=ask)
+    assert bool(decisions.open[0]) is should_open
+
+
+def test_trailing_limit_moves_and_zero_quotes_are_skipped():
+    position = make_position(status=Status.pending, trailing=True, limit_order=2, entry_price=1020.0)
+    decisions = evaluate([position], [None], bid=990.0, ask=990.0)
+    assert decisions.limit_move[0] and not decisions.open[0]
+
+    decisions = evaluate([position], [None], bid=0.0, ask=0.0)
+    assert decisions.no_quotes[0] and not decisions.open[0] and not decisions.limit_move[0]
+
+
+def test_trigger_prices_are_crossed_by_quotes():
+    positions = [
+        make_position(order_id=1, cumulative_take_profit=10, cumulative_leverage=2),
+        make_position(order_id=2, status=Status.pending, order_type=OrderType.sell, entry_price=1050.0),
+    ]
+    index = TriggerIndex()
+    index.load(compute_trigger_prices(build_position_columns(positions)))
+
+    # 2% stop loss at 2x leverage is a 1% move, 10% take profit a 5% move
+    assert index.crossed("BTCUSD", 995.0, 995.0) == []
+    assert index.crossed("BTCUSD", 989.0, 989.0) == [1]
+    assert index.crossed("BTCUSD", 1050.0, 1050.0) == [1, 2]
+    assert index.crossed("ETHUSD", 1.0, 1.0) == []
+
+
+def test_trigger_index_incremental_updates():
+    index = TriggerIndex()
+    index.load({"BTCUSD": [[1, True, False, 990.0], [2, True, False, 995.0]]})
+
+    index.add(3, "BTCUSD", [[3, True, False, 992.0]])
+    assert sorted(index.crossed("BTCUSD", 991.0, 991.0)) == [2, 3]
+
+    index.add(2, "BTCUSD", [[2, True, False, 980.0]])
+    index.remove(3)
+    assert index.crossed("BTCUSD", 991.0, 991.0) == []
+    assert sorted(index.crossed("BTCUSD", 979.0, 979.0)) == [1, 2]
+
+
+def test_unit_of_work_merges_updates_per_order():
+    uow = TransactionUnitOfWork()
+    uow.stage(1, {"stop_loss": 2.2, "entry_price": 1100.0})
+    uow.stage(1, {"status": Status.close})
+    uow.stage(2, {"status": Status.processing})
+
+    db = MagicMock()
+    uow.flush(db)
+    _, rows = db.execute.call_args.args
+    assert rows == [
+        {"order_id": 1, "stop_loss": 2.2, "entry_price": 1100.0, "status": Status.close},
+        {"order_id": 2, "status": Status.processing},
+    ]
+    db.commit.assert_called_once()
+    assert uow.updates == {}
+
+
+def test_shard_query_partitions_by_trader_id():
+    query = str(SLTP_pending_positions_query(shard=1, shards=4).compile(compile_kwargs={"literal_binds": True}))
+    assert "transactions.trader_id % 4 = 1" in query
+
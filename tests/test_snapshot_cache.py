@@ -0,0 +1,94 @@
+import io
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+from src.services.api_service import PositionsIndex, SnapshotCache
+from src.services.snapshot_stream import decode_main_net, decode_testnet
+
+
+def make_cache(ttl=60.0):
+    cache = SnapshotCache("https://taoshi.test/positions", ttl=ttl)
+    calls = []
+
+    def get(url, headers, stream=False):
+        calls.append(headers)
+        time.sleep(0.05)
+        response = MagicMock()
+        response.status_code = 304 if "If-None-Match" in headers else 200
+        response.json.return_value = {"hot_key": {"positions": []}}
+        response.headers = {"ETag": '"v1"'}
+        response.__enter__.return_value = response
+        return response
+
+    cache.session.get = get
+    return cache, calls
+
+
+def test_concurrent_callers_share_one_download():
+    cache, calls = make_cache()
+    threads = [threading.Thread(target=cache.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert cache.get() == {"hot_key": {"positions": []}}
+
+
+def test_stale_snapshot_is_revalidated_with_etag():
+    cache, calls = make_cache(ttl=0.0)
+    first = cache.get()
+    assert cache.get() is first
+    assert calls[1]["If-None-Match"] == '"v1"'
+
+
+def test_positions_index_lookups():
+    miners = {"hk": {"positions": [
+        {"position_uuid": "a", "trade_pair": ["BTCUSD"], "is_closed_position": True},
+        {"position_uuid": "b", "trade_pair": ["BTCUSD"], "is_closed_position": False},
+    ]}}
+    index = PositionsIndex(miners)
+
+    assert index.get("hk", position_uuid="a", trade_pair="BTCUSD")["position_uuid"] == "a"
+    assert index.get("hk", trade_pair="BTCUSD")["position_uuid"] == "b"
+    assert index.get("hk", trade_pair="ETHUSD") is None
+    assert index.get("other", position_uuid="a") is None
+
+
+def test_derived_values_are_built_once_per_payload():
+    cache, _ = make_cache()
+    builds = []
+    for _ in range(3):
+        cache.derive("index", lambda payload: builds.append(payload) or len(builds))
+    assert len(builds) == 1
+
+
+def position(uuid, trade_pair):
+    return {"position_uuid": uuid, "trade_pair": [trade_pair, "x", 0.1], "orders": [{"price": 1.0}],
+            "is_closed_position": False}
+
+
+def test_streaming_decode_keeps_tracked_hot_keys_only():
+    main_net = {
+        "tracked": {"positions": [position("a", "BTCUSD")], "all_time_returns": 1.1},
+        "other": {"positions": [position("b", "BTCUSD"), position("c", "ETHUSD"), position("d", "BTCUSD")],
+                  "all_time_returns": 0.9},
+    }
+    decoded = decode_main_net(io.BytesIO(json.dumps(main_net).encode()), {"tracked"})
+    assert decoded["tracked"] == main_net["tracked"]
+    assert decoded["other"] == {"all_time_returns": 0.9, "trade_pair_counts": {"BTCUSD": 2, "ETHUSD": 1}}
+
+    checkpoint = {
+        "positions": main_net,
+        "perf_ledgers": {"tracked": {"cps": [{"mdd": 1}]}, "other": {"cps": []}},
+        "eliminations": [{"hotkey": "other"}],
+        "challengeperiod": {"success": {"other": 1}, "testing": {}},
+    }
+    decoded = decode_testnet(io.BytesIO(json.dumps(checkpoint).encode()), {"tracked"})
+    assert decoded["positions"] == {"tracked": main_net["tracked"]}
+    assert decoded["perf_ledgers"] == {"tracked": {"cps": [{"mdd": 1}]}}
+    assert decoded["eliminations"] == checkpoint["eliminations"]
+    assert decoded["challengeperiod"] == checkpoint["challengeperiod"]
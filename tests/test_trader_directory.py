@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import src.models.notifications  # noqa: F401 registers Notification for the FirebaseUser mapper
+from src.services import trader_directory as module
+from src.services.trader_directory import TraderDirectory
+
+
+def challenge(trader_id, hot_key):
+    return SimpleNamespace(id=trader_id, trader_id=trader_id, hot_key=hot_key, challenge="main", active="1",
+                           status="In Challenge", tournament_id=None, user_id=1)
+
+
+class FakePubSub:
+    def __init__(self):
+        self.messages = []
+
+    def get_message(self):
+        return self.messages.pop(0) if self.messages else None
+
+
+def test_lookups_negative_cache_and_published_updates():
+    pubsub = FakePubSub()
+    db = MagicMock()
+    db.scalars.return_value.all.return_value = [challenge(1, "hk1"), challenge(2, "hk2")]
+    db.scalar.return_value = None
+    session = MagicMock()
+    session.return_value.__enter__.return_value = db
+
+    with patch.object(module, "TaskSessionLocal_", session), \
+            patch.object(module, "subscribe_trader_updates", return_value=pubsub):
+        directory = TraderDirectory()
+        assert directory.hot_key(1) == "hk1"
+        assert directory.source(2) == "main"
+
+        assert directory.get(3) is None
+        assert directory.get(3) is None
+        assert db.scalar.call_count == 1
+        assert session.call_count == 2
+
+        db.scalar.return_value = challenge(3, "hk3")
+        pubsub.messages.append({"data": "3"})
+        assert directory.hot_key(3) == "hk3"
+        assert db.scalar.call_count == 2
+
+        pubsub.messages.append({"data": "*"})
+        directory.get(1)
+        assert db.scalars.call_count == 2
+
+
+class FakeAsyncPubSub:
+    def __init__(self):
+        self.messages = asyncio.Queue()
+        self.closed = False
+
+    async def get_message(self, timeout):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_async_lookups_follow_the_updates_without_blocking_calls():
+    db = AsyncMock()
+    db.scalars.return_value = MagicMock(all=MagicMock(return_value=[challenge(1, "hk1")]))
+    db.scalar.return_value = challenge(2, "hk2")
+    pubsub = FakeAsyncPubSub()
+
+    with patch.object(module, "subscribe_trader_updates") as subscribe, \
+            patch.object(module, "subscribe_trader_updates_async", AsyncMock(return_value=pubsub)):
+        directory = TraderDirectory(poll_interval=0.01)
+        directory._lock = MagicMock()
+        await directory.start_updates()
+        assert (await directory.get_async(db, 1)).hot_key == "hk1"
+        assert (await directory.get_async(db, 2)).hot_key == "hk2"
+        assert (await directory.get_async(db, 2)).hot_key == "hk2"
+        assert db.scalars.await_count == 1
+        assert db.scalar.await_count == 1
+
+        db.scalar.return_value = challenge(1, "hk1b")
+        await pubsub.messages.put({"data": "1"})
+        await asyncio.sleep(0.02)
+        assert (await directory.get_async(db, 1)).hot_key == "hk1b"
+        await directory.stop_updates()
+
+    subscribe.assert_not_called()
+    directory._lock.__enter__.assert_not_called()
+    assert pubsub.closed
@@ -0,0 +1,50 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from src.utils import websocket_manager
+from src.utils.websocket_manager import CryptoWebSocketManager, ForexWebSocketManager
+
+
+def test_frames_are_parsed_into_quotes_and_aggregates():
+    manager = ForexWebSocketManager()
+    frame = '[{"ev":"C","p":"EUR/USD","x":48,"a":1.1,"b":1.0,"t":5},' \
+            '{"ev":"CAS","pair":"EUR/USD","o":1,"c":2,"s":3},{"ev":"status","message":"ok"}]'
+    writer = MagicMock()
+    with patch.object(websocket_manager, "quote_writer", writer), \
+            patch.object(websocket_manager.trigger_dispatcher, "on_quote") as on_quote:
+        assert manager.handle_message(frame) == 2
+
+    assert [put.args for put in writer.put.call_args_list] == [
+        ("polygon_quotes", "EURUSD", {"x": 48, "a": 1.1, "b": 1.0, "t": 5, "bp": 1.0, "ap": 1.1}, "forex"),
+        ("polygon_prices", "EURUSD", {"o": 1, "c": 2, "s": 3}, "forex"),
+    ]
+    on_quote.assert_called_once_with("EURUSD", 1.0, 1.1)
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_with_backoff_and_records_the_gap():
+    manager = CryptoWebSocketManager()
+    manager.reconnect_interval = 0.001
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+        if len(sleeps) == 3:
+            raise asyncio.CancelledError
+
+    connected = AsyncMock()
+    with patch.object(manager, "connect", AsyncMock(side_effect=[ConnectionError, ConnectionError, None])), \
+            patch.object(manager, "manage_subscriptions", AsyncMock()), \
+            patch.object(manager, "receive_and_log", AsyncMock(side_effect=ConnectionError)), \
+            patch.object(websocket_manager, "set_feed_connected", connected), \
+            patch.object(websocket_manager, "set_feed_disconnected", AsyncMock()) as disconnected, \
+            patch.object(websocket_manager.asyncio, "sleep", sleep):
+        with pytest.raises(asyncio.CancelledError):
+            await manager.listen_for_prices_multiple()
+
+    assert 0.0005 <= sleeps[0] <= 0.001 and 0.001 <= sleeps[1] <= 0.002 and 0.002 <= sleeps[2] <= 0.004
+    assert disconnected.await_count == 2  # once per lost connection, not per failed attempt
+    feed, gap = connected.await_args.args
+    assert feed == "crypto" and gap >= 0